@@ -1,4 +1,6 @@
 from django.contrib import admin
-from .models import Place
+from .models import Place, PhotoBlob, PhotoDeletion
 
 admin.site.register(Place)
+admin.site.register(PhotoBlob)
+admin.site.register(PhotoDeletion)
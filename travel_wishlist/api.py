@@ -0,0 +1,150 @@
+"""
+A JSON API for places, for clients that would otherwise scrape the HTML pages.
+
+    GET    api/places                  a page of places; ?visited=true|false, ?after/?before cursors, ?per_page
+    POST   api/places                  add a place, from a JSON body like {"name": "Oslo", "visited": false}
+    GET    api/places/<pk>             one place
+    DELETE api/places/<pk>             delete a place
+    POST   api/places/<pk>/visited     mark a place visited
+
+GET requests take ?fields=name,visited,... and only those columns are selected.
+Places are read with QuerySet.values(), so no model instances are made and no
+templates are rendered. Requests are authenticated by the session login, so
+POST and DELETE requests need an X-CSRFToken header. Places are checked for
+ownership as in the HTML views: 403 for another user's place, 404 for no place.
+"""
+
+import json
+from functools import wraps
+from operator import itemgetter
+
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views.decorators.http import require_http_methods
+
+from .forms import NewPlaceForm
+from .models import Place, delete_places
+from .pagination import get_page_size, paginate
+from .views import get_place_or_deny, mark_place_visited, raise_for_missing_place
+
+
+FIELDS = ('pk', 'name', 'visited', 'notes', 'date_visited', 'photo', 'updated_at')
+LIST_FIELDS = ('pk', 'name', 'visited')
+MAX_PER_PAGE = 200
+
+
+class BadRequest(Exception):
+    pass
+
+
+def api_view(view):
+    """ Answer with JSON errors instead of redirects and HTML error pages. """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Log in to use the API.'}, status=401)
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        except PermissionDenied:
+            return JsonResponse({'error': 'This place belongs to another user.'}, status=403)
+        except Http404:
+            return JsonResponse({'error': 'No such place.'}, status=404)
+    return wrapper
+
+
+def requested_fields(request, default=FIELDS):
+    """ The fields named in ?fields=, in the order given, or default. """
+    if not request.GET.get('fields'):
+        return default
+    fields = list(dict.fromkeys(field.strip() for field in request.GET['fields'].split(',') if field.strip()))
+    unknown = [field for field in fields if field not in FIELDS]
+    if unknown:
+        raise BadRequest(f'Unknown fields: {", ".join(unknown)}. Choose from {", ".join(FIELDS)}.')
+    return fields
+
+
+def place_json(row, fields):
+    """ The requested fields of a .values() row, with the photo as a URL. """
+    data = {field: row[field] for field in fields}
+    if 'photo' in data:
+        data['photo'] = photo_url(data['photo'])
+    return data
+
+
+def photo_url(name):
+    return Place._meta.get_field('photo').storage.url(name) if name else None
+
+
+def read_json_body(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        raise BadRequest('The request body is not valid JSON.')
+    if not isinstance(data, dict):
+        raise BadRequest('The request body must be a JSON object.')
+    return data
+
+
+@api_view
+@require_http_methods(['GET', 'HEAD', 'POST'])
+def places(request):
+    if request.method == 'POST':
+        return create_place(request)
+
+    fields = requested_fields(request, default=LIST_FIELDS)
+    queryset = Place.objects.filter(user=request.user)
+    visited = request.GET.get('visited')
+    if visited is not None:
+        if visited not in ('true', 'false'):
+            raise BadRequest('visited must be true or false.')
+        queryset = queryset.filter(visited=(visited == 'true'))
+
+    try:
+        per_page = min(int(request.GET.get('per_page') or get_page_size()), MAX_PER_PAGE)
+    except ValueError:
+        raise BadRequest('per_page must be a number.')
+
+    # name and pk are needed for the cursors, even if they weren't asked for
+    rows = queryset.values(*dict.fromkeys([*fields, 'name', 'pk']))
+    page = paginate(rows, after=request.GET.get('after'), before=request.GET.get('before'),
+                    per_page=max(per_page, 1), key=itemgetter('name', 'pk'))
+    return JsonResponse({
+        'places': [place_json(row, fields) for row in page.items],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+def create_place(request):
+    form = NewPlaceForm(read_json_body(request))
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    place = form.save(commit=False)
+    place.user = request.user
+    place.save()
+    row = {field: getattr(place, field) for field in FIELDS}
+    row['photo'] = place.photo.name
+    return JsonResponse(place_json(row, FIELDS), status=201)
+
+
+@api_view
+@require_http_methods(['GET', 'HEAD', 'DELETE'])
+def place(request, place_pk):
+    if request.method == 'DELETE':
+        # One DELETE, with the photo released as in the bulk delete
+        if not delete_places(request.user.pk, [place_pk]):
+            raise_for_missing_place(place_pk)
+        return HttpResponse(status=204)
+
+    fields = requested_fields(request)
+    row = get_place_or_deny(request.user, place_pk, queryset=Place.objects.values(*fields))
+    return JsonResponse(place_json(row, fields))
+
+
+@api_view
+@require_http_methods(['POST'])
+def place_visited(request, place_pk):
+    mark_place_visited(request.user, place_pk)
+    return JsonResponse({'pk': place_pk, 'visited': True})
@@ -1,5 +1,20 @@
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class TravelWishlistConfig(AppConfig):
     name = 'travel_wishlist'
+
+    def ready(self):
+        from .auth import logged_in, logged_out, user_changed
+        from .db import configure_connection
+        from .search import ensure_search_index
+        connection_created.connect(configure_connection)
+        post_migrate.connect(ensure_search_index, sender=self)
+        post_save.connect(user_changed, sender=get_user_model())
+        post_delete.connect(user_changed, sender=get_user_model())
+        user_logged_in.connect(logged_in)
+        user_logged_out.connect(logged_out)
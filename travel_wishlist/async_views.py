@@ -0,0 +1,174 @@
+"""
+Async versions of the views in views.py, served under ASGI (see wishlist/asgi.py).
+
+They read and write places with the async ORM where it has what they need, and
+hand everything that blocks to a thread with sync_to_async: Pillow and photo
+storage, template rendering (templates and context processors may query the
+database lazily), and the model and search functions shared with the sync
+views. The point isn't that any one request gets faster; it's that a request
+waiting on a slow client, or on a thread, doesn't hold a worker while it waits.
+
+The user is loaded with request.auser() and then kept as request.user, so code
+run in a thread finds them already loaded.
+
+The bulk import is database work from start to finish, so it's the sync view,
+which Django runs in a thread.
+"""
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, JsonResponse
+from django.shortcuts import redirect, render
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+
+from . import bulk, views
+from .autocomplete import suggest
+from .conditional import aconditional_get, place_etag, place_last_modified, places_etag, places_last_modified
+from .forms import NewPlaceForm
+from .models import Place, VisitYear, delete_places as delete_user_places, get_place_stats, mark_places_visited
+from .search import search_places
+from .views import import_places, selected_place_pks   # import_places is served as it is
+
+
+async def request_user(request):
+    request.user = await request.auser()
+    return request.user
+
+
+async def aget_place_or_deny(user, place_pk, queryset=None):
+    """ views.get_place_or_deny, with the async ORM. """
+    queryset = Place.objects.all() if queryset is None else queryset
+    place = await queryset.filter(pk=place_pk, user=user).afirst()
+    if place is None:
+        await araise_for_missing_place(place_pk)
+    return place
+
+
+async def araise_for_missing_place(place_pk):
+    if await Place.objects.filter(pk=place_pk).aexists():
+        raise PermissionDenied
+    raise Http404('No Place matches the given query.')
+
+
+async def in_thread(iterable):
+    """ Iterate over iterable, getting each item in a thread, so the queries
+    it makes as it goes don't block the event loop. """
+    iterator = iter(iterable)
+    done = object()
+    while (item := await sync_to_async(next)(iterator, done)) is not done:
+        yield item
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@aconditional_get(places_etag, places_last_modified)
+async def place_list(request):
+    user = await request_user(request)
+    if request.method == 'POST':
+        form = NewPlaceForm(request.POST)
+        place = form.save(commit=False)
+        place.user = user
+        if await sync_to_async(form.is_valid)():
+            await place.asave()
+            return redirect('place_list')
+
+    return await sync_to_async(views.render_wishlist)(request)
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@aconditional_get(places_etag, places_last_modified)
+async def places_visited(request):
+    await request_user(request)
+    return await sync_to_async(views.render_visited)(request)
+
+
+async def amark_place_visited(user, place_pk):
+    """ views.mark_place_visited, with the async ORM. """
+    place = await Place.objects.filter(pk=place_pk, user=user).values('visited', 'date_visited').afirst()
+    if place is None:
+        await araise_for_missing_place(place_pk)
+    if await Place.objects.filter(pk=place_pk, visited=False).aupdate(visited=True, updated_at=timezone.now()):
+        await sync_to_async(views.count_visit)(user.pk, place['date_visited'])
+
+
+@login_required
+async def place_was_visited(request, place_pk):
+    if request.method == 'POST':
+        await amark_place_visited(await request_user(request), place_pk)
+
+    return redirect('place_list')
+
+
+@login_required
+async def delete_place(request, place_pk):
+    place = await aget_place_or_deny(await request_user(request), place_pk)
+    await place.adelete()
+    return redirect('place_list')
+
+
+@login_required
+async def places_were_visited(request):
+    if request.method == 'POST':
+        user = await request_user(request)
+        await sync_to_async(mark_places_visited)(user.pk, selected_place_pks(request))
+
+    return redirect('place_list')
+
+
+@login_required
+async def delete_places(request):
+    if request.method == 'POST':
+        user = await request_user(request)
+        await sync_to_async(delete_user_places)(user.pk, selected_place_pks(request))
+
+    return redirect('place_list')
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@aconditional_get(place_etag, place_last_modified)
+async def place_details(request, place_pk):
+    place = await aget_place_or_deny(await request_user(request), place_pk)
+
+    if request.method == 'POST':
+        # Parsing the upload, checking and re-encoding the photo with Pillow, and
+        # storing it and its resized copies, all block
+        await sync_to_async(views.save_trip_review)(request, place)
+        return redirect('place_details', place_pk=place_pk)
+
+    # Any missing resized copies of the photo are made while rendering
+    return await sync_to_async(views.render_place_details)(request, place)
+
+
+@login_required
+async def export_places(request):
+    export_format = 'csv' if request.GET.get('format') == 'csv' else 'jsonl'
+    places = Place.objects.filter(user=await request_user(request))
+    return views.export_response(in_thread(bulk.export_places(places, export_format)), export_format)
+
+
+@login_required
+async def search(request):
+    user = await request_user(request)
+    query = request.GET.get('q', '').strip()
+    results = await sync_to_async(search_places)(user, query) if query else []
+    return await sync_to_async(render)(request, 'travel_wishlist/search.html', {'query': query, 'results': results})
+
+
+@login_required
+async def travel_stats(request):
+    user = await request_user(request)
+    stats = await sync_to_async(get_place_stats)(user.pk)
+    years = [year async for year in VisitYear.objects.filter(user=user, visits__gt=0).order_by('-year')]
+    counts = {'wishlist': stats.wishlist_count, 'visited': stats.visited_count}
+    return await sync_to_async(render)(request, 'travel_wishlist/stats.html',
+                                       {'stats': stats, 'years': years, 'place_counts': counts})
+
+
+@login_required
+async def place_name_suggestions(request):
+    user = await request_user(request)
+    return JsonResponse({'suggestions': await sync_to_async(suggest)(user.pk, request.GET.get('q', ''))})
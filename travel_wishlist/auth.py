@@ -0,0 +1,174 @@
+"""
+The signed in user, from the cache rather than the database.
+
+Sessions are cached_db: read from the cache, and written to both the cache and
+the database, so a session outlives the cache. That leaves the auth_user
+SELECT that AuthenticationMiddleware makes on every request. CachedUserMiddleware,
+after it, keeps the user in the cache too, for USER_CACHE_SECONDS, so a request
+for a page that's cached and hasn't changed makes one query: the last modified
+time of the places on it.
+
+A cached user is still checked as Django checks one loaded from the database:
+their backend must still be configured, and the session's auth hash must match
+their password, so changing it signs out their other sessions. The cached user
+is deleted when the User is saved or deleted, which covers password changes,
+last_login and is_active, and when they log out. Logging in caches them. Changes made with
+QuerySet.update skip those signals and last until the entry expires.
+
+Those deletions only reach every worker if the workers share the cache, so
+CachedUserMiddleware won't start on a per-process cache, such as LocMemCache,
+for the users or the cached sessions, unless DEBUG is on.
+
+The cache holds pickled sessions and users, and unpickling runs code, so anyone
+who can write to it can sign in as anyone and run code in the app. A file cache
+directory is made private to the user the app runs as, and
+CachedUserMiddleware won't start if it belongs to someone else or others can
+write to it.
+"""
+
+import os
+import stat
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+
+def user_cache():
+    return caches[getattr(settings, 'USER_CACHE_ALIAS', 'default')]
+
+
+def user_cache_seconds():
+    return getattr(settings, 'USER_CACHE_SECONDS', 300)
+
+
+def _user_key(user_id):
+    return f'session-user:{user_id}'
+
+
+def _user_and_session_caches():
+    """ The aliases of the caches holding users, and sessions if they are cached. """
+    aliases = {getattr(settings, 'USER_CACHE_ALIAS', 'default')}
+    if settings.SESSION_ENGINE in ('django.contrib.sessions.backends.cache',
+                                   'django.contrib.sessions.backends.cached_db'):
+        aliases.add(settings.SESSION_CACHE_ALIAS)
+    return sorted(aliases)
+
+
+def process_local_caches():
+    """ The aliases of the caches holding users and sessions that each process
+    keeps to itself. """
+    return [alias for alias in _user_and_session_caches() if isinstance(caches[alias], LocMemCache)]
+
+
+def unsafe_cache_directories():
+    """ The directories of file caches holding users and sessions that another
+    user owns or can write to. Makes any that don't exist yet, private. """
+    unsafe = []
+    for alias in _user_and_session_caches():
+        cache = caches[alias]
+        if not isinstance(cache, FileBasedCache):
+            continue
+        os.makedirs(cache._dir, mode=0o700, exist_ok=True)
+        info = os.stat(cache._dir)
+        if info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            unsafe.append(cache._dir)
+    return unsafe
+
+
+def cached_user(request):
+    """ The user signed in to request.session, from the cache if they're in it,
+    otherwise as django.contrib.auth.get_user loads them, and then cached. """
+    user_id = request.session.get(SESSION_KEY)
+    if user_id is None:
+        return get_user(request)   # anonymous
+
+    user = user_cache().get(_user_key(user_id))
+    if user is not None and _session_matches(request.session, user):
+        return user
+
+    # Not cached, or the session doesn't match the cached user: let Django
+    # decide, which flushes the session if it's no longer valid
+    user = get_user(request)
+    if user.is_authenticated:
+        user_cache().set(_user_key(user.pk), user, user_cache_seconds())
+    return user
+
+
+def _session_matches(session, user):
+    if session.get(BACKEND_SESSION_KEY) not in settings.AUTHENTICATION_BACKENDS:
+        return False
+    session_hash = session.get(HASH_SESSION_KEY)
+    return bool(session_hash) and constant_time_compare(session_hash, user.get_session_auth_hash())
+
+
+async def acached_user(request):
+    # Reading the session, and the user on a cache miss, block
+    if not hasattr(request, '_acached_user'):
+        request._acached_user = await sync_to_async(cached_user)(request)
+    return request._acached_user
+
+
+def forget_user(user_id):
+    user_cache().delete(_user_key(user_id))
+
+
+def user_changed(sender, instance, **kwargs):
+    """ post_save and post_delete receiver for the user model. """
+    forget_user(instance.pk)
+
+
+def logged_in(sender, request, user, **kwargs):
+    """ user_logged_in receiver. Caches the user now, so even the first request
+    after logging in doesn't look them up. """
+    user_cache().set(_user_key(user.pk), user, user_cache_seconds())
+
+
+def logged_out(sender, request, user, **kwargs):
+    """ user_logged_out receiver. """
+    if user is not None:
+        forget_user(user.pk)
+
+
+class CachedUserMiddleware:
+    """ Replace request.user and request.auser, as set by AuthenticationMiddleware,
+    with ones that use the user cache. Goes right after AuthenticationMiddleware. """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        local = process_local_caches()
+        if local and not settings.DEBUG:
+            raise ImproperlyConfigured(
+                f'The {", ".join(local)} cache is per process, so a logout or password change in one '
+                f'worker would leave the others signed in. Use a cache every worker shares.')
+        unsafe = unsafe_cache_directories()
+        if unsafe:
+            raise ImproperlyConfigured(
+                f'{", ".join(unsafe)} holds pickled sessions and users, so it must belong to the user '
+                f'the app runs as, and no one else may write to it.')
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.process_request(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        self.process_request(request)
+        return await self.get_response(request)
+
+    def process_request(self, request):
+        request.user = SimpleLazyObject(lambda: cached_user(request))
+        request.auser = partial(acached_user, request)
@@ -0,0 +1,204 @@
+"""
+Place name suggestions for the add place form, as the user types.
+
+Names come from two sorted indexes, and a prefix lookup is a binary search in
+each, so it costs the same however many names there are:
+
+  The gazetteer, a file of well known place names bundled with the app. Its
+  lines are "key<TAB>name", sorted by key, where the key is the name in
+  lower case without accents (see normalize). The file is memory-mapped once
+  per process and searched in place, so it's never read into memory as a
+  whole, and worker processes share its pages. build_gazetteer makes one
+  from a list of names.
+
+  The user's own place names, a sorted list of (key, name) pairs per user,
+  loaded with one query the first time a user asks for suggestions. Place.save
+  merges new and renamed places into it once their transaction commits. Any
+  other change to the user's places, such as a bulk import or delete, changes
+  their places version (see cache.py), and the list is loaded again on the next
+  lookup.
+"""
+
+import bisect
+import functools
+import mmap
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .cache import get_places_version
+
+
+MAX_SUGGESTIONS = 10
+
+
+def gazetteer_path():
+    return getattr(settings, 'PLACES_GAZETTEER', None)
+
+
+def max_cached_users():
+    return getattr(settings, 'PLACES_AUTOCOMPLETE_USERS', 1000)
+
+
+def normalize(name):
+    """ The key a name is sorted and matched by: lower case, accents removed,
+    and runs of white space, including tabs and new lines, made one space. """
+    decomposed = unicodedata.normalize('NFKD', name)
+    return ' '.join(''.join(char for char in decomposed if not unicodedata.combining(char)).casefold().split())
+
+
+class Gazetteer:
+    """ A sorted file of "key<TAB>name" lines, searched through a read-only memory map. """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            # An empty file can't be mapped, and has nothing to find anyway
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if file.seek(0, 2) else b''
+
+    def _first_line_from(self, prefix):
+        """ The offset of the first line with a key >= prefix. """
+        lo, hi = 0, len(self.map)   # both always at the start of a line
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.map.rfind(b'\n', lo, mid) + 1 or lo
+            end = self.map.find(b'\n', start)
+            if end == -1:
+                end = len(self.map)
+            if self.map[start:self.map.find(b'\t', start, end)] < prefix:
+                lo = end + 1
+            else:
+                hi = start
+        return lo
+
+    def lookup(self, prefix, limit=MAX_SUGGESTIONS):
+        """ Up to limit (key, name) pairs with keys starting with prefix, a normalized string. """
+        prefix = prefix.encode()
+        position = self._first_line_from(prefix)
+        found = []
+        while len(found) < limit and position < len(self.map):
+            end = self.map.find(b'\n', position)
+            if end == -1:
+                end = len(self.map)
+            key, _, name = self.map[position:end].partition(b'\t')
+            if not key.startswith(prefix):
+                break
+            found.append((key.decode(), name.decode()))
+            position = end + 1
+        return found
+
+
+@functools.cache
+def open_gazetteer(path):
+    return Gazetteer(path)
+
+
+def gazetteer():
+    """ The gazetteer named by the PLACES_GAZETTEER setting, or None. """
+    path = gazetteer_path()
+    return open_gazetteer(str(path)) if path else None
+
+
+def write_gazetteer(names, output):
+    """ Write names to the binary file output as a gazetteer, sorted and without
+    repeats. Returns the number of lines written. """
+    entries = set()
+    for name in names:
+        name = ' '.join(name.split())
+        key = normalize(name)
+        if key:
+            entries.add((key.encode(), name.encode()))
+    for key, name in sorted(entries):
+        output.write(key + b'\t' + name + b'\n')
+    return len(entries)
+
+
+class UserNames:
+    """ A user's place names as a sorted list of (key, name) pairs, as of places version. """
+
+    def __init__(self, names, version):
+        self.entries = sorted((normalize(name), name) for name in names)
+        self.version = version
+
+    def add(self, name):
+        bisect.insort(self.entries, (normalize(name), name))
+
+    def remove(self, name):
+        entry = (normalize(name), name)
+        index = bisect.bisect_left(self.entries, entry)
+        if index < len(self.entries) and self.entries[index] == entry:
+            del self.entries[index]
+
+    def lookup(self, prefix, limit=MAX_SUGGESTIONS):
+        found = []
+        for index in range(bisect.bisect_left(self.entries, (prefix,)), len(self.entries)):
+            entry = self.entries[index]
+            if len(found) >= limit or not entry[0].startswith(prefix):
+                break
+            if not found or found[-1][0] != entry[0]:   # the user may have several places with one name
+                found.append(entry)
+        return found
+
+
+# User pk -> UserNames, least recently used first
+_user_names = OrderedDict()
+_lock = threading.Lock()
+
+
+def user_names(user_id):
+    """ The user's UserNames, loaded again if their places changed in a way that
+    wasn't merged in. """
+    version = get_places_version(user_id)
+    with _lock:
+        names = _user_names.get(user_id)
+        if names is not None and names.version == version:
+            _user_names.move_to_end(user_id)
+            return names
+
+    from .models import Place   # models imports this module
+    names = UserNames(Place.objects.filter(user_id=user_id).values_list('name', flat=True), version)
+    with _lock:
+        _user_names[user_id] = names
+        _user_names.move_to_end(user_id)
+        while len(_user_names) > max_cached_users():
+            _user_names.popitem(last=False)
+    return names
+
+
+def place_name_saved(user_id, old_name, new_name):
+    """ Merge a saved place's name into the user's names, if they're loaded.
+    Called by Place.save once the save is committed. old_name is None for a
+    new place. A change another process made to the user's places just
+    before this save can be missed, until their places next change. """
+    with _lock:
+        names = _user_names.get(user_id)
+        if names is None:
+            return
+        if old_name is not None:
+            names.remove(old_name)
+        names.add(new_name)
+        # Saving bumped the version, which would otherwise mean loading them again
+        names.version = get_places_version(user_id)
+
+
+def forget_user_names():
+    with _lock:
+        _user_names.clear()
+
+
+def suggest(user_id, text, limit=MAX_SUGGESTIONS):
+    """ Up to limit names starting with text, as dicts of name and source: the
+    user's own place names first, then gazetteer names the user doesn't have. """
+    prefix = normalize(text)
+    if not prefix:
+        return []
+    suggestions = [{'name': name, 'source': 'place'} for key, name in user_names(user_id).lookup(prefix, limit)]
+    places = gazetteer()
+    if places is not None and len(suggestions) < limit:
+        seen = {normalize(suggestion['name']) for suggestion in suggestions}
+        for key, name in places.lookup(prefix, limit + len(suggestions)):
+            if key not in seen and len(suggestions) < limit:
+                seen.add(key)
+                suggestions.append({'name': name, 'source': 'gazetteer'})
+    return suggestions
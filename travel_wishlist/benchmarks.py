@@ -0,0 +1,110 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks run against a throwaway database built from the migrations, so
+seeding thousands of rows never touches the real db.sqlite3.
+"""
+
+import contextlib
+import math
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+
+from .models import Place
+
+
+@contextlib.contextmanager
+def scratch_database(name=None):
+    """ Create an empty, fully migrated database for the duration of the block.
+    Pass a file name to get an on-disk database, needed when several threads
+    or processes share it; by default SQLite uses an in-memory database. """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    if name:
+        test_settings['NAME'] = name
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+
+
+def seed_places(users=10, places_per_user=1000, visited_ratio=0.5, seed=0, batch_size=5000, notes_words=0):
+    """ Bulk insert users × places_per_user places and return the users.
+    Names are random so the rows don't arrive already sorted. With notes_words,
+    each place gets notes of that many words, see random_notes. """
+    rng = random.Random(seed)
+    created = User.objects.bulk_create(
+        User(username=f'bench-user-{n}', password='!') for n in range(users)
+    )
+    # bulk_create doesn't return primary keys on every backend, so read them back
+    created = list(User.objects.filter(username__in=[u.username for u in created]).order_by('pk'))
+
+    batch = []
+    for user in created:
+        for n in range(places_per_user):
+            name = f'{rng.choice(PLACE_PREFIXES)} {rng.randrange(10 ** 6):06d}'
+            notes = random_notes(rng, notes_words) if notes_words else None
+            batch.append(Place(user=user, name=name, visited=rng.random() < visited_ratio, notes=notes))
+            if len(batch) >= batch_size:
+                Place.objects.bulk_create(batch)
+                batch = []
+    Place.objects.bulk_create(batch)
+    return created
+
+
+def random_notes(rng, words):
+    """ Words mostly from NOTE_WORDS, so some search terms match many places, with
+    one in five from a much longer list of rare words that match only a few. """
+    return ' '.join(rng.choice(NOTE_WORDS) if rng.random() < 0.8 else f'{rng.choice(NOTE_WORDS)}{rng.randrange(10 ** 5)}'
+                    for _ in range(words))
+
+
+def time_calls(fn, repeat):
+    """ Call fn repeat times and return the wall time of each call in seconds. """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, pct):
+    """ Nearest-rank percentile of a list of samples. """
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples):
+    """ Summary statistics, in milliseconds, for a list of timings in seconds. """
+    return {
+        'mean': statistics.fmean(samples) * 1000,
+        'p50': percentile(samples, 50) * 1000,
+        'p95': percentile(samples, 95) * 1000,
+        'p99': percentile(samples, 99) * 1000,
+    }
+
+
+def format_summary(summary):
+    return '  '.join(f'{key} {value:.3f} ms' for key, value in summary.items())
+
+
+PLACE_PREFIXES = [
+    'Aberdeen', 'Bangkok', 'Cairo', 'Denver', 'Edinburgh', 'Florence', 'Glasgow', 'Hanoi',
+    'Istanbul', 'Jaipur', 'Kyoto', 'Lisbon', 'Moab', 'Nairobi', 'Oslo', 'Paris', 'Quito',
+    'Reykjavik', 'Seoul', 'Tokyo', 'Utrecht', 'Valencia', 'Warsaw', 'Yosemite', 'Zanzibar',
+]
+
+NOTE_WORDS = [
+    'beach', 'museum', 'hike', 'food', 'market', 'train', 'castle', 'river', 'sunset', 'temple',
+    'coffee', 'bridge', 'island', 'mountain', 'festival', 'garden', 'harbour', 'cathedral', 'street', 'night',
+    'rain', 'snow', 'ferry', 'lake', 'desert', 'forest', 'gallery', 'tower', 'square', 'palace',
+    'wine', 'noodles', 'bakery', 'waterfall', 'canyon', 'volcano', 'glacier', 'village', 'cliff', 'bay',
+]
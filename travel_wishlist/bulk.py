@@ -0,0 +1,229 @@
+"""
+Streaming bulk import and export of places.
+
+Places are read and written one record at a time, in the shape of
+fixtures/test_places.json: JSON objects, one per line or in a JSON array, or
+CSV with a header row of field names. Imported places are inserted with
+bulk_create, PLACES_IMPORT_BATCH_SIZE at a time, each batch in its own transaction,
+so memory use doesn't grow with the size of the input. If a record is invalid,
+the batches before it stay imported. Exports read places with
+QuerySet.iterator, so they stream too.
+
+An import takes each place's name, visited, notes and date_visited, and its
+user unless the user is given. pk, photo and updated_at are ignored: imported
+places are always new places, and photo files aren't part of an export.
+"""
+
+import codecs
+import csv
+import itertools
+import json
+import os
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from .models import Place, places_changed, stats_changes, update_place_stats
+
+
+FORMATS = ('jsonl', 'csv')
+
+IMPORTED_FIELDS = ('name', 'visited', 'notes', 'date_visited')
+IGNORED_FIELDS = ('photo', 'updated_at')
+EXPORTED_FIELDS = ('user', 'name', 'visited', 'notes', 'date_visited', 'photo', 'updated_at')
+
+READ_SIZE = 64 * 1024
+MAX_RECORD_SIZE = 1024 * 1024   # so a malformed file can't fill memory
+
+_SEPARATORS = re.compile(r'[\s\[\],]*')
+
+
+class PlaceImportError(ValueError):
+    """ An invalid record in an import. imported is the number of places
+    imported, in the batches before the one the record was in. """
+
+    def __init__(self, message, record_number, imported):
+        super().__init__(f'Record {record_number}: {message}')
+        self.record_number = record_number
+        self.imported = imported
+
+
+def import_batch_size():
+    return getattr(settings, 'PLACES_IMPORT_BATCH_SIZE', 1000)
+
+
+def guess_format(name='', content_type=''):
+    """ The import format for a file name or content type, jsonl unless it looks like CSV. """
+    if 'csv' in (content_type or '') or os.path.splitext(name or '')[1].lower() == '.csv':
+        return 'csv'
+    return 'jsonl'
+
+
+def read_records(stream, format='jsonl'):
+    """ The field dicts in a binary stream of UTF-8 JSON or CSV. """
+    text = codecs.getreader('utf-8-sig')(stream)
+    if format == 'csv':
+        return read_csv_records(text)
+    return read_json_records(text)
+
+
+def read_csv_records(text):
+    for row in csv.DictReader(text):
+        if None in row:   # DictReader's key for the values past the last column
+            raise ValidationError('This row has more values than the header.')
+        # CSV has no nulls, so treat an empty column as a missing field
+        yield {field: value for field, value in row.items() if value not in ('', None)}
+
+
+def read_json_records(text):
+    """ Parse JSON objects as they arrive: one per line, or anywhere in between
+    the brackets and commas of a JSON array, as in a fixture file. """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    at_end = False
+    while True:
+        position = _SEPARATORS.match(buffer, position).end()
+        if position < len(buffer):
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if at_end or len(buffer) - position > MAX_RECORD_SIZE:
+                    raise
+                # Probably a record split across reads, so read more and try again
+            else:
+                yield unwrap_record(record)
+                continue
+        elif at_end:
+            return
+
+        chunk = text.read(READ_SIZE)
+        at_end = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def unwrap_record(record):
+    """ The fields of a fixture-style record, or the record itself if it's just the fields. """
+    if not isinstance(record, dict):
+        raise ValidationError('Each record must be a JSON object.')
+    if 'fields' not in record:
+        return record
+    if record.get('model', 'travel_wishlist.place').lower() != 'travel_wishlist.place':
+        raise ValidationError(f'Only travel_wishlist.place records can be imported, not {record["model"]}.')
+    return record['fields']
+
+
+def build_place(fields, user_id=None):
+    """ A validated, unsaved Place from a record's fields. """
+    unknown = set(fields) - set(IMPORTED_FIELDS) - set(IGNORED_FIELDS) - {'user', 'pk', 'model'}
+    if unknown:
+        raise ValidationError(f'Unknown fields: {", ".join(sorted(unknown))}.')
+    if user_id is None:
+        if fields.get('user') is None:
+            raise ValidationError('No user for this place.')
+        user_id = Place._meta.get_field('user').to_python(fields['user'])
+
+    place = Place(user_id=user_id, **{field: fields[field] for field in IMPORTED_FIELDS if field in fields})
+    place.clean_fields(exclude=['user', 'photo', 'updated_at'])   # converts the values, too
+    return place
+
+
+def import_places(records, user=None, batch_size=None):
+    """ Insert a place for each of the records, batch_size at a time. The places
+    belong to user if given, or else to the user in each record.
+    Returns the number of places imported. """
+
+    batch_size = batch_size or import_batch_size()
+    user_id = user.pk if user is not None else None
+    known_users = {user_id}
+    imported = 0
+    batch = []
+    records = iter(records)
+
+    for record_number in itertools.count(1):
+        try:
+            fields = next(records, None)   # parse errors surface here
+            if fields is None:
+                break
+            place = build_place(fields, user_id)
+            if place.user_id not in known_users:
+                if not User.objects.filter(pk=place.user_id).exists():
+                    raise ValidationError(f'No user with pk {place.user_id}.')
+                known_users.add(place.user_id)
+        except (ValidationError, ValueError, csv.Error) as error:
+            raise PlaceImportError(_describe(error), record_number, imported) from error
+
+        batch.append(place)
+        if len(batch) >= batch_size:
+            _insert_batch(batch)
+            imported += len(batch)
+            batch = []
+
+    if batch:
+        _insert_batch(batch)
+        imported += len(batch)
+    return imported
+
+
+def _describe(error):
+    if isinstance(error, ValidationError) and hasattr(error, 'error_dict'):
+        return '; '.join(f'{field}: {" ".join(messages)}' for field, messages in error.message_dict.items())
+    if isinstance(error, ValidationError):
+        return ' '.join(error.messages)
+    return str(error)
+
+
+def _insert_batch(places):
+    with transaction.atomic():
+        Place.objects.bulk_create(places)
+        changes = Counter()
+        for place in places:
+            changes.update(stats_changes(place.user_id, place.visited, place.date_visited))
+        for user_id in {place.user_id for place in places}:
+            places_changed(user_id)
+        update_place_stats(changes)
+
+
+def export_places(queryset, format='jsonl', chunk_size=2000):
+    """ Yield places from queryset as JSON lines in the fixture shape, or as CSV,
+    a few hundred places at a time. """
+
+    rows = queryset.order_by('pk').values_list('pk', *EXPORTED_FIELDS).iterator(chunk_size=chunk_size)
+    lines = _csv_lines(rows) if format == 'csv' else _json_lines(rows)
+
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= 500:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _json_lines(rows):
+    encoder = DjangoJSONEncoder()
+    for pk, *values in rows:
+        fields = dict(zip(EXPORTED_FIELDS, values))
+        fields['photo'] = fields['photo'] or ''
+        yield encoder.encode({'model': 'travel_wishlist.place', 'pk': pk, 'fields': fields}) + '\n'
+
+
+class _Echo:
+    """ A file-like object for csv.writer that returns each line instead of storing it. """
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(('pk',) + EXPORTED_FIELDS)
+    for row in rows:
+        yield writer.writerow(['' if value is None else value for value in row])
@@ -0,0 +1,80 @@
+"""
+Per-user cache of the rendered wishlist and visited pages.
+
+Each user has a version number in the page cache, and pages are cached under a
+key that includes it. Every change to a user's places bumps the version, so
+pages rendered before the change are never read again; they are evicted as
+the least recently used entries. models.places_changed bumps the version.
+
+Pages are cached with a placeholder where the CSRF token goes, and the token
+for the current request is put in when a page is served.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+
+
+CSRF_PLACEHOLDER = 'csrf-token-placeholder-5f0e4c1a'
+
+
+def page_cache():
+    return caches[getattr(settings, 'PAGE_CACHE_ALIAS', 'pages')]
+
+
+def _version_key(user_id):
+    return f'places-version:{user_id}'
+
+
+def get_places_version(user_id):
+    cache = page_cache()
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        # Start from the clock rather than 1, so that if a version is evicted,
+        # the new one never matches pages cached under the old one
+        cache.add(_version_key(user_id), time.time_ns(), timeout=None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+def _bump(user_id):
+    cache = page_cache()
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:   # not in the cache
+        cache.set(_version_key(user_id), time.time_ns(), timeout=None)
+
+
+def bump_places_version(user_id):
+    """ Invalidate the cached pages for a user, after their places change. """
+    _bump(user_id)
+    # And again once the change is committed. A page rendered in between, by
+    # a request that couldn't see the uncommitted change yet, is then dropped.
+    transaction.on_commit(lambda: _bump(user_id))
+
+
+def render_cached(request, template_name, get_context, *key_parts):
+    """ Render template_name for request.user, or serve it from the page cache.
+    get_context is only called when the page isn't cached. key_parts are anything
+    else the page depends on, such as the page cursor. """
+
+    user_id = request.user.pk
+    parts = '\x00'.join(str(part) for part in key_parts if part)
+    key = 'page:{}:{}:{}:{}'.format(user_id, get_places_version(user_id), template_name,
+                                    hashlib.md5(parts.encode(), usedforsecurity=False).hexdigest())
+
+    cache = page_cache()
+    content = cache.get(key)
+    if content is None:
+        context = get_context()
+        context['csrf_token'] = CSRF_PLACEHOLDER
+        content = render_to_string(template_name, context, request)
+        cache.set(key, content)
+
+    return HttpResponse(content.replace(CSRF_PLACEHOLDER, get_token(request)))
@@ -0,0 +1,142 @@
+"""
+Conditional GET for the place views.
+
+A page is identified by when the places on it last changed, plus everything
+else that goes into it: the user, the URL, the CSRF token and any messages
+waiting to be shown. A client that already has the page gets a 304 after one
+small query, before the view fetches or renders anything.
+
+The wishlist and visited pages use the user's PlacesState row, which
+models.places_changed keeps up to date. A place's own page uses the later of its
+updated_at and that row, since the nav on every page shows how many places the
+user has, which changes when any of their places does.
+
+The ETag is made from the time to the microsecond. Last-Modified can only give
+whole seconds, so a client given it during the second of the change couldn't
+tell that change from another later that second, and would get a 304 for the
+older page. The header is left out until that second has passed; until then
+clients have only the ETag to revalidate with.
+"""
+
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.middleware.csrf import get_token
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .models import Place, PlacesState
+
+
+def _memoize_on_request(name):
+    """ Call the decorated function at most once per request, since condition()
+    asks for the ETag and the last modified time separately. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(request, *args, **kwargs):
+            memo = request.__dict__.setdefault('_conditional_memo', {})
+            key = (name, args, tuple(sorted(kwargs.items())))
+            if key not in memo:
+                memo[key] = func(request, *args, **kwargs)
+            return memo[key]
+        return wrapper
+    return decorator
+
+
+@_memoize_on_request('places')
+def places_modified(request, *args, **kwargs):
+    # Users whose places have never changed have no row yet; start one now
+    state, created = PlacesState.objects.get_or_create(user=request.user, defaults={'last_modified': timezone.now()})
+    return state.last_modified
+
+
+@_memoize_on_request('place')
+def place_modified(request, place_pk):
+    # Scoped to the user, so nothing is known about other users' places; the
+    # view itself then decides between 403 and 404.
+    times = (Place.objects.filter(pk=place_pk, user=request.user)
+             .values_list('updated_at', 'user__placesstate__last_modified').first())
+    if times is None:
+        return None
+    return max(time for time in times if time is not None)
+
+
+def _http_last_modified(modified):
+    """ modified, for Last-Modified, once the second it's in is over. """
+    if modified is None or timezone.now() < modified.replace(microsecond=0) + timedelta(seconds=1):
+        return None
+    return modified
+
+
+def places_last_modified(request, *args, **kwargs):
+    return _http_last_modified(places_modified(request))
+
+
+def place_last_modified(request, place_pk):
+    return _http_last_modified(place_modified(request, place_pk=place_pk))
+
+
+def _csrf_secret(request):
+    # The page has a token made from this secret. get_token makes the secret
+    # now if the client has none yet, so the ETag is the same on the next
+    # request, when the client sends it back as a cookie.
+    get_token(request)
+    return request.META['CSRF_COOKIE']
+
+
+def _etag(request, last_modified):
+    if last_modified is None:
+        return None
+    parts = [
+        request.user.pk,
+        request.path,
+        request.GET.urlencode(),
+        _csrf_secret(request),
+        request.COOKIES.get(getattr(settings, 'MESSAGE_COOKIE_NAME', 'messages'), ''),
+        request.session.get('_messages', ''),
+        last_modified.isoformat(),
+    ]
+    return hashlib.sha256('\x00'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def places_etag(request, *args, **kwargs):
+    return _etag(request, places_modified(request))
+
+
+def place_etag(request, place_pk):
+    return _etag(request, place_modified(request, place_pk=place_pk))
+
+
+def conditional_get(etag_func, last_modified_func):
+    """ Like django.views.decorators.http.condition, but only for GET and HEAD
+    requests, so form posts don't pay for the extra query. """
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in ('GET', 'HEAD'):
+                return conditional_view(request, *args, **kwargs)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def aconditional_get(etag_func, last_modified_func):
+    """ conditional_get for async views. The ETag and last modified time are
+    read from the database, so they're worked out in a thread first. """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view(request, *args, **kwargs)
+            etag = await sync_to_async(etag_func)(request, *args, **kwargs)
+            last_modified = await sync_to_async(last_modified_func)(request, *args, **kwargs)
+            conditional_view = condition(etag_func=lambda request, *args, **kwargs: etag,
+                                         last_modified_func=lambda request, *args, **kwargs: last_modified)(view)
+            return await conditional_view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,24 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cache import get_places_version, page_cache
+from .models import get_place_stats
+
+
+def place_counts(request):
+    """ place_counts.wishlist and place_counts.visited for the signed in user,
+    from their PlaceStats. Only read if a template uses them, and then cached
+    until their places next change, so most pages make no query for them. """
+    if not request.user.is_authenticated:
+        return {}
+    user_id = request.user.pk
+    return {'place_counts': SimpleLazyObject(lambda: _place_counts(user_id))}
+
+
+def _place_counts(user_id):
+    key = f'place-counts:{user_id}:{get_places_version(user_id)}'
+    counts = page_cache().get(key)
+    if counts is None:
+        stats = get_place_stats(user_id)
+        counts = {'wishlist': stats.wishlist_count, 'visited': stats.visited_count}
+        page_cache().set(key, counts)
+    return counts
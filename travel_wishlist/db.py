@@ -0,0 +1,80 @@
+"""
+SQLite settings applied to every new database connection.
+
+settings.SQLITE_PRAGMAS names the pragmas, set from the environment in
+settings.py. The defaults suit a web server with many concurrent readers and
+a few writers:
+
+  busy_timeout    wait this many milliseconds for a lock instead of failing
+                  with "database is locked"
+  journal_mode    WAL, so readers read the last committed data while a
+                  writer writes, instead of waiting for it
+  synchronous     NORMAL, which in WAL mode is still safe from corruption, and
+                  only syncs to disk at checkpoints rather than every commit
+  mmap_size       read the database through a memory map of this many bytes
+  cache_size      the page cache per connection, negative for KiB
+
+Connections are kept open between requests (CONN_MAX_AGE), so the pragmas are
+only set once per connection, not once per request.
+
+Every connection also gets notify_query_listeners as an execute wrapper, which
+lets the request metrics and the profiler see each query made while they
+listen (see listening_to_queries). Listeners are kept in a context variable
+rather than on the connection, so they also hear queries that async views make
+in other threads, with sync_to_async or the async ORM.
+"""
+
+import contextvars
+import re
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+_query_listeners = contextvars.ContextVar('query_listeners', default=())
+
+
+@contextmanager
+def listening_to_queries(listener):
+    """ Call listener(sql, params, context, seconds) after each query made in
+    this context, in any thread, until the block ends. """
+    token = _query_listeners.set((*_query_listeners.get(), listener))
+    try:
+        yield
+    finally:
+        _query_listeners.reset(token)
+
+
+def notify_query_listeners(execute, sql, params, many, context):
+    listeners = _query_listeners.get()
+    if not listeners:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - start
+        for listener in listeners:
+            listener(sql, params, context, seconds)
+
+
+def sqlite_pragmas():
+    return getattr(settings, 'SQLITE_PRAGMAS', {})
+
+
+def configure_connection(sender, connection, **kwargs):
+    """ connection_created handler: add the query listeners' execute wrapper,
+    and set SQLITE_PRAGMAS on new SQLite connections. """
+    if notify_query_listeners not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, notify_query_listeners)
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        # busy_timeout first, so changing the journal mode waits for other connections too
+        for name, value in sorted(sqlite_pragmas().items(), key=lambda item: item[0] != 'busy_timeout'):
+            if value is None or value == '':
+                continue
+            if not re.fullmatch(r'-?\w+', str(value)):
+                raise ValueError(f'Not a valid value for PRAGMA {name}: {value!r}')
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,156 @@
+"""
+Deletes the stored photos queued in PhotoDeletion.
+
+Places only queue deletions, after their transaction commits, so requests
+never wait on file I/O and a rolled back change never loses a file that a
+row still points at. The process_photo_deletions command drains the queue.
+
+Files can still be left behind with nothing pointing at them, by a crash
+between storing an upload and saving its place, say. orphaned_files finds
+them for the collect_orphaned_photos command, without loading every name into
+memory: it walks the files in name order, reads the names rows refer to in
+name order a batch at a time, and steps through the two together.
+"""
+
+import heapq
+import os
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import Place, PhotoDeletion, PhotoRendition
+
+
+def photo_storage():
+    return Place._meta.get_field('photo').storage
+
+
+def process_batch(batch_size=100, max_attempts=5, retry_delay=timedelta(seconds=30), storage=None):
+    """ Delete the files for one batch of due PhotoDeletion rows.
+    Returns the number of rows processed, and the number that failed. """
+
+    storage = storage or photo_storage()
+    now = timezone.now()
+    batch = list(PhotoDeletion.objects
+                 .filter(attempts__lt=max_attempts, next_attempt__lte=now)
+                 .order_by('next_attempt', 'pk')[:batch_size])
+    if not batch:
+        return 0, 0
+
+    # A name can be queued and then used again, for example by a new upload
+    # that got the same file name. Never delete a file a place refers to.
+    names = {job.name for job in batch}
+    in_use = set(Place.objects.filter(photo__in=names).values_list('photo', flat=True))
+    in_use.update(PhotoRendition.objects.filter(name__in=names).values_list('name', flat=True))
+
+    done, failed = [], []
+    for job in batch:
+        if job.name not in in_use:
+            try:
+                if storage.exists(job.name):
+                    storage.delete(job.name)
+            except OSError as e:
+                job.attempts += 1
+                job.last_error = str(e)
+                job.next_attempt = now + retry_delay * 2 ** (job.attempts - 1)   # back off exponentially
+                failed.append(job)
+                continue
+        done.append(job.pk)
+
+    PhotoDeletion.objects.filter(pk__in=done).delete()
+    PhotoDeletion.objects.bulk_update(failed, ['attempts', 'last_error', 'next_attempt'])
+    return len(batch), len(failed)
+
+
+def drain(batch_size=100, max_attempts=5, retry_delay=timedelta(seconds=30), storage=None):
+    """ Process batches until nothing is due. Returns totals of rows processed and failed. """
+    processed = failed = 0
+    while True:
+        batch_processed, batch_failed = process_batch(batch_size, max_attempts, retry_delay, storage)
+        processed += batch_processed
+        failed += batch_failed
+        if batch_processed == 0 or batch_failed == batch_processed:
+            return processed, failed
+
+
+def stored_files(storage, top):
+    """ (name, modified time) of each file under the directory top of storage,
+    sorted by name, as the database sorts them. Each directory is sorted by
+    name with a trailing slash, so user_images/a.jpg comes before the files in
+    user_images/a/, as "." sorts before "/". """
+    def walk(directory, prefix):
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name + '/' if entry.is_dir() else entry.name)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(entry.path, prefix + entry.name + '/')
+            elif entry.is_file(follow_symlinks=False):
+                yield prefix + entry.name, entry.stat().st_mtime
+
+    directory = storage.path(top)
+    if os.path.isdir(directory):
+        yield from walk(directory, top.strip('/') + '/')
+
+
+def sorted_names(queryset, field, batch_size):
+    """ The distinct values of field, sorted, read a batch at a time, each
+    batch starting after the last name of the one before. """
+    names = queryset.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+    names = names.order_by(field).values_list(field, flat=True).distinct()
+    last = None
+    while True:
+        batch = list((names if last is None else names.filter(**{f'{field}__gt': last}))[:batch_size])
+        if not batch:
+            return
+        yield from batch
+        last = batch[-1]
+
+
+def referenced_names(batch_size=1000):
+    """ Every stored name a row refers to, sorted, once each: place photos,
+    their renditions, and files already queued for deletion, which are left
+    to process_photo_deletions. The names are compared as the database sorts
+    them, byte by byte in SQLite, which is how Python sorts strings. """
+    previous = None
+    for name in heapq.merge(sorted_names(Place.objects.all(), 'photo', batch_size),
+                            sorted_names(PhotoRendition.objects.all(), 'name', batch_size),
+                            sorted_names(PhotoDeletion.objects.all(), 'name', batch_size)):
+        if name != previous:
+            yield name
+            previous = name
+
+
+def orphaned_files(top='user_images', min_age=timedelta(days=1), batch_size=1000, storage=None):
+    """ Names of the files under top that no row refers to, in name order.
+    Files modified in the last min_age are skipped: their rows may not be
+    committed yet. Storing a photo that's already stored touches its file,
+    so that covers a new upload of an old orphan too. """
+    storage = storage or photo_storage()
+    newest = time.time() - min_age.total_seconds()
+    referenced = referenced_names(batch_size)
+    current = next(referenced, None)
+    for name, modified in stored_files(storage, top):
+        while current is not None and current < name:
+            current = next(referenced, None)
+        if name != current and modified <= newest:
+            yield name
+
+
+def delete_orphans(names, storage=None):
+    """ Delete the files named, bar any a row has come to refer to since they
+    were found, such as a new upload of the same photo. Returns how many were
+    deleted; any that can't be are left for the next run. """
+    storage = storage or photo_storage()
+    in_use = set(Place.objects.filter(photo__in=names).values_list('photo', flat=True))
+    in_use.update(PhotoRendition.objects.filter(name__in=names).values_list('name', flat=True))
+    in_use.update(PhotoDeletion.objects.filter(name__in=names).values_list('name', flat=True))
+    deleted = 0
+    for name in names:
+        if name not in in_use:
+            try:
+                storage.delete(name)
+            except OSError:
+                continue
+            deleted += 1
+    return deleted
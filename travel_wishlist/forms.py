@@ -1,11 +1,18 @@
 from django import forms
 from django.forms import FileInput, DateInput
 from .models import Place
+from .images import build_renditions
+from .uploads import PhotoField, RejectedUpload, max_upload_bytes
+from django.template.defaultfilters import filesizeformat
 
 class NewPlaceForm(forms.ModelForm):
     class Meta:
         model = Place
         fields = ('name', 'visited')
+        widgets = {
+            # Suggestions are filled in by js/suggest_names.js as the user types
+            'name': forms.TextInput(attrs={'list': 'place-name-suggestions', 'autocomplete': 'off'})
+        }
 
 
 # Create a custom date input field, otherwise would get a plain text field.
@@ -20,5 +27,27 @@ class TripReviewForm(forms.ModelForm):
         widgets = {
             'date_visited': DateInput()
         }
+        field_classes = {
+            'photo': PhotoField
+        }
+
+    def save(self, commit=True):
+        place = super().save(commit)
+        # Make the resized copies for srcset now, while the upload is fresh
+        if commit and 'photo' in self.changed_data and place.photo:
+            build_renditions(place.photo)
+        return place
+
+
+
 
+class PlacesImportForm(forms.Form):
+    file = forms.FileField(help_text='JSON lines or CSV, in the same shape as an export.')
 
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if isinstance(upload, RejectedUpload):
+            raise forms.ValidationError(
+                'Uploaded files can be at most %(max_size)s. Send bigger imports as the request body instead.',
+                params={'max_size': filesizeformat(max_upload_bytes())})
+        return upload
@@ -0,0 +1,95 @@
+"""
+Resized renditions of uploaded photos, for responsive <img srcset>.
+
+Renditions are made when a photo is uploaded through TripReviewForm. Any that
+are missing, for example for photos uploaded before renditions existed, are
+made the first time the photo's srcset is needed. They are recorded in
+PhotoRendition and deleted along with the photo by Place.delete_photo.
+
+A stored photo can be missing or unreadable, after its deletion was queued,
+say. Then only the renditions already made are used, and the page falls back
+to the photo's own URL; nothing is recorded, so they're made once it's back.
+"""
+
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, UnidentifiedImageError
+
+from .models import PhotoRendition
+
+
+logger = logging.getLogger(__name__)
+
+def rendition_widths():
+    return getattr(settings, 'PHOTO_RENDITION_WIDTHS', (160, 640, 1280))
+
+
+def rendition_name(source_name, width):
+    """ Renditions go in a renditions directory under the photo's top-level directory,
+    e.g. user_images/renditions/. """
+    top_directory = source_name.split('/')[0] if '/' in source_name else ''
+    stem, ext = os.path.splitext(os.path.basename(source_name))
+    return os.path.join(top_directory, 'renditions', f'{stem}_{width}w{ext}')
+
+
+def build_renditions(photo, widths=None):
+    """ Make and record the renditions of photo (a FieldFile) that don't exist yet.
+    Returns every PhotoRendition for the photo. """
+
+    widths = widths or rendition_widths()
+    existing = {rendition.width: rendition for rendition in PhotoRendition.objects.filter(source=photo.name)}
+    missing = [width for width in widths if width not in existing]
+    if not missing:
+        return sorted(existing.values(), key=lambda rendition: rendition.width)
+
+    try:
+        created = _make_renditions(photo, missing)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as error:
+        logger.warning('Could not make renditions of %s: %s', photo.name, error)
+        return sorted(existing.values(), key=lambda rendition: rendition.width)
+
+    PhotoRendition.objects.bulk_create(created, ignore_conflicts=True)
+    renditions = list(existing.values()) + created
+    return sorted(renditions, key=lambda rendition: rendition.width)
+
+
+def _make_renditions(photo, widths):
+    """ Resize and store photo at each of widths, returning unsaved PhotoRenditions. """
+    storage = photo.storage
+    created = []
+    with storage.open(photo.name, 'rb') as source_file, Image.open(source_file) as image:
+        image_format = 'JPEG' if image.format == 'MPO' else image.format   # phone cameras write MPO
+        for width in widths:
+            if image.width <= width:
+                created.append(PhotoRendition(source=photo.name, width=width, name=''))   # no upscaling
+                continue
+            resized = image.copy()
+            resized.thumbnail((width, image.height))   # keeps the aspect ratio
+            if image_format == 'JPEG' and resized.mode not in ('RGB', 'L'):
+                resized = resized.convert('RGB')
+            buffer = io.BytesIO()
+            resized.save(buffer, format=image_format, **_save_options(image_format))
+            name = storage.save(rendition_name(photo.name, width), ContentFile(buffer.getvalue()))
+            created.append(PhotoRendition(source=photo.name, width=width, name=name))
+    return created
+
+
+def srcset(photo):
+    """ The srcset attribute value for a photo, making any missing renditions first. """
+    if not photo:
+        return ''
+    renditions = build_renditions(photo)
+    return ', '.join(f'{photo.storage.url(rendition.name)} {rendition.width}w'
+                     for rendition in renditions if rendition.name)
+
+
+def _save_options(image_format):
+    if image_format == 'JPEG':
+        return {'quality': 85, 'optimize': True, 'progressive': True}
+    if image_format == 'PNG':
+        return {'optimize': True}
+    return {}
@@ -0,0 +1,543 @@
+"""
+Load tests of every view, for the benchmark_views command.
+
+Each URL in travel_wishlist/urls.py has a scenario: a request that exercises
+it, and the statuses it should answer with. Scenarios run one at a time, with
+several workers sending requests at once, each worker signed in as its own
+user. Requests go through Django's test client, in the worker threads, or
+over HTTP to a threaded WSGI server started in the background.
+
+For each scenario the results are the latency percentiles, the throughput of
+all the workers together, and the number of database queries per request.
+They can be saved as a baseline, and a later run compared to it with
+regressions: query and error counts must not grow, and the statuses answered
+must stay the same. Latency and throughput depend on the machine, so they're
+only compared, within a tolerance, when asked for, with a baseline saved on the
+same machine. The baseline in settings.LOADTEST_BASELINE is committed with the
+code, without timings, and benchmark_views compares with it unless told otherwise.
+
+Scenarios that change places, such as marking them visited or deleting them,
+are given fresh places for each request, added before the scenario starts and
+not timed.
+
+For the benchmark_asgi command, PooledWSGIServer and ASGITestServer serve the
+project as a WSGI deployment with a fixed number of worker threads would, and
+as an ASGI one would, and slow_upload is a client on a slow connection.
+"""
+
+import asyncio
+import http.client
+import io
+import json
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from urllib.parse import unquote, urlencode
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIServer
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.middleware.csrf import _get_new_csrf_string
+from django.test import Client
+from django.test.testcases import QuietWSGIRequestHandler
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from PIL import Image
+
+from . import bulk, urls
+from .benchmarks import NOTE_WORDS, PLACE_PREFIXES, percentile
+from .models import PhotoBlob, Place, rebuild_place_stats
+from .storage import photo_storage
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    query: dict = field(default_factory=dict)
+    data: dict = None             # form fields, for a POST
+    body: bytes = None            # or a raw body, with its content type
+    content_type: str = None
+
+
+@dataclass
+class Scenario:
+    """ How to load test one URL. make_request(worker) returns the Request to
+    send. A scenario that uses up places sets fresh_places to how many each
+    request needs, and finds them in worker.fresh. """
+    url_name: str
+    make_request: object
+    statuses: tuple = (200,)
+    fresh_places: int = 0
+
+
+class Worker:
+    """ A signed in user sending requests, and what it knows about their places. """
+
+    def __init__(self, user, rng):
+        self.user = user
+        self.rng = rng
+        places = Place.objects.filter(user=user)
+        self.place_pks = list(places.values_list('pk', flat=True))
+        self.photo_place_pks = list(places.filter(photo__gt='').values_list('pk', flat=True)) or self.place_pks
+        self.fresh = []
+
+    def place_pk(self):
+        return self.rng.choice(self.place_pks)
+
+    def fresh_pks(self, count):
+        taken, self.fresh = self.fresh[:count], self.fresh[count:]
+        return taken
+
+
+def _import_body(worker):
+    lines = (json.dumps({'name': f'{worker.rng.choice(PLACE_PREFIXES)} import {n}'}) for n in range(50))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+SCENARIOS = [
+    Scenario('place_list', lambda w: Request('GET', reverse('place_list'))),
+    Scenario('places_visited', lambda w: Request('GET', reverse('places_visited'))),
+    Scenario('place_was_visited', lambda w: Request('POST', reverse('place_was_visited', args=w.fresh_pks(1))),
+             statuses=(302,), fresh_places=1),
+    Scenario('place_details', lambda w: Request('GET', reverse('place_details', args=(w.rng.choice(w.photo_place_pks),)))),
+    Scenario('delete_place', lambda w: Request('POST', reverse('delete_place', args=w.fresh_pks(1))),
+             statuses=(302,), fresh_places=1),
+    Scenario('places_were_visited', lambda w: Request('POST', reverse('places_were_visited'), data={'place_pk': w.fresh_pks(20)}),
+             statuses=(302,), fresh_places=20),
+    Scenario('delete_places', lambda w: Request('POST', reverse('delete_places'), data={'place_pk': w.fresh_pks(20)}),
+             statuses=(302,), fresh_places=20),
+    Scenario('search', lambda w: Request('GET', reverse('search'), query={'q': w.rng.choice(NOTE_WORDS)})),
+    Scenario('travel_stats', lambda w: Request('GET', reverse('travel_stats'))),
+    Scenario('place_name_suggestions', lambda w: Request('GET', reverse('place_name_suggestions'),
+                                                         query={'q': w.rng.choice(PLACE_PREFIXES)[:2]})),
+    Scenario('import_places', lambda w: Request('POST', reverse('import_places'), body=_import_body(w),
+                                                content_type='application/jsonl'), statuses=(201,)),
+    Scenario('export_places', lambda w: Request('GET', reverse('export_places'))),
+    Scenario('api_places', lambda w: Request('GET', reverse('api_places'), query={'fields': 'pk,name,visited'})),
+    Scenario('api_place', lambda w: Request('GET', reverse('api_place', args=(w.place_pk(),)))),
+    Scenario('api_place_visited', lambda w: Request('POST', reverse('api_place_visited', args=w.fresh_pks(1))),
+             fresh_places=1),
+]
+
+
+def missing_scenarios():
+    """ Names of URLs in travel_wishlist/urls.py with no scenario. """
+    covered = {scenario.url_name for scenario in SCENARIOS}
+    return [pattern.name for pattern in urls.urlpatterns if pattern.name not in covered]
+
+
+def seed_photos(users, photos_per_user, size=(1600, 1200), seed=0):
+    """ Give photos_per_user of each user's places a photo, each a different
+    image, so the place pages have renditions to make and serve. """
+    rng = random.Random(seed)
+    storage = photo_storage()
+    for user in users:
+        places = list(Place.objects.filter(user=user).order_by('pk')[:photos_per_user])
+        for place in places:
+            buffer = io.BytesIO()
+            Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3))).save(buffer, format='JPEG')
+            place.photo = storage.save('user_images/seed.jpg', ContentFile(buffer.getvalue()))
+            place.visited = True   # the photo is only shown for visited places
+        Place.objects.bulk_update(places, ['photo', 'visited'])
+        PhotoBlob.objects.bulk_create([PhotoBlob(name=place.photo.name, refcount=1) for place in places],
+                                      ignore_conflicts=True)
+    rebuild_place_stats([user.pk for user in users])
+
+
+def add_fresh_places(workers, count):
+    """ Give each worker count new places on their wishlist, untimed, through a
+    bulk import so the user's stats and cached pages stay right. """
+    for worker in workers:
+        if count:
+            before = Place.objects.filter(user=worker.user).order_by('-pk').values_list('pk', flat=True).first() or 0
+            bulk.import_places(({'name': f'Fresh place {n}'} for n in range(count)), user=worker.user)
+            worker.fresh = list(Place.objects.filter(user=worker.user, pk__gt=before).values_list('pk', flat=True))
+
+
+class QueryCounter:
+    """ Database queries counted by scenario, across threads. """
+
+    def __init__(self):
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def counting(self, scenario_name):
+        """ An execute_wrapper for this thread's connection, counting towards scenario_name. """
+        def wrapper(execute, sql, params, many, context):
+            with self.lock:
+                self.counts[scenario_name] = self.counts.get(scenario_name, 0) + 1
+            return execute(sql, params, many, context)
+        return connection.execute_wrapper(wrapper)
+
+
+class ClientTransport:
+    """ Sends requests through the test client, as the worker's user. """
+
+    def __init__(self, user):
+        self.client = Client(raise_request_exception=False)   # a 500 is a result, like over HTTP
+        self.client.force_login(user)
+
+    def send(self, request):
+        if request.method == 'GET':
+            response = self.client.get(request.path, request.query)
+        elif request.body is not None:
+            response = self.client.generic(request.method, request.path, request.body, request.content_type)
+        else:
+            response = self.client.generic(request.method, request.path, urlencode(request.data or {}, doseq=True),
+                                           'application/x-www-form-urlencoded')
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response.status_code
+
+
+class HTTPTransport:
+    """ Sends requests over HTTP to a server, with the worker's user's session
+    cookie, and a CSRF cookie and header. """
+
+    SCENARIO_HEADER = 'X-Load-Test-Scenario'
+
+    def __init__(self, user, host, port):
+        self.host, self.port = host, port
+        session_client = Client()
+        session_client.force_login(user)
+        csrf_secret = _get_new_csrf_string()
+        self.headers = {
+            'Cookie': f'sessionid={session_client.cookies["sessionid"].value}; csrftoken={csrf_secret}',
+            'X-CSRFToken': csrf_secret,
+        }
+
+    def send(self, request, scenario_name=''):
+        path = request.path + ('?' + urlencode(request.query) if request.query else '')
+        headers = {**self.headers, self.SCENARIO_HEADER: scenario_name}
+        body = request.body
+        if request.method != 'GET':
+            if body is None:
+                body = urlencode(request.data or {}, doseq=True).encode()
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            else:
+                headers['Content-Type'] = request.content_type
+        http_connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            http_connection.request(request.method, path, body=body, headers=headers)
+            response = http_connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            http_connection.close()
+
+
+class LoadTestServer:
+    """ The project's WSGI application on a threaded server on localhost, in a
+    background thread, counting the queries each request makes. """
+
+    def __init__(self, counter):
+        application = get_wsgi_application()
+
+        def counted_application(environ, start_response):
+            scenario_name = environ.get('HTTP_' + HTTPTransport.SCENARIO_HEADER.upper().replace('-', '_'), '')
+            with counter.counting(scenario_name):
+                # Streamed bodies are read while the response is iterated, so count that too
+                response = application(environ, start_response)
+                try:
+                    yield from response
+                finally:
+                    response.close()
+
+        self.server = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler, allow_reuse_address=False)
+        self.server.set_app(counted_application)
+        self.host, self.port = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class PooledWSGIServer(WSGIServer):
+    """ A WSGI server that handles requests in a fixed pool of threads, like a
+    deployment with that many worker threads. A request waits for a free thread. """
+
+    def __init__(self, *args, threads, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_in_pool, request, client_address)
+
+    def process_request_in_pool(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+
+
+class WSGITestServer:
+    """ settings.WSGI_APPLICATION on a PooledWSGIServer on localhost, in a background thread. """
+
+    def __init__(self, threads):
+        self.server = PooledWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler, threads=threads,
+                                       allow_reuse_address=False)
+        self.server.set_app(get_wsgi_application())
+        self.host, self.port = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class ASGITestServer:
+    """ settings.ASGI_APPLICATION behind a minimal HTTP/1.1 server on localhost,
+    an event loop in a background thread. It takes one request per connection,
+    with a Content-Length body, and closes the connection after the response:
+    enough for the benchmark's clients, not for browsers. Deploy with an ASGI
+    server such as uvicorn or daphne. """
+
+    def __init__(self):
+        self.application = import_string(settings.ASGI_APPLICATION)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.handlers = set()
+
+    def __enter__(self):
+        self.thread.start()
+        start_server = asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.server = asyncio.run_coroutine_threadsafe(start_server, self.loop).result()
+        self.host, self.port = self.server.sockets[0].getsockname()[:2]
+        return self
+
+    def __exit__(self, *exc_info):
+        async def stop():
+            self.server.close()
+            await self.server.wait_closed()
+            await asyncio.gather(*self.handlers, return_exceptions=True)   # requests still being answered
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def handle(self, reader, writer):
+        self.handlers.add(asyncio.current_task())
+        try:
+            method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+            headers = []
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+            path, _, query = target.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                'method': method, 'scheme': 'http', 'path': unquote(path), 'raw_path': path.encode('latin-1'),
+                'query_string': query.encode('latin-1'), 'root_path': '', 'headers': headers,
+                'client': writer.get_extra_info('peername')[:2], 'server': (self.host, self.port),
+            }
+            remaining = int(dict(headers).get(b'content-length', 0))
+            more_body = True
+            finished = asyncio.Event()
+
+            async def receive():
+                nonlocal remaining, more_body
+                if not more_body:
+                    await finished.wait()   # Django listens for the client going away
+                    return {'type': 'http.disconnect'}
+                body = await reader.read(min(remaining, 64 * 1024)) if remaining else b''
+                remaining = remaining - len(body) if body else 0
+                more_body = remaining > 0
+                return {'type': 'http.request', 'body': body, 'more_body': more_body}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status = message['status']
+                    writer.write(f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'.encode('latin-1'))
+                    for name, value in message.get('headers', []):
+                        writer.write(bytes(name) + b': ' + bytes(value) + b'\r\n')
+                    writer.write(b'Connection: close\r\n\r\n')
+                elif message['type'] == 'http.response.body':
+                    writer.write(message.get('body', b''))
+                    await writer.drain()
+
+            try:
+                await self.application(scope, receive, send)
+            finally:
+                finished.set()
+        finally:
+            writer.close()
+            self.handlers.discard(asyncio.current_task())
+
+
+def slow_upload(host, port, path, headers, body, seconds, pieces=20):
+    """ POST body to path, sent in pieces spread over seconds, like a client on a
+    slow connection. Returns the response's status. """
+    sock = socket.create_connection((host, port), timeout=60 + seconds)
+    try:
+        head = [f'POST {path} HTTP/1.1', f'Host: {host}:{port}', f'Content-Length: {len(body)}',
+                'Connection: close', *(f'{name}: {value}' for name, value in headers.items())]
+        sock.sendall(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        piece_size = -(-len(body) // pieces)
+        for start in range(0, len(body), piece_size):
+            time.sleep(seconds / pieces)
+            sock.sendall(body[start:start + piece_size])
+        response = http.client.HTTPResponse(sock)
+        response.begin()
+        response.read()
+        return response.status
+    finally:
+        sock.close()
+
+
+def run_scenario(scenario, workers, transports, requests_per_worker, counter):
+    """ Have every worker send requests_per_worker requests at once. Returns
+    the scenario's results, as saved in a baseline. """
+    add_fresh_places(workers, scenario.fresh_places * requests_per_worker)
+    # Made up front, since making them reads the database in the worker threads otherwise
+    planned = [[scenario.make_request(worker) for _ in range(requests_per_worker)] for worker in workers]
+    samples = []
+    errors = []
+    statuses = set()
+    lock = threading.Lock()
+
+    def work(transport, requests):
+        local_samples, local_errors, local_statuses = [], [], set()
+        try:
+            with counter.counting(scenario.url_name):
+                for request in requests:
+                    start = time.perf_counter()
+                    try:
+                        if isinstance(transport, HTTPTransport):
+                            status = transport.send(request, scenario.url_name)
+                        else:
+                            status = transport.send(request)
+                    except Exception as error:   # a failed request is a result too
+                        status = repr(error)
+                    local_samples.append(time.perf_counter() - start)
+                    local_statuses.add(str(status) if isinstance(status, int) else 'exception')
+                    if status not in scenario.statuses:
+                        local_errors.append(f'{request.method} {request.path}: {status}')
+        finally:
+            with lock:
+                samples.extend(local_samples)
+                errors.extend(local_errors)
+                statuses.update(local_statuses)
+
+    start = time.perf_counter()
+    if len(workers) == 1:
+        work(transports[0], planned[0])   # in this thread, so it sees this thread's transaction in tests
+    else:
+        threads = [threading.Thread(target=_closing_connections(work), args=(transport, requests))
+                   for transport, requests in zip(transports, planned)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': len(samples),
+        'errors': len(errors),
+        'error_examples': errors[:3],
+        'statuses': sorted(statuses),
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'throughput_rps': len(samples) / elapsed,
+        'queries_per_request': counter.counts.get(scenario.url_name, 0) / len(samples),
+    }
+
+
+def _closing_connections(target):
+    def run(*args):
+        try:
+            target(*args)
+        finally:
+            connections.close_all()
+    return run
+
+
+def run_load_test(users, requests_per_worker, scenarios=None, server=False, seed=0):
+    """ Run each scenario, or those named in scenarios, with a worker for each
+    of users, through the test client or a local server. Returns results by URL name. """
+    rng = random.Random(seed)
+    workers = [Worker(user, random.Random(rng.random())) for user in users]
+    counter = QueryCounter()
+    chosen = [scenario for scenario in SCENARIOS if not scenarios or scenario.url_name in scenarios]
+    results = {}
+    if server:
+        with LoadTestServer(counter) as live_server:
+            transports = [HTTPTransport(worker.user, live_server.host, live_server.port) for worker in workers]
+            for scenario in chosen:
+                results[scenario.url_name] = run_scenario(scenario, workers, transports, requests_per_worker, counter)
+    else:
+        transports = [ClientTransport(worker.user) for worker in workers]
+        for scenario in chosen:
+            results[scenario.url_name] = run_scenario(scenario, workers, transports, requests_per_worker, counter)
+    return results
+
+
+def load_baseline(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+TIMING_KEYS = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps')
+
+
+def without_timings(results):
+    """ results without the measures that depend on the machine, for a baseline
+    to commit. """
+    return {name: {key: value for key, value in result.items() if key not in TIMING_KEYS}
+            for name, result in results.items()}
+
+
+def regressions(results, baseline, timings=False, tolerance=0.25, slack_ms=1.0):
+    """ How results are worse than baseline, as messages. Query counts and
+    errors may not grow at all, and the statuses must be the same. With
+    timings, latency may also grow by tolerance (a fraction) plus slack_ms, and
+    throughput fall by tolerance, to allow for noise, where the baseline has them. """
+    problems = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['errors'] > before['errors']:
+            problems.append(f'{name}: {result["errors"]} errors, was {before["errors"]}')
+        if result['queries_per_request'] > before['queries_per_request'] + 0.01:
+            problems.append(f'{name}: {result["queries_per_request"]:.2f} queries per request, '
+                            f'was {before["queries_per_request"]:.2f}')
+        if 'statuses' in before and result['statuses'] != before['statuses']:
+            problems.append(f'{name}: answered {", ".join(result["statuses"])}, '
+                            f'was {", ".join(before["statuses"])}')
+        if not timings:
+            continue
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if key not in before:
+                continue
+            limit = before[key] * (1 + tolerance) + slack_ms
+            if result[key] > limit:
+                problems.append(f'{name}: {key[:3]} {result[key]:.2f} ms, was {before[key]:.2f} ms')
+        if 'throughput_rps' in before and result['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            problems.append(f'{name}: {result["throughput_rps"]:.1f} requests/s, was {before["throughput_rps"]:.1f}')
+    return problems
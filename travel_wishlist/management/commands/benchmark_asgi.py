@@ -0,0 +1,146 @@
+import io
+import logging
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.client import encode_multipart
+from django.test.utils import override_settings
+from django.urls import reverse
+from PIL import Image
+
+from travel_wishlist import loadtest
+from travel_wishlist.benchmarks import format_summary, scratch_database, seed_places, summarize
+from travel_wishlist.models import Place
+
+BOUNDARY = 'BenchmarkBoundary'
+
+
+@contextmanager
+def conn_max_age(seconds):
+    """ Use CONN_MAX_AGE seconds for connections made in the block. """
+    settings_dict = connection.settings_dict
+    old = settings_dict.get('CONN_MAX_AGE', 0)
+    settings_dict['CONN_MAX_AGE'] = seconds
+    connections.close_all()
+    try:
+        yield
+    finally:
+        connections.close_all()
+        settings_dict['CONN_MAX_AGE'] = old
+
+
+def photo_body(size, seed):
+    """ A multipart form body with a noisy JPEG of size pixels, which compresses badly, as the photo. """
+    image = Image.effect_noise(size, 64 + seed).convert('RGB')
+    photo = io.BytesIO()
+    image.save(photo, format='JPEG', quality=90)
+    photo.seek(0)
+    photo.name = f'photo-{seed}.jpg'
+    return encode_multipart(BOUNDARY, {'photo': photo})
+
+
+class Command(BaseCommand):
+    help = ('Compare the WSGI and the ASGI deployment while clients on slow connections upload photos: '
+            'the latency and throughput of the wishlist page for other users meanwhile, and how the uploads fare. '
+            'The WSGI server has a fixed pool of worker threads, which each slow upload holds for as long as it '
+            'takes to arrive; under ASGI the upload arrives on the event loop, and the view only gets it once it has.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Worker threads of the WSGI server')
+        parser.add_argument('--slow-clients', type=int, default=4, help='Clients uploading a photo slowly, at once')
+        parser.add_argument('--upload-seconds', type=float, default=5, help='How long each upload takes to send')
+        parser.add_argument('--photo-size', type=int, nargs=2, default=(1200, 900), metavar=('WIDTH', 'HEIGHT'))
+        parser.add_argument('--fast-clients', type=int, default=4, help='Clients loading their wishlist meanwhile')
+        parser.add_argument('--places', type=int, default=200, help='Places per user')
+        parser.add_argument('--file', help='Build the scratch database in this file. '
+                                           'Defaults to a temporary file, since the servers\' threads share it')
+
+    def handle(self, *args, **options):
+        hosts = [*settings.ALLOWED_HOSTS, '127.0.0.1']
+        with tempfile.TemporaryDirectory() as directory, override_settings(MEDIA_ROOT=directory, ALLOWED_HOSTS=hosts):
+            with scratch_database(options['file'] or f'{directory}/benchmark.sqlite3'):
+                users = seed_places(options['slow_clients'] + options['fast_clients'], options['places'])
+                uploaders, readers = users[:options['slow_clients']], users[options['slow_clients']:]
+                bodies = [photo_body(tuple(options['photo_size']), n) for n in range(len(uploaders))]
+                self.stdout.write(f'{len(uploaders)} clients each uploading a {len(bodies[0]) // 1024} KiB photo '
+                                  f'over {options["upload_seconds"]} s, while {len(readers)} load their wishlists')
+
+                # Errors are counted and reported below, rather than logged with a traceback each
+                request_logger = logging.getLogger('django.request')
+                request_logger.disabled, was_disabled = True, request_logger.disabled
+                try:
+                    with loadtest.WSGITestServer(options['threads']) as server:
+                        results = self.run_clients(server, uploaders, bodies, readers, options)
+                    self.report(f'WSGI, {options["threads"]} worker threads', results)
+
+                    with conn_max_age(0), loadtest.ASGITestServer() as server:   # as asgi.py sets it
+                        mode = 'async views' if settings.ASYNC_VIEWS else 'sync views'
+                        results = self.run_clients(server, uploaders, bodies, readers, options)
+                    self.report(f'ASGI, {mode}', results)
+                finally:
+                    request_logger.disabled = was_disabled
+
+    def run_clients(self, server, uploaders, bodies, readers, options):
+        results = {'uploads': [], 'upload_statuses': [], 'reads': [], 'read_errors': []}
+        lock = threading.Lock()
+        uploading = threading.Event()
+        uploads_done = threading.Event()
+
+        def upload(user, body):
+            transport = loadtest.HTTPTransport(user, server.host, server.port)
+            place_pk = Place.objects.filter(user=user).order_by('pk').values_list('pk', flat=True).first()
+            headers = {**transport.headers, 'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'}
+            uploading.set()
+            start = time.perf_counter()
+            try:
+                status = loadtest.slow_upload(server.host, server.port, reverse('place_details', args=(place_pk,)),
+                                              headers, body, options['upload_seconds'])
+            except Exception as error:
+                status = repr(error)
+            with lock:
+                results['uploads'].append(time.perf_counter() - start)
+                results['upload_statuses'].append(status)
+
+        def read(user):
+            transport = loadtest.HTTPTransport(user, server.host, server.port)
+            request = loadtest.Request('GET', reverse('place_list'))
+            uploading.wait()
+            while not uploads_done.is_set():
+                start = time.perf_counter()
+                try:
+                    status = transport.send(request, 'place_list')
+                except Exception as error:
+                    status = repr(error)
+                with lock:
+                    results['reads'].append(time.perf_counter() - start)
+                    if status != 200:
+                        results['read_errors'].append(status)
+
+        upload_threads = [threading.Thread(target=upload, args=(user, body)) for user, body in zip(uploaders, bodies)]
+        read_threads = [threading.Thread(target=read, args=(user,)) for user in readers]
+        start = time.perf_counter()
+        for thread in upload_threads + read_threads:
+            thread.start()
+        for thread in upload_threads:
+            thread.join()
+        uploads_done.set()
+        for thread in read_threads:
+            thread.join()
+        results['seconds'] = time.perf_counter() - start
+        connections.close_all()
+        return results
+
+    def report(self, label, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        reads = results['reads']
+        self.stdout.write(f'  wishlist: {len(reads)} requests, {len(reads) / results["seconds"]:.1f}/s  '
+                          f'{format_summary(summarize(reads))}  max {max(reads) * 1000:.0f} ms')
+        if results['read_errors']:
+            self.stdout.write(self.style.ERROR(f'    {len(results["read_errors"])} errors, such as {results["read_errors"][0]}'))
+        statuses = ', '.join(str(status) for status in sorted(set(map(str, results['upload_statuses']))))
+        self.stdout.write(f'  uploads:  {format_summary(summarize(results["uploads"]))}  status {statuses}')
@@ -0,0 +1,41 @@
+import os
+import random
+import tempfile
+
+from django.core.management.base import BaseCommand
+
+from travel_wishlist import autocomplete
+from travel_wishlist.benchmarks import PLACE_PREFIXES, format_summary, summarize, time_calls
+
+
+class Command(BaseCommand):
+    help = ('Build a gazetteer of random names and a user with many places in memory, '
+            'then time prefix lookups in each, as each keystroke in the add place form makes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gazetteer-names', type=int, default=1_000_000)
+        parser.add_argument('--user-places', type=int, default=100_000)
+        parser.add_argument('--repeat', type=int, default=10_000, help='Timed lookups of each prefix')
+        parser.add_argument('--prefixes', nargs='+', default=['p', 'pa', 'paris 1', 'paris 123456', 'qqq'])
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+
+        def names(count):
+            return (f'{rng.choice(PLACE_PREFIXES)} {rng.randrange(10 ** 6):06d}' for _ in range(count))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'gazetteer.tsv')
+            with open(path, 'wb') as file:
+                written = autocomplete.write_gazetteer(names(options['gazetteer_names']), file)
+            gazetteer = autocomplete.Gazetteer(path)
+            user_names = autocomplete.UserNames(names(options['user_places']), version=0)
+            self.stdout.write(f'{written} gazetteer names ({os.path.getsize(path) // 1024} KiB), '
+                              f'{options["user_places"]} user place names')
+
+            for prefix in options['prefixes']:
+                self.stdout.write(self.style.MIGRATE_HEADING(f'"{prefix}"'))
+                for label, index in (('gazetteer', gazetteer), ('user', user_names)):
+                    samples = time_calls(lambda: index.lookup(prefix), options['repeat'])
+                    self.stdout.write(f'  {label}: {len(index.lookup(prefix))} names  {format_summary(summarize(samples))}')
+            gazetteer.map.close()
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from travel_wishlist.benchmarks import format_summary, scratch_database, seed_places, summarize, time_calls
+from travel_wishlist.models import Place
+
+
+class Command(BaseCommand):
+    help = ('Seed a scratch database with users × places, then print the query plan and latency '
+            'of the wishlist and visited queries without and with the per-list (user, name) indexes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--places', type=int, default=5000, help='Places per user')
+        parser.add_argument('--repeat', type=int, default=50, help='Timed runs of each query')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.stdout.write(f'Seeding {options["users"]} users × {options["places"]} places...')
+            user = seed_places(options['users'], options['places'])[0]
+
+            with connection.schema_editor() as editor:
+                for index in Place._meta.indexes:
+                    editor.remove_index(Place, index)
+            self.run_queries('Before (implicit user index only)', user, options['repeat'])
+
+            with connection.schema_editor() as editor:
+                for index in Place._meta.indexes:
+                    editor.add_index(Place, index)
+            names = ', '.join(index.name for index in Place._meta.indexes)
+            self.run_queries(f'After ({names})', user, options['repeat'])
+
+    def run_queries(self, heading, user, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(heading))
+        for label, visited in (('wishlist', False), ('visited', True)):
+            places = Place.objects.filter(user=user).filter(visited=visited).order_by('name')
+            self.stdout.write(f'  {label} query plan:')
+            for line in places.explain().splitlines():
+                self.stdout.write(f'    {line}')
+            samples = time_calls(lambda: list(places.all()), repeat)
+            self.stdout.write(f'  {label} latency: {format_summary(summarize(samples))}')
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from travel_wishlist import search
+from travel_wishlist.benchmarks import format_summary, scratch_database, seed_places, summarize, time_calls
+
+
+class Command(BaseCommand):
+    help = ('Seed a scratch database with users × places with notes, then compare the latency '
+            'of searching one user\'s places with the FTS5 index and with LIKE filters.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--places', type=int, default=100_000, help='Places per user')
+        parser.add_argument('--notes-words', type=int, default=12, help='Words in each place\'s notes')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs of each search')
+        parser.add_argument('--file', help='Build the scratch database in this file instead of in memory')
+        parser.add_argument('--queries', nargs='+', default=['volcano', 'volc*', 'beach sunset', 'paris', 'glacier123'],
+                            help='Searches to time')
+
+    def handle(self, *args, **options):
+        with scratch_database(options['file']):
+            if not search.search_index_exists():
+                self.stderr.write('This SQLite has no FTS5, so there is nothing to compare.')
+                return
+
+            total = options['users'] * options['places']
+            self.stdout.write(f'Seeding {options["users"]} users × {options["places"]} places ({total} rows)...')
+            user = seed_places(options['users'], options['places'], notes_words=options['notes_words'])[0]
+
+            for query in options['queries']:
+                words = search.query_words(query)
+                self.stdout.write(self.style.MIGRATE_HEADING(f'"{query}"'))
+                for label, run in (('FTS5', search._fts_search), ('LIKE', search._like_search)):
+                    results = run(user, words, 50)
+                    samples = time_calls(lambda: run(user, words, 50), options['repeat'])
+                    self.stdout.write(f'  {label}: {len(results)} results  {format_summary(summarize(samples))}')
@@ -0,0 +1,129 @@
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, connections
+from django.test.utils import override_settings
+
+from travel_wishlist.benchmarks import format_summary, scratch_database, seed_places, summarize
+from travel_wishlist.models import Place
+
+
+# SQLite's own defaults, and Django's: a new connection for every request, and
+# transactions that only take the write lock when they first write
+DEFAULT_CONFIG = {
+    'pragmas': {'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+    'conn_max_age': 0,
+    'transaction_mode': None,
+}
+
+
+def tuned_config():
+    """ The configuration in settings.py. """
+    return {
+        'pragmas': settings.SQLITE_PRAGMAS,
+        'conn_max_age': settings.DATABASES['default'].get('CONN_MAX_AGE', 0),
+        'transaction_mode': settings.DATABASES['default'].get('OPTIONS', {}).get('transaction_mode'),
+    }
+
+
+@contextmanager
+def database_config(config):
+    """ Use config for connections made in the block. Every thread's connection
+    is made from the same settings dict, the one connection has. """
+    settings_dict = connection.settings_dict
+    options = settings_dict.setdefault('OPTIONS', {})
+    old = settings_dict.get('CONN_MAX_AGE', 0), options.get('transaction_mode')
+    settings_dict['CONN_MAX_AGE'] = config['conn_max_age']
+    options['transaction_mode'] = config['transaction_mode']
+    connections.close_all()
+    try:
+        with override_settings(SQLITE_PRAGMAS=config['pragmas']):
+            yield
+    finally:
+        connections.close_all()
+        settings_dict['CONN_MAX_AGE'], options['transaction_mode'] = old
+
+
+class Command(BaseCommand):
+    help = ('Seed a scratch database file, then run threads that each read and save one user\'s places '
+            'for a while, first with SQLite\'s default settings and then with the ones in settings.py, '
+            'and compare their throughput, latency and "database is locked" errors.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Threads, each acting as a different user')
+        parser.add_argument('--places', type=int, default=2000, help='Places per user')
+        parser.add_argument('--writes', type=float, default=0.2, help='Fraction of operations that save a place')
+        parser.add_argument('--seconds', type=float, default=10, help='How long to run each configuration')
+        parser.add_argument('--file', help='Build the scratch database in this file. '
+                                           'Defaults to a temporary file, since threads share it')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            with scratch_database(options['file'] or f'{directory}/benchmark.sqlite3'):
+                self.stdout.write(f'Seeding {options["threads"]} users × {options["places"]} places...')
+                users = seed_places(options['threads'], options['places'])
+                place_pks = {user.pk: list(Place.objects.filter(user=user).values_list('pk', flat=True))
+                             for user in users}
+
+                for label, config in (('SQLite defaults', DEFAULT_CONFIG), ('settings.py', tuned_config())):
+                    with database_config(config):
+                        results = self.run_threads(users, place_pks, options)
+                    self.report(label, config, results, options['seconds'])
+
+    def run_threads(self, users, place_pks, options):
+        results = {'read': [], 'write': [], 'errors': []}
+        lock = threading.Lock()
+        stop_at = time.perf_counter() + options['seconds']
+
+        def work(user, seed):
+            rng = random.Random(seed)
+            samples = {'read': [], 'write': [], 'errors': []}
+            try:
+                while time.perf_counter() < stop_at:
+                    kind = 'write' if rng.random() < options['writes'] else 'read'
+                    start = time.perf_counter()
+                    try:
+                        if kind == 'write':
+                            place = Place.objects.get(pk=rng.choice(place_pks[user.pk]))
+                            place.notes = f'Note {rng.randrange(10 ** 6)}'
+                            place.save()
+                        else:
+                            # What the wishlist page reads
+                            list(Place.objects.filter(user=user, visited=False).order_by('name', 'pk')[:50])
+                        samples[kind].append(time.perf_counter() - start)
+                    except OperationalError as error:
+                        samples['errors'].append(str(error))
+                    # The end of a request, which closes the connection unless CONN_MAX_AGE keeps it
+                    close_old_connections()
+            finally:
+                connection.close()
+                with lock:
+                    for key, values in samples.items():
+                        results[key] += values
+
+        threads = [threading.Thread(target=work, args=(user, n)) for n, user in enumerate(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def report(self, label, config, results, seconds):
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        pragmas = ', '.join(f'{name}={value}' for name, value in config['pragmas'].items())
+        self.stdout.write(f'  {pragmas}, CONN_MAX_AGE={config["conn_max_age"]}, '
+                          f'transaction_mode={config["transaction_mode"]}')
+        for kind in ('read', 'write'):
+            samples = results[kind]
+            if samples:
+                self.stdout.write(f'  {kind}s: {len(samples) / seconds:8.1f}/s  {format_summary(summarize(samples))}')
+        errors = results['errors']
+        if errors:
+            self.stdout.write(self.style.ERROR(f'  {len(errors)} errors, such as: {errors[0]}'))
+        else:
+            self.stdout.write('  no errors')
@@ -0,0 +1,65 @@
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.template import engines
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+from travel_wishlist.benchmarks import format_summary, scratch_database, seed_places, summarize, time_calls
+from travel_wishlist.forms import NewPlaceForm
+from travel_wishlist.models import Place
+from travel_wishlist.pagination import paginate
+
+# The place rows as they were, each with its own form, CSRF token and URL
+# reverses, to compare with
+PER_ROW_FORMS = '''{% extends 'travel_wishlist/base.html' %}
+{% block content %}
+{% for place in places %}
+<div class="wishlist-place">
+    <input type="checkbox" id="select-place-{{ place.pk }}" name="place_pk" value="{{ place.pk }}" form="bulk-actions"
+           aria-label="Select {{ place.name }}">
+    <span id="place-name-{{ place.pk }}" class="place-name">
+      <a href="{% url 'place_details' place_pk=place.pk %}">{{ place.name }}</a>
+    </span>
+    <form class="visited-form" method="POST" action="{% url 'place_was_visited' place.pk %}">
+        {% csrf_token %}
+        <button id="visited-button-{{ place.pk }}" type="submit">Visited!</button>
+    </form>
+</div>
+{% endfor %}
+{% endblock %}
+'''
+
+
+class Command(BaseCommand):
+    help = ('Time rendering the wishlist page with every place on one page, at several list sizes: '
+            'with a form per place as it used to be, and with the one shared form, with no place rows '
+            'cached yet (cold) and with all of them cached (warm).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000], help='Places on the page')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed renders of each')
+
+    def handle(self, *args, **options):
+        per_row_forms = engines.all()[0].from_string(PER_ROW_FORMS)
+        with scratch_database():
+            user = seed_places(1, max(options['sizes']), visited_ratio=0)[0]
+            request = RequestFactory().get('/')
+            request.user = user
+            for size in options['sizes']:
+                page = paginate(Place.objects.filter(user=user, visited=False), per_page=size)
+                context = {'places': page.items, 'page': page, 'new_place_form': NewPlaceForm()}
+
+                self.stdout.write(self.style.MIGRATE_HEADING(f'{size} places'))
+                self.report('form per place', time_calls(lambda: per_row_forms.render(context, request),
+                                                         options['repeat']))
+
+                def render_cold():
+                    caches['fragments'].clear()
+                    render_to_string('travel_wishlist/wishlist.html', context, request)
+
+                self.report('shared form, cold', time_calls(render_cold, options['repeat']))
+                self.report('shared form, warm', time_calls(
+                    lambda: render_to_string('travel_wishlist/wishlist.html', context, request), options['repeat']))
+
+    def report(self, label, samples):
+        self.stdout.write(f'  {label:<20} {format_summary(summarize(samples))}')
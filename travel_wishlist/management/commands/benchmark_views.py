@@ -0,0 +1,95 @@
+import json
+import logging
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from travel_wishlist import loadtest
+from travel_wishlist.benchmarks import scratch_database, seed_places
+
+
+class Command(BaseCommand):
+    help = ('Seed a scratch database with users × places × photos, then load test every URL of the app '
+            'with concurrent workers, and report latency percentiles, throughput and queries per request. '
+            'Fails if query or error counts grow, or the statuses change, against the saved baseline, '
+            'LOADTEST_BASELINE unless --baseline names another. With --timings, latency and throughput '
+            'are compared too.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=8, help='Users, each with their own worker')
+        parser.add_argument('--places', type=int, default=1000, help='Places per user')
+        parser.add_argument('--photos', type=int, default=5, help='Places per user with a photo')
+        parser.add_argument('--workers', type=int, default=4, help='Workers sending requests at once')
+        parser.add_argument('--requests', type=int, default=50, help='Requests each worker sends per URL')
+        parser.add_argument('--server', action='store_true',
+                            help='Send requests over HTTP to a local threaded WSGI server, not through the test client')
+        parser.add_argument('--only', nargs='+', metavar='URL_NAME', help='Only load test these URLs')
+        parser.add_argument('--file', help='Build the scratch database in this file. '
+                                           'Defaults to a temporary file, since workers share it')
+        parser.add_argument('--baseline', help='JSON file of results to compare with. Defaults to the '
+                                               'LOADTEST_BASELINE setting')
+        parser.add_argument('--no-baseline', action='store_true', help="Don't compare with a baseline")
+        parser.add_argument('--save-baseline', action='store_true', help='Save the results to the baseline file')
+        parser.add_argument('--timings', action='store_true',
+                            help='Also compare latency and throughput, which only means anything against a '
+                                 'baseline saved on this machine, and save them with --save-baseline')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Fraction by which latency may grow, or throughput fall, before it counts as a regression')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        missing = loadtest.missing_scenarios()
+        if missing:
+            raise CommandError(f'No load test scenario for: {", ".join(missing)}. Add them to loadtest.SCENARIOS.')
+        if options['workers'] > options['users']:
+            raise CommandError('Each worker needs its own user, so --workers can be at most --users.')
+        baseline_file = None if options['no_baseline'] else options['baseline'] or settings.LOADTEST_BASELINE
+        if options['save_baseline'] and not baseline_file:
+            raise CommandError('--save-baseline needs a baseline file to save to.')
+
+        # The test client and the local server send these hosts
+        hosts = [*settings.ALLOWED_HOSTS, 'testserver', '127.0.0.1']
+        with tempfile.TemporaryDirectory() as directory, override_settings(MEDIA_ROOT=directory, ALLOWED_HOSTS=hosts):
+            with scratch_database(options['file'] or f'{directory}/benchmark.sqlite3'):
+                self.stdout.write(f'Seeding {options["users"]} users × {options["places"]} places '
+                                  f'× {options["photos"]} photos...')
+                users = seed_places(options['users'], options['places'], notes_words=8)
+                loadtest.seed_photos(users, options['photos'])
+
+                mode = 'a local WSGI server' if options['server'] else 'the test client'
+                self.stdout.write(f'{options["workers"]} workers × {options["requests"]} requests per URL, through {mode}')
+                # Errors are counted and reported below, rather than logged with a traceback each
+                request_logger = logging.getLogger('django.request')
+                request_logger.disabled, was_disabled = True, request_logger.disabled
+                try:
+                    results = loadtest.run_load_test(users[:options['workers']], options['requests'],
+                                                     scenarios=options['only'], server=options['server'])
+                finally:
+                    request_logger.disabled = was_disabled
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.report(results)
+
+        if baseline_file and options['save_baseline']:
+            with open(baseline_file, 'w') as file:
+                json.dump(results if options['timings'] else loadtest.without_timings(results), file, indent=2)
+                file.write('\n')
+            self.stdout.write(f'Saved the results as the baseline in {baseline_file}')
+        elif baseline_file:
+            problems = loadtest.regressions(results, loadtest.load_baseline(baseline_file),
+                                            timings=options['timings'], tolerance=options['tolerance'])
+            if problems:
+                raise CommandError('Worse than the baseline:\n  ' + '\n  '.join(problems))
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {baseline_file}'))
+
+    def report(self, results):
+        self.stdout.write(f'{"URL":<24} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>8} {"queries":>8} {"errors":>7}')
+        for name, result in results.items():
+            self.stdout.write(f'{name:<24} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+                              f'{result["throughput_rps"]:>8.1f} {result["queries_per_request"]:>8.2f} {result["errors"]:>7}')
+            for example in result['error_examples']:
+                self.stdout.write(self.style.ERROR(f'    {example}'))
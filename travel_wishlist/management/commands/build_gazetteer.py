@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from travel_wishlist import autocomplete
+
+
+class Command(BaseCommand):
+    help = ('Build the sorted gazetteer file that place name suggestions are looked up in, '
+            'from files of place names, one per line.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Files of names, or - for standard input')
+        parser.add_argument('--output', help='Gazetteer file to write. Defaults to the PLACES_GAZETTEER setting')
+        parser.add_argument('--column', type=int,
+                            help='Take the name from this tab separated column, counting from 0, '
+                                 'as in a GeoNames dump, where the name is column 1')
+
+    def handle(self, *args, **options):
+        output = options['output'] or autocomplete.gazetteer_path()
+
+        def names():
+            for path in options['paths']:
+                lines = sys.stdin if path == '-' else open(path, encoding='utf-8')
+                try:
+                    for line in lines:
+                        if options['column'] is None:
+                            yield line
+                        else:
+                            columns = line.rstrip('\n').split('\t')
+                            if len(columns) > options['column']:
+                                yield columns[options['column']]
+                finally:
+                    if lines is not sys.stdin:
+                        lines.close()
+
+        with open(output, 'wb') as file:
+            written = autocomplete.write_gazetteer(names(), file)
+
+        if options['verbosity'] > 0:
+            self.stdout.write(f'Wrote {written} names to {output}')
@@ -0,0 +1,48 @@
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from travel_wishlist import deletions
+
+
+class Command(BaseCommand):
+    help = ('Delete stored photos and renditions that no place refers to, such as files left by a crash '
+            'between storing an upload and saving its place. Files and rows are compared in name order, '
+            'a batch at a time, so memory use doesn\'t grow with the number of photos.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='List the orphaned files, but delete nothing')
+        parser.add_argument('--min-age', type=float, default=24,
+                            help='Only delete files last modified at least this many hours ago')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Names read from the database, and files deleted, at a time')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='Delete at most this many files a second; 0 for no limit')
+        parser.add_argument('--top', default='user_images', help='Directory of the photo storage to check')
+
+    def handle(self, *args, **options):
+        orphans = deletions.orphaned_files(top=options['top'], min_age=timedelta(hours=options['min_age']),
+                                           batch_size=options['batch_size'])
+        found = deleted = 0
+        start = time.monotonic()
+        while batch := list(islice(orphans, options['batch_size'])):
+            found += len(batch)
+            if options['verbosity'] > 1 or (options['dry_run'] and options['verbosity'] > 0):
+                for name in batch:
+                    self.stdout.write(name)
+            if options['dry_run']:
+                continue
+            chunk_size = max(int(options['rate']), 1) if options['rate'] else len(batch)
+            for offset in range(0, len(batch), chunk_size):
+                deleted += deletions.delete_orphans(batch[offset:offset + chunk_size])
+                if options['rate']:
+                    # Wait until the deletions so far are no more than --rate a second
+                    time.sleep(max(0, deleted / options['rate'] - (time.monotonic() - start)))
+
+        if options['verbosity'] > 0:
+            if options['dry_run']:
+                self.stdout.write(f'Found {found} orphaned files, deleted none (dry run)')
+            else:
+                self.stdout.write(f'Found {found} orphaned files, deleted {deleted}')
@@ -0,0 +1,41 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from travel_wishlist import bulk
+
+
+class Command(BaseCommand):
+    help = ('Import places from JSON lines or CSV, in the shape of fixtures/test_places.json, '
+            'reading the file as a stream and inserting the places in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for standard input')
+        parser.add_argument('--user', help='Username to import the places for, instead of the user in each record')
+        parser.add_argument('--format', choices=bulk.FORMATS,
+                            help='Defaults to csv for .csv files and jsonl for anything else')
+        parser.add_argument('--batch-size', type=int, help='Places inserted per transaction')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'No user named {options["user"]}')
+
+        path = options['path']
+        import_format = options['format'] or bulk.guess_format(path)
+        stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            records = bulk.read_records(stream, import_format)
+            imported = bulk.import_places(records, user=user, batch_size=options['batch_size'])
+        except bulk.PlaceImportError as error:
+            raise CommandError(f'{error} {error.imported} places were imported before it.')
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+        if options['verbosity'] > 0:
+            self.stdout.write(f'Imported {imported} places')
@@ -0,0 +1,33 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from travel_wishlist import deletions
+
+
+class Command(BaseCommand):
+    help = 'Delete stored photos queued for deletion when places are deleted or their photo is replaced.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=5,
+                            help='Give up on a file after this many failed deletions')
+        parser.add_argument('--retry-delay', type=float, default=30,
+                            help='Seconds before the first retry of a failed deletion; doubles each time')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, checking the queue every --interval seconds')
+        parser.add_argument('--interval', type=float, default=10)
+
+    def handle(self, *args, **options):
+        while True:
+            processed, failed = deletions.drain(
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+                retry_delay=timedelta(seconds=options['retry_delay']),
+            )
+            if (processed and options['verbosity'] > 0) or options['verbosity'] > 1:
+                self.stdout.write(f'Processed {processed} queued photo deletions, {failed} failed')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
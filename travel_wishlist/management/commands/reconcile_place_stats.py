@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from travel_wishlist.models import PlaceStats, VisitYear, rebuild_place_stats
+
+
+class Command(BaseCommand):
+    help = ('Count every user\'s places again and rebuild their PlaceStats and VisitYears, '
+            'fixing any drift, such as from places changed with QuerySet.update. '
+            'Users are rebuilt in batches, each in its own transaction.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Users rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        user_ids = User.objects.order_by('pk').values_list('pk', flat=True)
+        checked = fixed = 0
+        last_pk = None
+        while True:
+            batch = list((user_ids if last_pk is None else user_ids.filter(pk__gt=last_pk))[:options['batch_size']])
+            if not batch:
+                break
+            before = stats_snapshot(batch)
+            rebuild_place_stats(batch)
+            after = stats_snapshot(batch)
+            fixed += sum(before.get(user_id) != after.get(user_id) for user_id in batch)
+            checked += len(batch)
+            last_pk = batch[-1]
+
+        if options['verbosity'] > 0:
+            self.stdout.write(f'Checked the stats of {checked} users, {fixed} were wrong and have been fixed')
+
+
+def stats_snapshot(user_ids):
+    """ Each user's counts and visits by year, to compare. """
+    snapshot = {stats.user_id: [stats.wishlist_count, stats.visited_count, set()]
+                for stats in PlaceStats.objects.filter(user_id__in=user_ids)}
+    for year in VisitYear.objects.filter(user_id__in=user_ids, visits__gt=0):
+        snapshot.setdefault(year.user_id, [None, None, set()])[2].add((year.year, year.visits))
+    return snapshot
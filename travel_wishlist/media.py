@@ -0,0 +1,152 @@
+"""
+Uploaded photos, served only to the users whose places they belong to.
+
+A photo can be seen by anyone with a place that uses it, and so can its resized
+renditions. Anything else is a 404, whether or not another user has the photo:
+names are hashes of the contents, so a 403 would tell anyone who has a copy of
+an image that someone uploaded it.
+
+Once the check passes, the file is sent in one of three ways, by MEDIA_SENDFILE:
+
+    None (the default)   Django sends it with FileResponse, which the WSGI
+                         server sends with sendfile when it can
+    'x-accel-redirect'   nginx sends it: the response is empty, with an
+                         X-Accel-Redirect header to MEDIA_INTERNAL_URL + the
+                         name, a location nginx only serves internally
+    'x-sendfile'         Apache (mod_xsendfile) or lighttpd sends it, from
+                         the path in an X-Sendfile header
+
+Photos are stored by content hash (see storage.py), so a name never changes
+contents: responses have an ETag and are cached privately for a year.
+Range requests for a single range get a 206; the proxy handles them itself.
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+from .models import PhotoRendition, Place
+from .storage import photo_storage
+
+
+SENDFILE_METHODS = ('x-accel-redirect', 'x-sendfile')
+
+CACHE_SECONDS = 365 * 24 * 60 * 60
+
+CHUNK_SIZE = 64 * 1024
+
+_range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def sendfile_method():
+    return getattr(settings, 'MEDIA_SENDFILE', None)
+
+
+def internal_url():
+    return getattr(settings, 'MEDIA_INTERNAL_URL', '/protected-media/')
+
+
+def check_photo_access(user, name):
+    """ Raise Http404 unless name is the photo of one of user's places, or a
+    rendition of one. """
+    renditions = PhotoRendition.objects.filter(name=name).values('source')
+    if not Place.objects.filter(user=user).filter(Q(photo=name) | Q(photo__in=renditions)).exists():
+        raise Http404('No photo matches the given name.')
+
+
+def byte_range(header, size):
+    """ The (start, end) of a Range header asking for one range of a file of
+    size bytes, end inclusive. None to send the whole file: no header, one
+    that isn't bytes=start-end, or several ranges. Raises ValueError for a
+    range that isn't satisfiable. """
+    match = _range_re.match(header.strip()) if header else None
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        start, end = max(size - int(end), 0), size - 1   # the last end bytes
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def read_range(file, start, end):
+    with file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+@login_required
+@require_safe
+def serve_photo(request, name):
+    check_photo_access(request.user, name)
+
+    storage = photo_storage()
+    try:
+        path = storage.path(name)
+        stat = os.stat(path)
+    except (OSError, ValueError):   # ValueError: a name outside MEDIA_ROOT
+        raise Http404('No photo matches the given name.')
+
+    etag = '"%s"' % hashlib.sha256(f'{name}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:32]
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = photo_response(request, name, path, stat.st_size, etag)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    patch_cache_control(response, private=True, max_age=CACHE_SECONDS, immutable=True)
+    return response
+
+
+def photo_response(request, name, path, size, etag):
+    content_type, _ = mimetypes.guess_type(name)
+    content_type = content_type or 'application/octet-stream'
+    method = sendfile_method()
+    if method in SENDFILE_METHODS:
+        response = HttpResponse(content_type=content_type)
+        if method == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = internal_url() + quote(name)
+        else:
+            response['X-Sendfile'] = path
+        return response
+
+    # If-Range: only send part of the file if the client's copy is this one
+    if_range = request.headers.get('If-Range')
+    try:
+        requested = byte_range(request.headers.get('Range'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if requested is None or (if_range and etag not in parse_etags(if_range)):
+        response = FileResponse(photo_storage().open(name), filename=os.path.basename(name))
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    start, end = requested
+    response = StreamingHttpResponse(read_range(photo_storage().open(name), start, end), status=206,
+                                     content_type=content_type)
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
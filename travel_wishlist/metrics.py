@@ -0,0 +1,327 @@
+"""
+Per-view request metrics, in the Prometheus text format at /metrics.
+
+MetricsMiddleware times each request and counts what it spent the time on:
+wall time, database queries and their time (heard with db.listening_to_queries),
+template rendering (with TimedDjangoTemplates, the template backend in
+settings), and storage I/O (timed by ContentAddressedStorage). Each is kept as
+a histogram per view, by URL name. Like any Prometheus histogram, the counts
+only ever go up; rates over a window come from PromQL's rate().
+
+Recording only happens while someone is scraping. A scrape notes the time, and
+while the last scrape was less than METRICS_ACTIVE_SECONDS ago, each process
+records its requests in memory and adds them to a shared SQLite file,
+METRICS_DB, at most every METRICS_FLUSH_SECONDS. A scrape reads the totals of
+every process from that file. When nobody has scraped for a while, the
+middleware only checks, every few seconds, whether someone has started again.
+Without METRICS_DB, each process reports only its own requests.
+
+Time spent streaming a response body, such as an export, happens after the
+view returns, and isn't counted.
+"""
+
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from django.template.backends.django import DjangoTemplates
+
+from .db import listening_to_queries
+
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# name: (help, buckets)
+METRICS = {
+    'request_seconds': ('Wall time of each request, from the first middleware to the response.', SECONDS_BUCKETS),
+    'db_queries': ('Database queries made by each request.', COUNT_BUCKETS),
+    'db_seconds': ('Time each request spent waiting for the database.', SECONDS_BUCKETS),
+    'template_seconds': ('Time each request spent rendering templates.', SECONDS_BUCKETS),
+    'storage_seconds': ('Time each request spent reading and writing stored files.', SECONDS_BUCKETS),
+}
+PREFIX = 'wishlist_'
+
+CHECK_SECONDS = 5   # how often an idle process looks for a recent scrape
+
+
+def metrics_db():
+    return getattr(settings, 'METRICS_DB', None)
+
+
+def active_seconds():
+    return getattr(settings, 'METRICS_ACTIVE_SECONDS', 300)
+
+
+def flush_seconds():
+    return getattr(settings, 'METRICS_FLUSH_SECONDS', 10)
+
+
+class RequestMetrics:
+    """ What one request has spent its time on so far. """
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.storage_seconds = 0.0
+
+    def query(self, sql, params, context, seconds):
+        self.db_queries += 1
+        self.db_seconds += seconds
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+@contextmanager
+def timing(kind):
+    """ Add the time the block takes to the current request's template or
+    storage time. Does nothing outside a recorded request. """
+    request_metrics = _current.get()
+    if request_metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(request_metrics, f'{kind}_seconds',
+                getattr(request_metrics, f'{kind}_seconds') + time.perf_counter() - start)
+
+
+class Histograms:
+    """ Bucket counts, sums and counts by (metric, view), as a dict of
+    (metric, view, key) -> number, where key is a bucket's index, 'sum' or 'count'. """
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, view, observations):
+        with self.lock:
+            for name, value in observations.items():
+                buckets = METRICS[name][1]
+                index = next((n for n, bound in enumerate(buckets) if value <= bound), len(buckets))
+                for key, amount in ((index, 1), ('sum', value), ('count', 1)):
+                    self.values[name, view, key] = self.values.get((name, view, key), 0) + amount
+
+    def take(self):
+        """ Everything observed since the last take. """
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+
+
+class Store:
+    """ Totals from every process, and when the last scrape was, in a SQLite file. """
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS metric (name TEXT, view TEXT, key TEXT, value REAL, '
+                   'PRIMARY KEY (name, view, key))')
+        db.execute('CREATE TABLE IF NOT EXISTS scrape (id INTEGER PRIMARY KEY CHECK (id = 1), at REAL)')
+        return db
+
+    def add(self, values):
+        if not values:
+            return
+        db = self.connect()
+        try:
+            with db:
+                db.execute('BEGIN IMMEDIATE')
+                db.executemany('INSERT INTO metric VALUES (?, ?, ?, ?) '
+                               'ON CONFLICT (name, view, key) DO UPDATE SET value = value + excluded.value',
+                               [(name, view, str(key), value) for (name, view, key), value in values.items()])
+        finally:
+            db.close()
+
+    def totals(self):
+        db = self.connect()
+        try:
+            return {(name, view, int(key) if key.isdigit() else key): value
+                    for name, view, key, value in db.execute('SELECT name, view, key, value FROM metric')}
+        finally:
+            db.close()
+
+    def last_scrape(self):
+        db = self.connect()
+        try:
+            row = db.execute('SELECT at FROM scrape WHERE id = 1').fetchone()
+            return row[0] if row else 0
+        finally:
+            db.close()
+
+    def scraped(self, at):
+        db = self.connect()
+        try:
+            db.execute('INSERT INTO scrape VALUES (1, ?) ON CONFLICT (id) DO UPDATE SET at = excluded.at', [at])
+        finally:
+            db.close()
+
+
+class Recorder:
+    """ This process's histograms, and whether to record at all. """
+
+    def __init__(self):
+        self.pending = Histograms()   # not yet added to the store
+        self.totals = Histograms()    # everything, when there's no store
+        self.last_scrape = 0
+        self.last_check = 0
+        self.last_flush = time.monotonic()
+        self.pid = os.getpid()
+
+    def store(self):
+        path = metrics_db()
+        return Store(path) if path else None
+
+    def active(self):
+        """ Whether anyone has scraped recently, checking the store every few seconds. """
+        now = time.time()
+        if now - self.last_check > CHECK_SECONDS:
+            self.last_check = now
+            store = self.store()
+            if store is not None:
+                self.last_scrape = store.last_scrape()
+        return now - self.last_scrape < active_seconds()
+
+    def observe(self, view, observations):
+        if os.getpid() != self.pid:   # forked since, so the pending values are the parent's
+            self.__init__()
+        (self.pending if self.store() else self.totals).observe(view, observations)
+        if time.monotonic() - self.last_flush > flush_seconds():
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        store = self.store()
+        if store is not None:
+            store.add(self.pending.take())
+
+    def scrape(self):
+        """ Note the scrape, so every process records, and return the totals. """
+        self.last_scrape = self.last_check = time.time()
+        store = self.store()
+        if store is None:
+            return dict(self.totals.values)
+        store.scraped(self.last_scrape)
+        self.flush()
+        return store.totals()
+
+
+recorder = Recorder()
+
+
+class MetricsMiddleware:
+    """ Record each request's metrics under its view's URL name, while someone
+    is scraping /metrics. Goes first in MIDDLEWARE, to time all the others.
+    Async under ASGI, so async views aren't moved to a thread for it. """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not recorder.active():
+            return self.get_response(request)
+        with recording(request):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not recorder.active():
+            return await self.get_response(request)
+        with recording(request):
+            return await self.get_response(request)
+
+
+@contextmanager
+def recording(request):
+    """ Record the metrics of the request handled in the block. """
+    request_metrics = RequestMetrics()
+    token = _current.set(request_metrics)
+    start = time.perf_counter()
+    try:
+        with listening_to_queries(request_metrics.query):
+            yield
+    finally:
+        _current.reset(token)
+    wall_seconds = time.perf_counter() - start
+
+    match = getattr(request, 'resolver_match', None)
+    view = (match.view_name if match else None) or 'unmatched'
+    if view != 'metrics':
+        recorder.observe(view, {
+            'request_seconds': wall_seconds,
+            'db_queries': request_metrics.db_queries,
+            'db_seconds': request_metrics.db_seconds,
+            'template_seconds': request_metrics.template_seconds,
+            'storage_seconds': request_metrics.storage_seconds,
+        })
+
+
+class TimedTemplate:
+    """ A template from TimedDjangoTemplates, timing each render. """
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        with timing('template'):
+            return self.template.render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """ The Django template backend, with render time counted in the request's metrics. """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def render_prometheus(values):
+    """ values from Histograms, in the Prometheus text exposition format. """
+    lines = []
+    for name, (help_text, buckets) in METRICS.items():
+        metric = PREFIX + name
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+        views = sorted({view for (value_name, view, key) in values if value_name == name})
+        for view in views:
+            label = view.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for index, bound in enumerate([*buckets, '+Inf']):
+                cumulative += values.get((name, view, index), 0)
+                lines.append(f'{metric}_bucket{{view="{label}",le="{bound}"}} {cumulative:g}')
+            lines.append(f'{metric}_sum{{view="{label}"}} {values.get((name, view, "sum"), 0):.6f}')
+            lines.append(f'{metric}_count{{view="{label}"}} {values.get((name, view, "count"), 0):g}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """ Every process's metrics, for Prometheus. Staff only: scrape with a staff
+    user's session cookie. Scraping turns recording on, see above. """
+    if not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(render_prometheus(recorder.scrape()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.4 on 2026-10-18 07:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('travel_wishlist', '0002_alter_place_id_alter_place_photo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(condition=models.Q(('visited', False)), fields=['user', 'name'], name='place_wishlist_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(condition=models.Q(('visited', True)), fields=['user', 'name'], name='place_visited_idx'),
+        ),
+    ]
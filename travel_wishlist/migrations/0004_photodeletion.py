@@ -0,0 +1,25 @@
+# Generated by Django 6.0.4 on 2026-10-18 07:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('travel_wishlist', '0003_place_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('next_attempt', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0.4 on 2026-10-18 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('travel_wishlist', '0004_photodeletion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255)),
+                ('width', models.PositiveIntegerField()),
+                ('name', models.CharField(blank=True, max_length=255)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('source', 'width'), name='unique_rendition_width')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.0.4 on 2026-10-18 07:12
+
+import travel_wishlist.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('travel_wishlist', '0005_photorendition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('refcount', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='place',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, storage=travel_wishlist.storage.photo_storage, upload_to='user_images/'),
+        ),
+    ]
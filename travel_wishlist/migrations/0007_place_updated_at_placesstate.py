@@ -0,0 +1,38 @@
+# Generated by Django 6.0.4 on 2026-10-18 07:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def create_places_states(apps, schema_editor):
+    Place = apps.get_model('travel_wishlist', 'Place')
+    PlacesState = apps.get_model('travel_wishlist', 'PlacesState')
+    now = timezone.now()
+    user_ids = Place.objects.values_list('user_id', flat=True).distinct()
+    PlacesState.objects.bulk_create(PlacesState(user_id=user_id, last_modified=now) for user_id in user_ids)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('travel_wishlist', '0006_photoblob_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlacesState',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_modified', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(create_places_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+"""
+An FTS5 index over the names and notes of places, kept up to date by triggers.
+The user_id is indexed too, so a search only ranks the user's own places. See
+travel_wishlist/search.py. Databases without FTS5 are left as they are,
+and search falls back to LIKE queries.
+"""
+
+from django.db import migrations
+
+
+CREATE_TABLE = """
+    CREATE VIRTUAL TABLE travel_wishlist_place_fts USING fts5(
+        name, notes, user_id,
+        content='travel_wishlist_place', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )"""
+
+CREATE_TRIGGERS = [
+    """
+    CREATE TRIGGER travel_wishlist_place_fts_insert AFTER INSERT ON travel_wishlist_place BEGIN
+        INSERT INTO travel_wishlist_place_fts (rowid, name, notes, user_id) VALUES (new.id, new.name, new.notes, new.user_id);
+    END""",
+    """
+    CREATE TRIGGER travel_wishlist_place_fts_delete AFTER DELETE ON travel_wishlist_place BEGIN
+        INSERT INTO travel_wishlist_place_fts (travel_wishlist_place_fts, rowid, name, notes, user_id)
+        VALUES ('delete', old.id, old.name, old.notes, old.user_id);
+    END""",
+    """
+    CREATE TRIGGER travel_wishlist_place_fts_update AFTER UPDATE OF name, notes, user_id ON travel_wishlist_place BEGIN
+        INSERT INTO travel_wishlist_place_fts (travel_wishlist_place_fts, rowid, name, notes, user_id)
+        VALUES ('delete', old.id, old.name, old.notes, old.user_id);
+        INSERT INTO travel_wishlist_place_fts (rowid, name, notes, user_id) VALUES (new.id, new.name, new.notes, new.user_id);
+    END""",
+]
+
+
+def fts5_supported(schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute('CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(text)')
+        except Exception:
+            return False
+        cursor.execute('DROP TABLE temp.fts5_probe')
+    return True
+
+
+def create_search_index(apps, schema_editor):
+    if not fts5_supported(schema_editor):
+        return
+    schema_editor.execute(CREATE_TABLE)
+    for trigger in CREATE_TRIGGERS:
+        schema_editor.execute(trigger)
+    # Index the places that are already there
+    schema_editor.execute("INSERT INTO travel_wishlist_place_fts (travel_wishlist_place_fts) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for name in ('insert', 'delete', 'update'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS travel_wishlist_place_fts_{name}')
+    schema_editor.execute('DROP TABLE IF EXISTS travel_wishlist_place_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('travel_wishlist', '0007_place_updated_at_placesstate'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
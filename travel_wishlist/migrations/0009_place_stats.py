@@ -0,0 +1,57 @@
+# Generated by Django 6.0.4 on 2026-10-18 07:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+
+
+def count_places(apps, schema_editor):
+    # A frozen copy of models.rebuild_place_stats, for every user with places
+    Place = apps.get_model('travel_wishlist', 'Place')
+    PlaceStats = apps.get_model('travel_wishlist', 'PlaceStats')
+    VisitYear = apps.get_model('travel_wishlist', 'VisitYear')
+
+    stats = {}
+    for row in Place.objects.values('user_id', 'visited').annotate(places=Count('pk')).order_by():
+        user_stats = stats.setdefault(row['user_id'], PlaceStats(user_id=row['user_id']))
+        setattr(user_stats, 'visited_count' if row['visited'] else 'wishlist_count', row['places'])
+    PlaceStats.objects.bulk_create(stats.values())
+
+    years = (Place.objects.filter(visited=True, date_visited__isnull=False)
+             .values('user_id', year=ExtractYear('date_visited')).annotate(visits=Count('pk')).order_by())
+    VisitYear.objects.bulk_create(VisitYear(user_id=row['user_id'], year=row['year'], visits=row['visits']) for row in years)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('travel_wishlist', '0008_place_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('wishlist_count', models.IntegerField(default=0)),
+                ('visited_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VisitYear',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField()),
+                ('visits', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'year'), name='unique_visit_year')],
+            },
+        ),
+        migrations.RunPython(count_places, migrations.RunPython.noop),
+    ]
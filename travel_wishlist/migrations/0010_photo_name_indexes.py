@@ -0,0 +1,21 @@
+# Generated by Django 6.0.4 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('travel_wishlist', '0009_place_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photorendition',
+            index=models.Index(fields=['name'], name='photorendition_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['photo'], name='place_photo_idx'),
+        ),
+    ]
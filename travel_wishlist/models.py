@@ -1,6 +1,15 @@
-from django.db import models
+from collections import Counter
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, When
+from django.db.models.functions import ExtractYear
+from django.db.models.fields.files import FieldFile
 from django.contrib.auth.models import User
-from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .autocomplete import place_name_saved
+from .cache import bump_places_version
+from .storage import photo_storage
 
 
 class Place(models.Model):
@@ -9,31 +18,373 @@ class Place(models.Model):
     visited = models.BooleanField(default=False)
     notes = models.TextField(blank=True, null=True)
     date_visited = models.DateField(blank=True, null=True)
-    photo = models.ImageField(upload_to='user_images/', blank=True, null=True)
+    photo = models.ImageField(upload_to='user_images/', storage=photo_storage, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Serve the wishlist and visited pages, which filter on user and visited and
+            # sort by name, straight from an index with no separate sort step.
+            # Django writes visited=False as "NOT visited" rather than "visited = 0", so a
+            # composite (user, visited, name) index can't be used for the visited term;
+            # a partial index per list matches the generated WHERE clause exactly.
+            models.Index(fields=['user', 'name'], condition=models.Q(visited=False), name='place_wishlist_idx'),
+            models.Index(fields=['user', 'name'], condition=models.Q(visited=True), name='place_visited_idx'),
+            # Photos are looked up by stored name before their files are deleted, and
+            # read in name order to find orphaned files (see deletions.py)
+            models.Index(fields=['photo'], name='place_photo_idx'),
+        ]
+
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded, so save() can work out what changed
+        # without selecting the old row again.
+        instance._loaded_values = instance._field_values()
+        return instance
+
+
+    def _field_values(self):
+        values = {}
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__:   # skip deferred fields that were never loaded
+                value = getattr(self, field.attname)
+                values[field.attname] = value.name if isinstance(value, FieldFile) else value
+        return values
+
+
+    def changed_fields(self):
+        """ Names of the fields that differ from the values loaded from the database. """
+        loaded = getattr(self, '_loaded_values', {})
+        current = self._field_values()
+        return [field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname in current
+                and (field.attname not in loaded or current[field.attname] != loaded[field.attname])]
 
 
     def save(self, *args, **kwargs):
-        # get reference to previous version of this Place 
-        old_place = Place.objects.filter(pk=self.pk).first()
-        if old_place and old_place.photo:
-            if old_place.photo != self.photo:
-                self.delete_photo(old_place.photo)
+        loaded = getattr(self, '_loaded_values', None)
+        adding = self._state.adding
+        photo_changed = self._state.adding
+        old_photo = None
+
+        if loaded is not None and not self._state.adding:
+            # Only write the columns that changed since this Place was loaded
+            changed = self.changed_fields()
+            if kwargs.get('update_fields') is None:
+                kwargs['update_fields'] = changed
+
+            if 'photo' in changed and 'photo' in kwargs['update_fields']:
+                photo_changed = True
+                old_photo = loaded.get('photo')
+
+            # auto_now only reaches the database if updated_at is one of the fields written
+            if kwargs['update_fields'] and 'updated_at' not in kwargs['update_fields']:
+                kwargs['update_fields'] = [*kwargs['update_fields'], 'updated_at']
 
         super().save(*args, **kwargs)
+        self._loaded_values = self._field_values()
+
+        if kwargs.get('update_fields') != []:
+            places_changed(self.user_id)
+            self.update_stats(adding, loaded, kwargs.get('update_fields'))
+        if adding or (loaded is not None and 'name' in (kwargs.get('update_fields') or ())):
+            # Without the loaded values, the old name isn't known, and the
+            # version bump has the user's names loaded again instead
+            old_name = None if adding else loaded.get('name')
+            user_id, name = self.user_id, self.name
+            transaction.on_commit(lambda: place_name_saved(user_id, old_name, name))
+        if photo_changed and self.photo:
+            acquire_photo(self.photo.name)   # the name is only final once the file is stored
+        if old_photo:
+            self.delete_photo(old_photo)
             
 
+    def update_stats(self, adding, loaded, update_fields):
+        """ Count this place's change in its user's PlaceStats and VisitYears,
+        from the values it was loaded with and the values just written. """
+        if adding:
+            update_place_stats(stats_changes(self.user_id, self.visited, self.date_visited))
+            return
+        stats_fields = ('user_id', 'visited', 'date_visited')
+        if loaded is None or any(field not in loaded for field in stats_fields):
+            rebuild_place_stats([self.user_id])   # no way to tell what changed
+            return
+        written = {self._meta.get_field(name).attname for name in update_fields} if update_fields is not None else set(stats_fields)
+        if written.isdisjoint(stats_fields):
+            return
+        new = [getattr(self, field) if field in written else loaded[field] for field in stats_fields]
+        changes = stats_changes(*new)
+        changes.update(stats_changes(*[loaded[field] for field in stats_fields], places=-1))
+        update_place_stats(changes)
+
+
     def delete(self, *args, **kwargs):
-        if self.photo:
-            self.delete_photo(self.photo)
+        photo_name = self.photo.name if self.photo else None
+
+        result = super().delete(*args, **kwargs)
+        places_changed(self.user_id)
+        update_place_stats(stats_changes(self.user_id, self.visited, self.date_visited, places=-1))
 
-        super().delete(*args, **kwargs)
+        if photo_name:
+            self.delete_photo(photo_name)
+        return result
 
     
-    def delete_photo(self, photo):
-        if default_storage.exists(photo.name):
-            default_storage.delete(photo.name)
+    def delete_photo(self, photo_name):
+        """ Drop this place's reference to a stored photo. If no other place uses
+        it, the photo and its resized renditions are queued for deletion by the
+        process_photo_deletions command, once the current transaction commits.
+        Nothing is deleted if it rolls back. """
+        release_photos([photo_name])
 
 
     def __str__(self):
         photo_str = self.photo.url if self.photo else 'no photo'
         return f'{self.pk}: {self.name} visited? {self.visited} on {self.date_visited}\nPhoto {photo_str}'
+
+
+
+class PlacesState(models.Model):
+    """ When a user's places last changed, for Last-Modified and ETag headers.
+    Deleting a place leaves no row behind to take an updated_at from, so this is
+    kept separately from the places' own updated_at. """
+    user = models.OneToOneField('auth.User', primary_key=True, on_delete=models.CASCADE)
+    last_modified = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.user_id}: places changed {self.last_modified}'
+
+
+class PlaceStats(models.Model):
+    """ How many places a user has on their wishlist and has visited, kept up to
+    date as places change, so pages don't count them. See update_place_stats. """
+    user = models.OneToOneField('auth.User', primary_key=True, on_delete=models.CASCADE)
+    wishlist_count = models.IntegerField(default=0)
+    visited_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.wishlist_count} to visit, {self.visited_count} visited'
+
+
+class VisitYear(models.Model):
+    """ How many of a user's visited places they visited in a year, by date_visited. """
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE)
+    year = models.PositiveIntegerField()
+    visits = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'year'], name='unique_visit_year'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}: {self.visits} places visited in {self.year}'
+
+
+class PhotoBlob(models.Model):
+    """ How many places use a stored photo. Photos are stored by content hash,
+    so places that were given the same photo share one file. """
+    name = models.CharField(max_length=255, unique=True)
+    refcount = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name} used by {self.refcount}'
+
+
+class PhotoRendition(models.Model):
+    """ A resized copy of a stored photo, used in the srcset of the place detail page.
+    Keyed on the stored name of the photo it was made from. If the photo is narrower
+    than width, no copy is needed and name is blank. """
+    source = models.CharField(max_length=255)
+    width = models.PositiveIntegerField()
+    name = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'width'], name='unique_rendition_width'),
+        ]
+        indexes = [
+            # Served photos are checked by name (see media.py)
+            models.Index(fields=['name'], name='photorendition_name_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.source} at {self.width}px: {self.name or "not needed"}'
+
+
+class PhotoDeletion(models.Model):
+    """ A stored photo waiting to be deleted by the process_photo_deletions command.
+    Failed deletions are retried, backing off, until max attempts is reached. """
+    name = models.CharField(max_length=255)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.attempts} attempts)'
+
+
+def places_changed(user_id):
+    """ Record that a user's places have changed, in any way: move their
+    Last-Modified time on and stop serving their cached pages. Code that
+    changes places with QuerySet.update or delete must call this itself. """
+    PlacesState.objects.bulk_create(
+        [PlacesState(user_id=user_id, last_modified=timezone.now())],
+        update_conflicts=True, unique_fields=['user'], update_fields=['last_modified'],
+    )
+    bump_places_version(user_id)
+
+
+def stats_changes(user_id, visited, date_visited, places=1):
+    """ What places of a user add to their PlaceStats and VisitYears, as a Counter
+    of (user_id, field or year) keys. places is negative to take them away. """
+    year = date_visited.year if date_visited else None
+    return grouped_stats_changes(user_id, [{'visited': visited, 'year': year, 'places': places}])
+
+
+def grouped_stats_changes(user_id, rows, sign=1):
+    """ stats_changes for rows of visited, year and places, as counted by _stats_groups. """
+    changes = Counter()
+    for row in rows:
+        places = row['places'] * sign
+        changes[user_id, 'visited_count' if row['visited'] else 'wishlist_count'] += places
+        if row['visited'] and row['year'] is not None:
+            changes[user_id, row['year']] += places
+    return changes
+
+
+def _stats_groups(places):
+    """ How many of places there are for each visited and year. """
+    return places.values('visited', year=ExtractYear('date_visited')).annotate(places=Count('pk')).order_by()
+
+
+def update_place_stats(changes):
+    """ Add changes, a Counter from stats_changes, to PlaceStats and VisitYears,
+    with an UPDATE of each row. A user whose rows are missing has theirs rebuilt
+    from their places instead. Code that changes places with QuerySet.update or
+    delete must call this itself, as with places_changed. """
+    by_user = {}
+    for (user_id, key), change in changes.items():
+        if change:
+            by_user.setdefault(user_id, {})[key] = change
+
+    for user_id, user_changes in by_user.items():
+        counts = {key: F(key) + change for key, change in user_changes.items() if isinstance(key, str)}
+        years = {key: change for key, change in user_changes.items() if not isinstance(key, str)}
+        if counts and not PlaceStats.objects.filter(user_id=user_id).update(**counts):
+            rebuild_place_stats([user_id])
+            continue
+        for year, change in years.items():
+            if not VisitYear.objects.filter(user_id=user_id, year=year).update(visits=F('visits') + change):
+                rebuild_place_stats([user_id])   # the first visit that year, or missing rows
+                break
+
+
+def rebuild_place_stats(user_ids):
+    """ Count the places of the users with these pks again, and replace their
+    PlaceStats and VisitYears. Returns the new PlaceStats, by user pk. """
+    stats = {user_id: PlaceStats(user_id=user_id) for user_id in user_ids}
+    if not stats:
+        return stats
+    places = Place.objects.filter(user_id__in=stats)
+    with transaction.atomic():   # so no place changes between counting and writing
+        for row in places.values('user_id', 'visited').annotate(places=Count('pk')).order_by():
+            setattr(stats[row['user_id']], 'visited_count' if row['visited'] else 'wishlist_count', row['places'])
+        visit_years = [VisitYear(user_id=row['user_id'], year=row['year'], visits=row['visits'])
+                       for row in (places.filter(visited=True, date_visited__isnull=False)
+                                   .values('user_id', year=ExtractYear('date_visited'))
+                                   .annotate(visits=Count('pk')).order_by())]
+        PlaceStats.objects.bulk_create(stats.values(), update_conflicts=True, unique_fields=['user'],
+                                       update_fields=['wishlist_count', 'visited_count'])
+        VisitYear.objects.filter(user_id__in=stats).delete()
+        VisitYear.objects.bulk_create(visit_years)
+    return stats
+
+
+def get_place_stats(user_id):
+    """ The user's PlaceStats, made from their places if they have none yet. """
+    stats = PlaceStats.objects.filter(user_id=user_id).first()
+    return stats if stats is not None else rebuild_place_stats([user_id])[user_id]
+
+
+def mark_places_visited(user_id, place_pks):
+    """ Mark the user's places with these pks visited, in one UPDATE. pks that
+    aren't the user's places are ignored. Returns the number of places updated. """
+    if not place_pks:
+        return 0
+    with transaction.atomic():
+        places = Place.objects.filter(user_id=user_id, pk__in=place_pks, visited=False)
+        groups = list(_stats_groups(places))
+        updated = places.update(visited=True, updated_at=timezone.now())
+        if updated:
+            places_changed(user_id)
+            changes = grouped_stats_changes(user_id, groups, sign=-1)
+            changes.update(grouped_stats_changes(user_id, [{**row, 'visited': True} for row in groups]))
+            update_place_stats(changes)
+    return updated
+
+
+def delete_places(user_id, place_pks):
+    """ Delete the user's places with these pks, in one DELETE, and release their
+    photos as a batch. pks that aren't the user's places are ignored. The same
+    few queries however many places there are. Returns the number deleted. """
+    if not place_pks:
+        return 0
+    with transaction.atomic():
+        places = Place.objects.filter(user_id=user_id, pk__in=place_pks)
+        photo_names = list(places.filter(photo__gt='').values_list('photo', flat=True))
+        groups = list(_stats_groups(places))
+        deleted, _ = places.delete()   # nothing refers to places, so this is a single DELETE
+        if deleted:
+            places_changed(user_id)
+            update_place_stats(grouped_stats_changes(user_id, groups, sign=-1))
+            release_photos(photo_names)
+    return deleted
+
+
+def acquire_photo(photo_name):
+    """ Count one more place using a stored photo. """
+    if PhotoBlob.objects.filter(name=photo_name).update(refcount=F('refcount') + 1):
+        return
+    try:
+        with transaction.atomic():
+            PhotoBlob.objects.create(name=photo_name, refcount=1)
+    except IntegrityError:
+        # Another request created the row first
+        PhotoBlob.objects.filter(name=photo_name).update(refcount=F('refcount') + 1)
+
+
+def release_photos(photo_names):
+    """ Count one place fewer for each name (a name can appear more than once).
+    Photos no place uses any more, and their renditions, are queued for deletion.
+    The same handful of queries however many names there are. Photos stored
+    before reference counting have no PhotoBlob row, and are deleted on release. """
+
+    counts = Counter(name for name in photo_names if name)
+    if not counts:
+        return
+
+    blobs = PhotoBlob.objects.filter(name__in=counts)
+    blobs.update(refcount=Case(*[When(name=name, then=F('refcount') - count) for name, count in counts.items()],
+                               default=F('refcount')))
+    in_use = set(blobs.filter(refcount__gt=0).values_list('name', flat=True))
+    unused = [name for name in counts if name not in in_use]
+    if not unused:
+        return
+
+    PhotoBlob.objects.filter(name__in=unused).delete()
+    renditions = PhotoRendition.objects.filter(source__in=unused)
+    rendition_names = [name for name in renditions.values_list('name', flat=True) if name]
+    renditions.delete()
+    queue_photo_deletions(unused + rendition_names)
+
+
+def queue_photo_deletions(photo_names):
+    """ Queue stored photos for deletion, after the current transaction commits.
+    If it rolls back, the rows still point at the photos and nothing is queued. """
+    names = [name for name in photo_names if name]
+    if names:
+        transaction.on_commit(lambda: PhotoDeletion.objects.bulk_create(PhotoDeletion(name=name) for name in names))
@@ -0,0 +1,105 @@
+"""
+Keyset (cursor) pagination for lists of places ordered by (name, pk).
+
+Each page is fetched with WHERE (name, pk) > (last name, last pk) ... LIMIT n,
+which walks the per-list index from the cursor, so a page deep in the list
+costs the same as the first one. OFFSET pagination would have to read and
+throw away every row before the requested page.
+"""
+
+import base64
+import json
+from operator import attrgetter
+
+from django.conf import settings
+from django.db.models import Q
+
+
+def get_page_size():
+    return getattr(settings, 'PLACES_PER_PAGE', 50)
+
+
+def encode_cursor(name, pk):
+    data = json.dumps([name, pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ Return the (name, pk) in a cursor, or None if the cursor is missing or malformed. """
+    if not cursor:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        name, pk = json.loads(data)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(name, str) or not isinstance(pk, int):
+        return None
+    return name, pk
+
+
+class KeysetPage:
+    """ One page of results, and the cursors for the pages either side of it. """
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def paginate(queryset, after=None, before=None, per_page=None, key=attrgetter('name', 'pk')):
+    """ Fetch the page of queryset that follows the after cursor, or precedes the before
+    cursor, or the first page if neither is given.
+
+    key extracts (name, pk) from a result; pass operator.itemgetter('name', 'pk') when
+    queryset is a .values() queryset. The queryset's own ordering is replaced. """
+
+    per_page = per_page or get_page_size()
+    after = decode_cursor(after)
+    before = decode_cursor(before) if not after else None
+
+    if before:
+        name, pk = before
+        # The plain name bound lets SQLite seek straight to the cursor in the index;
+        # the OR on its own is only applied as a filter while scanning from the start.
+        rows = queryset.filter(name__lte=name).filter(Q(name__lt=name) | Q(name=name, pk__lt=pk))
+        rows = rows.order_by('-name', '-pk')
+        items = list(rows[:per_page + 1])
+        has_previous = len(items) > per_page
+        items = items[:per_page]
+        items.reverse()
+        has_next = True
+    else:
+        if after:
+            name, pk = after
+            queryset = queryset.filter(name__gte=name).filter(Q(name__gt=name) | Q(name=name, pk__gt=pk))
+        items = list(queryset.order_by('name', 'pk')[:per_page + 1])
+        has_next = len(items) > per_page
+        items = items[:per_page]
+        has_previous = after is not None
+
+    next_cursor = previous_cursor = None
+    if items:
+        next_cursor = encode_cursor(*key(items[-1])) if has_next else None
+        previous_cursor = encode_cursor(*key(items[0])) if has_previous else None
+    elif after:
+        # Nothing left after the cursor, as when the last places were deleted: link
+        # back to the page ending at it. pk + 1 so the place at the cursor is included.
+        previous_cursor = encode_cursor(after[0], after[1] + 1)
+    elif before:
+        next_cursor = encode_cursor(before[0], before[1] - 1)
+    return KeysetPage(items, next_cursor, previous_cursor)
@@ -0,0 +1,150 @@
+"""
+Profiles single requests on demand, for finding out why a page is slow.
+
+A staff user asks for a profile by adding ?profile to the URL, or sending an
+X-Profile header. The value picks the profiler:
+
+    ?profile or ?profile=cprofile   cProfile, saved as a .pstats file, for
+                                    python -m pstats or snakeviz
+    ?profile=sample                 a stack sampled every PROFILING_SAMPLE_INTERVAL
+                                    seconds, saved as collapsed stacks, one
+                                    "frame;frame;frame count" line per stack,
+                                    for flamegraph.pl or speedscope
+
+Files go in PROFILING_DIR, named after the time, the URL name and the user,
+and the response has the file name in an X-Profile header. Every SQL query the
+request made is logged to the travel_wishlist.profiling logger, with its time.
+
+ProfilingMiddleware goes after AuthenticationMiddleware, so it knows who is
+asking, and profiles the middleware after it and the view. Without
+PROFILING_DIR it takes itself out of the middleware chain. It's sync only, as
+both profilers follow one thread. Under ASGI the async views run on the event
+loop, not in that thread, so profile them through the sync views, under WSGI.
+"""
+
+import cProfile
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .db import listening_to_queries
+
+
+logger = logging.getLogger(__name__)
+
+PROFILERS = ('cprofile', 'sample')
+
+
+def profiling_dir():
+    return getattr(settings, 'PROFILING_DIR', None)
+
+
+def sample_interval():
+    return getattr(settings, 'PROFILING_SAMPLE_INTERVAL', 0.001)
+
+
+def requested_profiler(request):
+    """ The profiler asked for, or None. Unknown values get cProfile. """
+    value = request.GET.get('profile', request.headers.get('X-Profile'))
+    if value is None:
+        return None
+    return value if value in PROFILERS else 'cprofile'
+
+
+class SQLLog:
+    """ A query listener that keeps each query, with its parameters filled in, and its time. """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, sql, params, context, seconds):
+        try:
+            sql = context['connection'].ops.last_executed_query(context['cursor'], sql, params)
+        except Exception:
+            pass   # keep the SQL with placeholders
+        self.queries.append((seconds, sql))
+
+    def log(self, label):
+        total = sum(seconds for seconds, sql in self.queries)
+        logger.info('%s: %d queries in %.1f ms', label, len(self.queries), total * 1000)
+        for seconds, sql in self.queries:
+            logger.info('%8.2f ms  %s', seconds * 1000, sql)
+
+
+class Sampler:
+    """ Samples one thread's stack from a background thread, counting each
+    stack as a line of root-first frame names joined by semicolons. """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(f'{frame.f_globals.get("__name__", "?")}.{frame.f_code.co_qualname}')
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopping.set()
+        self.thread.join()
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+
+class ProfilingMiddleware:
+
+    def __init__(self, get_response):
+        if not profiling_dir():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profiler = requested_profiler(request)
+        if profiler is None or not request.user.is_staff:
+            return self.get_response(request)
+
+        sql_log = SQLLog()
+        with listening_to_queries(sql_log):
+            if profiler == 'sample':
+                with Sampler(threading.get_ident(), sample_interval()) as sampler:
+                    response = self.get_response(request)
+            else:
+                with cProfile.Profile() as profile:
+                    response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        name = (match.url_name if match else None) or 'unmatched'
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        extension = 'collapsed' if profiler == 'sample' else 'pstats'
+        file_name = f'{stamp}-{name}-user{request.user.pk}.{extension}'
+        directory = profiling_dir()
+        os.makedirs(directory, exist_ok=True)
+        if profiler == 'sample':
+            sampler.write(os.path.join(directory, file_name))
+        else:
+            profile.dump_stats(os.path.join(directory, file_name))
+
+        sql_log.log(f'{request.method} {request.get_full_path()} ({file_name})')
+        response['X-Profile'] = file_name
+        return response
@@ -0,0 +1,184 @@
+"""
+Full-text search over place names and notes.
+
+On SQLite with FTS5, migration 0008 creates travel_wishlist_place_fts, an
+external content FTS5 table over Place's name, notes and user_id, and triggers
+that keep it in step with every INSERT, UPDATE and DELETE of a place, including
+bulk_create, QuerySet.update and QuerySet.delete. Results are ranked with
+bm25, with a match in the name worth more than one in the notes, and come back
+with the matching words highlighted.
+
+The user is part of the FTS5 query, so FTS5 only ranks the user's own places.
+Only the best few are then read from the place table and highlighted.
+Filtering on place.user_id instead means looking up the row of every match,
+for every user.
+
+Django rebuilds a SQLite table to alter it, which drops the table's triggers,
+so after every migrate ensure_search_index puts back any that are missing.
+
+Databases without FTS5 fall back to LIKE '%word%' filters, which have to read
+every one of the user's places.
+"""
+
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Place
+
+
+FTS_TABLE = 'travel_wishlist_place_fts'
+PLACE_TABLE = 'travel_wishlist_place'
+
+# bm25 weights for the name, notes and user_id columns
+NAME_WEIGHT = 10.0
+NOTES_WEIGHT = 1.0
+USER_WEIGHT = 0.0
+
+# mark_words puts these around matches. They're characters from the
+# Unicode private use area, which place names and notes have no use for, and
+# are swapped for <mark> tags after the rest of the text is escaped.
+MATCH_START = '\ue000'
+MATCH_END = '\ue001'
+
+SNIPPET_TOKENS = 16
+
+TRIGGERS = {
+    f'{FTS_TABLE}_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON {PLACE_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, name, notes, user_id) VALUES (new.id, new.name, new.notes, new.user_id);
+        END""",
+    f'{FTS_TABLE}_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON {PLACE_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, notes, user_id)
+            VALUES ('delete', old.id, old.name, old.notes, old.user_id);
+        END""",
+    f'{FTS_TABLE}_update': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF name, notes, user_id ON {PLACE_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, notes, user_id)
+            VALUES ('delete', old.id, old.name, old.notes, old.user_id);
+            INSERT INTO {FTS_TABLE} (rowid, name, notes, user_id) VALUES (new.id, new.name, new.notes, new.user_id);
+        END""",
+}
+
+
+def search_index_exists(db_connection=connection):
+    """ Whether migration 0008 made the FTS5 table; checked once per connection. """
+    exists = getattr(db_connection, '_place_search_index', None)
+    if exists is None:
+        exists = False
+        if db_connection.vendor == 'sqlite':
+            with db_connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                exists = cursor.fetchone() is not None
+        db_connection._place_search_index = exists
+    return exists
+
+
+def ensure_search_index(using='default', **kwargs):
+    """ post_migrate handler: put back any triggers a table rebuild dropped, and
+    then reindex, since changes made without the triggers were missed. """
+    db_connection = connections[using]
+    db_connection._place_search_index = None   # the migrations may have added or removed it
+    if not search_index_exists(db_connection):
+        return
+    with db_connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [PLACE_TABLE])
+        existing = {row[0] for row in cursor.fetchall()}
+        missing = [sql for name, sql in TRIGGERS.items() if name not in existing]
+        for sql in missing:
+            cursor.execute(sql)
+        if missing:
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def query_words(query):
+    """ The words in a search, lower case, in order and without repeats. A word
+    followed by * is kept with it, and matches any word that starts with it. """
+    return list(dict.fromkeys(word.lower() + star for word, star in re.findall(r'(\w+)(\*?)', query)))
+
+
+def fts_query(words, user_id):
+    """ An FTS5 query matching the user's places with every word in their name or
+    notes. Each word is quoted, so nothing the user types is read as FTS5
+    query syntax. Only words the user
+    asked for are prefixes: a prefix term matches many more words, and takes
+    about twice as long to rank. """
+    terms = ' '.join(f'"{word[:-1]}"*' if word.endswith('*') else f'"{word}"' for word in words)
+    return f'user_id : "{int(user_id)}" AND {{name notes}} : ({terms})'
+
+
+def search_places(user, query, limit=50):
+    """ The user's places matching every word in query, best matches first, as dicts
+    with pk, name, visited, and name_html and notes_html with matches in <mark> tags. """
+    words = query_words(query)
+    if not words:
+        return []
+    if search_index_exists():
+        return _fts_search(user, words, limit)
+    return _like_search(user, words, limit)
+
+
+def _fts_search(user, words, limit):
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT rowid FROM {FTS_TABLE}
+            WHERE {FTS_TABLE} MATCH %s
+            ORDER BY bm25({FTS_TABLE}, %s, %s, %s), rowid
+            LIMIT %s""", [fts_query(words, user.pk), NAME_WEIGHT, NOTES_WEIGHT, USER_WEIGHT, limit])
+        ranked = [row[0] for row in cursor.fetchall()]
+
+    # The matches are highlighted here rather than with FTS5's highlight() and
+    # snippet(). In the ranking query those would be worked out for every match
+    # before sorting, and a second MATCH just for the best few is slow for prefixes.
+    places = Place.objects.filter(user=user, pk__in=ranked)
+    rows = {row['pk']: row for row in places.values('pk', 'name', 'visited', 'notes')}
+    return [result(rows[pk], words, whole_words=True) for pk in ranked if pk in rows]
+
+
+def _like_search(user, words, limit):
+    words = [word.rstrip('*') for word in words]   # LIKE matches prefixes anyway
+    places = Place.objects.filter(user=user)
+    for word in words:
+        places = places.filter(Q(name__icontains=word) | Q(notes__icontains=word))
+    rows = places.order_by('name', 'pk').values('pk', 'name', 'visited', 'notes')[:limit]
+    return [result(row, words, whole_words=False) for row in rows]
+
+
+def result(row, words, whole_words):
+    return {
+        'pk': row['pk'], 'name': row['name'], 'visited': row['visited'],
+        'name_html': marked_html(mark_words(row['name'], words, whole_words)),
+        'notes_html': marked_html(snippet(mark_words(row['notes'] or '', words, whole_words))),
+    }
+
+
+def mark_words(text, words, whole_words=False):
+    """ text with MATCH_START and MATCH_END around each of the words. With whole_words,
+    as FTS5 matches them: whole words, or the start of words for words ending in *. """
+    if whole_words:
+        patterns = [rf'\b{re.escape(word[:-1])}\w*' if word.endswith('*') else rf'\b{re.escape(word)}\b'
+                    for word in words]
+    else:
+        patterns = [re.escape(word) for word in sorted(words, key=len, reverse=True)]
+    pattern = re.compile('|'.join(patterns), re.IGNORECASE)
+    return pattern.sub(lambda match: f'{MATCH_START}{match.group()}{MATCH_END}', text)
+
+
+def snippet(marked, tokens=SNIPPET_TOKENS):
+    """ About tokens words of marked text around its first match. """
+    words = marked.split()
+    if len(words) <= tokens:
+        return marked
+    first = next((n for n, word in enumerate(words) if MATCH_START in word), 0)
+    start = max(0, min(first - tokens // 4, len(words) - tokens))
+    text = ' '.join(words[start:start + tokens])
+    return ('…' if start else '') + text + ('…' if start + tokens < len(words) else '')
+
+
+def marked_html(marked):
+    """ Escape text for HTML, and turn the match markers into <mark> tags. """
+    return mark_safe(escape(marked).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>'))
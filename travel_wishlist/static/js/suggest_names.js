@@ -0,0 +1,40 @@
+// Suggest place names in the add place form as the user types.
+// The name input is linked to the datalist by its list attribute, and the
+// browser shows the datalist's options under the input. Each time the text
+// changes, ask the server for names starting with it, and replace the options.
+// Answers that arrive after a newer request was sent are ignored.
+
+var suggestionList = document.querySelector('#place-name-suggestions');
+var nameInput = document.querySelector('input[list="place-name-suggestions"]');
+
+if (suggestionList && nameInput) {
+
+  var latestRequest = 0;
+
+  nameInput.addEventListener('input', function(){
+
+    var text = nameInput.value.trim();
+    var thisRequest = ++latestRequest;
+
+    if (!text) {
+      suggestionList.replaceChildren();
+      return;
+    }
+
+    fetch(suggestionList.dataset.url + '?q=' + encodeURIComponent(text), {credentials: 'same-origin'})
+      .then(function(response) { return response.json(); })
+      .then(function(data) {
+        if (thisRequest !== latestRequest) {
+          return;  // the user has typed more since
+        }
+        suggestionList.replaceChildren.apply(suggestionList, data.suggestions.map(function(suggestion){
+          var option = document.createElement('option');
+          option.value = suggestion.name;
+          return option;
+        }));
+      })
+      .catch(function() {
+        // No suggestions is fine, the form still works
+      });
+  });
+}
@@ -0,0 +1,177 @@
+"""
+Static files with hashed names, precompressed, and cached for good.
+
+collectstatic, with CompressedManifestStaticFilesStorage, copies each file to
+STATIC_ROOT under a name with a hash of its contents, css/style.3f9a1c.css,
+as ManifestStaticFilesStorage does, and rewrites the references in stylesheets
+to match. Then it writes a gzipped copy, css/style.3f9a1c.css.gz, of each file
+that compresses, and a brotli one, .br, if the brotli package is installed.
+Compressing once at deploy time means the best (slowest) levels cost nothing
+per request.
+
+StaticFilesMiddleware serves STATIC_ROOT without going through the URLs and
+views. It picks the smallest copy the client accepts, by Accept-Encoding, and
+sends it with FileResponse, which the WSGI server can send with sendfile. A
+hashed name never changes contents, so it's cached for a year as immutable;
+anything else, like the unhashed copy collectstatic also keeps, is revalidated
+with If-Modified-Since after a few minutes. With DEBUG on, runserver serves
+static files from the app directories, unhashed, so the middleware takes
+itself out of the middleware chain, as it does without STATIC_ROOT.
+"""
+
+import gzip
+import mimetypes
+import os
+import posixpath
+from email.utils import parsedate_to_datetime
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:   # optional; without it only .gz copies are made
+    brotli = None
+
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.map', '.svg', '.txt', '.html', '.json', '.xml', '.ico'}
+
+# Content-Encoding of each compressed copy, in order of preference
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+CACHE_CONTROL = 'public, max-age=300'
+
+
+def compress(content):
+    """ The compressed copies of content worth keeping, as {extension: bytes}:
+    those smaller than content itself. """
+    copies = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}   # mtime=0, so the same file every time
+    if brotli is not None:
+        copies['.br'] = brotli.compress(content, quality=11)
+    return {extension: copy for extension, copy in copies.items() if len(copy) < len(content)}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ ManifestStaticFilesStorage that also writes compressed copies of the
+    files collected, next to them, and keeps the hashed names as a set, so
+    is_hashed doesn't search the manifest on every request. """
+
+    def load_manifest(self):
+        hashed_files, manifest_hash = super().load_manifest()
+        self.hashed_names = frozenset(hashed_files.values())
+        return hashed_files, manifest_hash
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        self.hashed_names = frozenset(self.hashed_files.values())
+        for name in sorted({*paths, *self.hashed_files.values()}):
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            with self.open(name) as file:
+                content = file.read()
+            for extension, copy in compress(content).items():
+                if self.exists(name + extension):
+                    self.delete(name + extension)
+                self._save(name + extension, ContentFile(copy))
+                yield name, name + extension, True
+
+
+def accepted_encodings(request):
+    """ The content codings the client accepts, ignoring any it gives q=0. """
+    accepted = set()
+    for coding in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = coding.strip().partition(';')
+        quality = params.strip().removeprefix('q=')
+        try:
+            if params and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class StaticFilesMiddleware:
+    """ Serve files under STATIC_URL from STATIC_ROOT, compressed if the client
+    accepts it. Goes near the top of MIDDLEWARE, so static files skip sessions,
+    CSRF and authentication. """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.DEBUG or not settings.STATIC_ROOT:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = '/' + settings.STATIC_URL.lstrip('/')
+        self.root = os.fspath(settings.STATIC_ROOT)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.serve(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        # Only a stat and an open; the file is sent in a thread by FileResponse
+        return self.serve(request) or await self.get_response(request)
+
+    def serve(self, request):
+        """ The response for a static file, or None if the request isn't for one. """
+        if request.method not in ('GET', 'HEAD') or not request.path_info.startswith(self.prefix):
+            return None
+        name = posixpath.normpath(request.path_info.removeprefix(self.prefix)).lstrip('/')
+        try:
+            path = safe_join(self.root, name)
+        except ValueError:   # outside STATIC_ROOT
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        accepted = accepted_encodings(request)
+        encoding, serve_path = None, path
+        if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+            for coding, extension in ENCODINGS.items():
+                if coding in accepted and os.path.isfile(path + extension):
+                    encoding, serve_path = coding, path + extension
+                    break
+
+        last_modified = int(os.stat(serve_path).st_mtime)
+        if not_modified_since(request, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            content_type, _ = mimetypes.guess_type(name)
+            # The content type of the original file, not of the .gz or .br copy
+            response = FileResponse(open(serve_path, 'rb'), content_type=content_type or 'application/octet-stream')
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if is_hashed(name) else CACHE_CONTROL
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
+
+def not_modified_since(request, last_modified):
+    header = request.headers.get('If-Modified-Since')
+    if not header:
+        return False
+    try:
+        return int(parsedate_to_datetime(header).timestamp()) >= last_modified
+    except (TypeError, ValueError):
+        return False
+
+
+def is_hashed(name):
+    """ Whether name is the hashed name of a file in the staticfiles manifest,
+    so its contents never change. """
+    return name in getattr(staticfiles_storage, 'hashed_names', ())
@@ -0,0 +1,100 @@
+"""
+Content-addressed storage for uploaded photos.
+
+Each file is stored under the SHA-256 hash of its contents, in directories
+named after the first characters of the hash so no directory gets too big:
+user_images/3f/a9/3fa9…e1.jpg. When the same photo is uploaded to several
+places it is stored once. PhotoBlob counts the places that use each stored
+file, and a file is only queued for deletion when its count drops to zero.
+
+Saving contents that are already stored touches the file, so its modified time
+is that of the latest upload. collect_orphaned_photos leaves files modified
+recently alone, since the place saving them may not have committed yet.
+"""
+
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, storages
+
+from .metrics import timing
+
+
+class _AlreadyStored(Exception):
+    pass
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """ FileSystemStorage that names files by the hash of their contents. Saving
+    contents that are already stored writes nothing and returns the existing name. """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        try:
+            return super().save(name, content, max_length)
+        except _AlreadyStored:
+            try:
+                self.touch(name)
+            except FileNotFoundError:   # deleted since, as an orphan: store it again
+                return super().save(name, content, max_length)
+            return name
+
+    def content_name(self, name, content):
+        """ The name for content: the directory of name, two levels of shard
+        directories, then the hash with name's extension. """
+        digest = hashlib.sha256()
+        for chunk in content.chunks():   # chunks() starts from the beginning of the file
+            digest.update(chunk if isinstance(chunk, bytes) else chunk.encode())
+        content.seek(0)
+
+        content_hash = digest.hexdigest()
+        directory = posixpath.dirname(name.replace('\\', '/'))
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(directory, content_hash[:2], content_hash[2:4], content_hash + extension)
+
+    def get_available_name(self, name, max_length=None):
+        # A file with this name has these exact contents, so there's never a
+        # reason to pick another name. Signal _save to keep the existing file.
+        if self.exists(name):
+            raise _AlreadyStored
+        return name
+
+    def _save(self, name, content):
+        try:
+            with timing('storage'):
+                return super()._save(name, content)
+        except _AlreadyStored:
+            # Stored already, or by another upload of the same photo at the same moment
+            self.touch(name)
+            return name
+
+    def touch(self, name):
+        """ Set the modified time of the file to now. """
+        with timing('storage'):
+            os.utime(self.path(name))
+
+    # Timed for the request metrics, see metrics.py. Reading an opened file
+    # happens later, in whatever reads it, and is counted as that.
+
+    def _open(self, name, mode='rb'):
+        with timing('storage'):
+            return super()._open(name, mode)
+
+    def exists(self, name):
+        with timing('storage'):
+            return super().exists(name)
+
+    def delete(self, name):
+        with timing('storage'):
+            return super().delete(name)
+
+
+def photo_storage():
+    """ The storage for Place.photo, configured as "photos" in settings.STORAGES. """
+    return storages['photos']
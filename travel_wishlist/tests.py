@@ -1,17 +1,70 @@
+import datetime
+import gzip
+import io
+import json
+import re
+import shutil
+import stat
 import tempfile
-import filecmp
 import os 
-
-from django.test import TestCase
+import pstats
+import threading
+import time
+import subprocess
+import sys
+import zlib
+import struct
+
+from django.conf import settings
+from django.test import RequestFactory, TestCase as DjangoTestCase
 from django.urls import reverse
+from django.utils import timezone
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction
+from django.http import Http404
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest import mock, skipUnless
 
 from django.contrib.auth.models import User
-from .models import Place
+from .models import (Place, PhotoBlob, PhotoDeletion, PhotoRendition, PlacesState, PlaceStats, VisitYear,
+                     delete_places, mark_places_visited, places_changed, rebuild_place_stats)
+from . import auth, autocomplete, bulk, db, deletions, loadtest, media, metrics, profiling, search, staticfiles
+from .cache import CSRF_PLACEHOLDER, page_cache
+from .uploads import RejectedUpload
 
 from PIL import Image 
 
 
+# Tests run with DEBUG off, when the manifest storage would need collectstatic to
+# have been run before any page could be rendered
+PLAIN_STATIC_STORAGES = {**settings.STORAGES,
+                         'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}
+
+# The session and user cache, and the metrics file, in a directory of their own that's
+# removed when the tests finish
+TEST_FILES = tempfile.TemporaryDirectory()
+TEST_CACHES = {**settings.CACHES, 'sessions': {**settings.CACHES['sessions'],
+                                               'LOCATION': os.path.join(TEST_FILES.name, 'sessions')}}
+TEST_METRICS_DB = os.path.join(TEST_FILES.name, 'metrics.sqlite3')
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES, CACHES=TEST_CACHES, METRICS_DB=TEST_METRICS_DB)
+class TestCase(DjangoTestCase):
+    """ Each test starts with empty caches. Cached pages would otherwise outlive the
+    transaction each test's database changes are rolled back with. """
+
+    @classmethod
+    def _pre_setup(cls):
+        super()._pre_setup()
+        for cache in caches.all():
+            cache.clear()
+        autocomplete.forget_user_names()
+
+
 class TestViewHomePageIsEmptyList(TestCase):
 
     fixtures = ['test_users']
@@ -34,7 +87,7 @@ class TestViewHomePageIsEmptyList(TestCase):
 class TestWishList(TestCase):
 
     # Load this data into the database for all of the tests in this class
-    fixtures = ['test_places', 'test_users']
+    fixtures = ['test_places', 'test_users', 'test_place_stats']
 
     
     def setUp(self):
@@ -141,7 +194,7 @@ class TestAddNewPlace(TestCase):
 
 class TestMarkPlaceAsVisited(TestCase):
 
-    fixtures = ['test_places', 'test_users']
+    fixtures = ['test_places', 'test_users', 'test_place_stats']
 
     def setUp(self):
         self.user = User.objects.get(pk=1)
@@ -169,9 +222,30 @@ class TestMarkPlaceAsVisited(TestCase):
         self.assertEqual(403, response.status_code)  # 403 Forbidden
 
 
+    def test_visited_buttons_share_one_form(self):
+        response = self.client.get(reverse('place_list'))
+        self.assertContains(response, 'id="visit-place"', count=1)
+        self.assertContains(response, 'form="visit-place"', count=2)
+        self.assertContains(response, 'csrfmiddlewaretoken', count=3)   # add, visit and bulk forms
+        # The button sends its own pk to the bulk view, and not the ticked checkboxes
+        self.client.post(reverse('places_were_visited'), {'place_pk': 2})
+        self.assertEqual([1, 2, 4], list(Place.objects.filter(visited=True).order_by('pk').values_list('pk', flat=True)))
+
+    def test_rows_cached_until_place_changes(self):
+        self.client.get(reverse('place_list'))
+        Place.objects.filter(pk=2).update(name='Boston')   # updated_at left as it was
+        places_changed(self.user.pk)
+        response = self.client.get(reverse('place_list'))
+        self.assertNotContains(response, 'Boston')   # the row's fragment, although not the page, came from the cache
+        self.assertContains(response, 'San Francisco')
+        Place.objects.filter(pk=2).update(updated_at=timezone.now())
+        places_changed(self.user.pk)
+        self.assertContains(self.client.get(reverse('place_list')), 'Boston')
+
+
 class TestDeletePlace(TestCase):
 
-    fixtures = ['test_places', 'test_users']
+    fixtures = ['test_places', 'test_users', 'test_place_stats']
 
     def setUp(self):
         user = User.objects.first()
@@ -193,7 +267,7 @@ class TestDeletePlace(TestCase):
 
 class TestPlaceDetail(TestCase):
     # Load this data into the database for all of the tests in this class
-    fixtures = ['test_places', 'test_users']
+    fixtures = ['test_places', 'test_users', 'test_place_stats']
 
     def setUp(self):
         user = User.objects.get(pk=1)
@@ -287,22 +361,27 @@ class TestPlaceDetail(TestCase):
 
 class TestImageUpload(TestCase):
 
-    fixtures = ['test_users', 'test_places']
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
 
     def setUp(self):
         user = User.objects.get(pk=1)
         self.client.force_login(user)
         self.MEDIA_ROOT = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.MEDIA_ROOT)
         
 
-    def create_temp_image_file(self):
+    def create_temp_image_file(self, color='black'):
         handle, tmp_img_file = tempfile.mkstemp(suffix='.jpg')
-        img = Image.new('RGB', (10, 10) )
+        os.close(handle)
+        self.addCleanup(os.remove, tmp_img_file)
+        img = Image.new('RGB', (10, 10), color)
         img.save(tmp_img_file, format='JPEG')
         return tmp_img_file
 
     def create_temp_text_file(self):
         handle, tmp_txt_file = tempfile.mkstemp(suffix='.txt', text=True)
+        os.close(handle)
+        self.addCleanup(os.remove, tmp_txt_file)
         with open(tmp_txt_file, 'w') as f:
             f.write('this is some example text')
         return tmp_txt_file
@@ -320,17 +399,21 @@ class TestImageUpload(TestCase):
                 self.assertEqual(200, resp.status_code)
 
                 place_1 = Place.objects.get(pk=1)
-                img_file_name = os.path.basename(img_file_path)
-                expected_uploaded_file_path = os.path.join(self.MEDIA_ROOT, 'user_images', img_file_name)
+                # Stored under the hash of its contents, e.g. user_images/ab/cd/abcd....jpg
+                self.assertRegex(place_1.photo.name, r'^user_images/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.jpg$')
+                expected_uploaded_file_path = os.path.join(self.MEDIA_ROOT, place_1.photo.name)
                 self.assertTrue(os.path.exists(expected_uploaded_file_path))
                 self.assertIsNotNone(place_1.photo)
-                self.assertTrue(filecmp.cmp( img_file_path,  expected_uploaded_file_path ))
+                # Uploads are re-encoded, so compare the images rather than the files
+                with Image.open(img_file_path) as uploaded, Image.open(expected_uploaded_file_path) as stored:
+                    self.assertEqual(uploaded.size, stored.size)
+                    self.assertEqual(uploaded.format, stored.format)
 
 
     def test_change_image_for_own_place_expect_old_deleted(self):
         
         first_img_file_path = self.create_temp_image_file()
-        second_img_file_path = self.create_temp_image_file()
+        second_img_file_path = self.create_temp_image_file(color='white')
 
         with self.settings(MEDIA_ROOT=self.MEDIA_ROOT):
         
@@ -343,7 +426,11 @@ class TestImageUpload(TestCase):
                 first_uploaded_image = place_1.photo.name
 
                 with open(second_img_file_path, 'rb') as second_img_file:
-                    resp = self.client.post(reverse('place_details', kwargs={'place_pk':1}), {'photo': second_img_file}, follow=True)
+                    with self.captureOnCommitCallbacks(execute=True):
+                        resp = self.client.post(reverse('place_details', kwargs={'place_pk':1}), {'photo': second_img_file}, follow=True)
+
+                    # Old photo is queued for deletion, run the worker to delete it
+                    call_command('process_photo_deletions', verbosity=0)
 
                     # first file should not exist 
                     # second file should exist 
@@ -384,16 +471,1820 @@ class TestImageUpload(TestCase):
                 self.assertEqual(200, resp.status_code)
 
                 place_1 = Place.objects.get(pk=1)
-                img_file_name = os.path.basename(img_file_path)
-                
-                uploaded_file_path = os.path.join(self.MEDIA_ROOT, 'user_images', img_file_name)
+                uploaded_file_path = os.path.join(self.MEDIA_ROOT, place_1.photo.name)
 
                 self.assertTrue(os.path.exists(uploaded_file_path))  # the image is there
                
                 # delete place 1 
 
                 place_1 = Place.objects.get(pk=1)
-                place_1.delete()
+                with self.captureOnCommitCallbacks(execute=True):
+                    place_1.delete()
 
+                self.assertTrue(os.path.exists(uploaded_file_path))  # deletion is queued, not done in the request
+                call_command('process_photo_deletions', verbosity=0)
                 self.assertFalse(os.path.exists(uploaded_file_path))  # and has been deleted 
                
+
+
+class TestPlaceListQueryPlan(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def test_list_queries_use_index_without_sorting(self):
+        user = User.objects.get(pk=1)
+        for visited, index_name in ((False, 'place_wishlist_idx'), (True, 'place_visited_idx')):
+            plan = Place.objects.filter(user=user).filter(visited=visited).order_by('name').explain()
+            self.assertIn(index_name, plan)
+            self.assertNotIn('TEMP B-TREE', plan)   # no separate sort step
+
+
+    def test_photo_access_check_uses_indexes(self):
+        with CaptureQueriesContext(connection) as context:
+            with self.assertRaises(Http404):
+                media.check_photo_access(User.objects.get(pk=1), 'user_images/nothing.jpg')
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + context.captured_queries[-1]['sql'])
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('photorendition_name_idx', plan)
+        self.assertNotIn('SCAN', plan)   # only the user's places are read
+
+@override_settings(PLACES_PER_PAGE=2)
+class TestKeysetPagination(TestCase):
+
+    fixtures = ['test_users']
+
+    def setUp(self):
+        self.user = User.objects.get(pk=1)
+        self.client.force_login(self.user)
+        # Two places named Oslo, so pages have to be split on pk as well as name
+        for name in ['Oslo', 'Berlin', 'Oslo', 'Cairo', 'Zurich']:
+            Place.objects.create(user=self.user, name=name)
+
+    def place_names(self, response):
+        return [place.name for place in response.context['places']]
+
+    def test_walk_forward_and_back_through_pages(self):
+        first = self.client.get(reverse('place_list'))
+        self.assertEqual(['Berlin', 'Cairo'], self.place_names(first))
+        self.assertFalse(first.context['page'].has_previous)
+
+        second = self.client.get(reverse('place_list'), {'after': first.context['page'].next_cursor})
+        self.assertEqual(['Oslo', 'Oslo'], self.place_names(second))
+
+        third = self.client.get(reverse('place_list'), {'after': second.context['page'].next_cursor})
+        self.assertEqual(['Zurich'], self.place_names(third))
+        self.assertFalse(third.context['page'].has_next)
+
+        back = self.client.get(reverse('place_list'), {'before': third.context['page'].previous_cursor})
+        self.assertEqual(['Oslo', 'Oslo'], self.place_names(back))
+        back = self.client.get(reverse('place_list'), {'before': back.context['page'].previous_cursor})
+        self.assertEqual(['Berlin', 'Cairo'], self.place_names(back))
+        self.assertFalse(back.context['page'].has_previous)
+
+    def test_empty_page_after_deletions_links_back(self):
+        first = self.client.get(reverse('place_list'))
+        second = self.client.get(reverse('place_list'), {'after': first.context['page'].next_cursor})
+        cursor = second.context['page'].next_cursor
+        self.client.post(reverse('delete_place', args=(Place.objects.get(name='Zurich').pk,)))
+
+        empty = self.client.get(reverse('place_list'), {'after': cursor})
+        self.assertEqual([], self.place_names(empty))
+        self.assertContains(empty, '?before=' + empty.context['page'].previous_cursor)
+        back = self.client.get(reverse('place_list'), {'before': empty.context['page'].previous_cursor})
+        self.assertEqual(['Oslo', 'Oslo'], self.place_names(back))   # including the place at the cursor
+
+    def test_page_links_shown(self):
+        response = self.client.get(reverse('place_list'))
+        self.assertContains(response, '?after=' + response.context['page'].next_cursor)
+        self.assertNotContains(response, '?before=')
+
+    def test_visited_list_paginated(self):
+        Place.objects.filter(user=self.user).update(visited=True)
+        response = self.client.get(reverse('places_visited'))
+        self.assertEqual(['Berlin', 'Cairo'], [place.name for place in response.context['visited']])
+        self.assertTrue(response.context['page'].has_next)
+
+    def test_malformed_cursor_shows_first_page(self):
+        response = self.client.get(reverse('place_list'), {'after': 'not-a-cursor'})
+        self.assertEqual(['Berlin', 'Cairo'], self.place_names(response))
+
+
+class TestSaveWritesOnlyChangedFields(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.user = User.objects.get(pk=1)
+        self.client.force_login(self.user)
+
+    def test_save_updates_only_changed_columns_without_reselecting(self):
+        place = Place.objects.get(pk=2)
+        place.visited = True
+        with self.assertNumQueries(3) as context:   # the UPDATE, recording that the user's places changed, and their stats
+            place.save()
+        sql = context.captured_queries[0]['sql']
+        self.assertTrue(sql.startswith('UPDATE'))
+        self.assertIn('"visited"', sql)
+        self.assertNotIn('"name"', sql)
+        self.assertIn('"updated_at"', sql)
+        self.assertTrue(Place.objects.get(pk=2).visited)
+
+    def test_save_without_changes_runs_no_queries(self):
+        place = Place.objects.get(pk=2)
+        with self.assertNumQueries(0):
+            place.save()
+
+    def test_changes_made_after_a_save_are_saved_next_time(self):
+        place = Place.objects.get(pk=2)
+        place.notes = 'first'
+        place.save()
+        place.notes = 'second'
+        place.save()
+        self.assertEqual('second', Place.objects.get(pk=2).notes)
+
+    def test_new_place_is_inserted(self):
+        place = Place(user=self.user, name='Oslo')
+        place.save()
+        self.assertEqual('Oslo', Place.objects.get(pk=place.pk).name)
+
+    def test_deferred_field_assigned_after_load_is_saved(self):
+        place = Place.objects.only('name').get(pk=2)
+        place.notes = 'set on a deferred field'
+        place.save()
+        self.assertEqual('set on a deferred field', Place.objects.get(pk=2).notes)
+
+    def test_mark_visited_query_count(self):
+        # Reading the place's visited date (the session and user are cached), one
+        # conditional UPDATE, then recording that the user's places changed and
+        # updating their stats
+        with self.assertNumQueries(4):
+            response = self.client.post(reverse('place_was_visited', args=(2,)))
+        self.assertRedirects(response, reverse('place_list'), fetch_redirect_response=False)
+        self.assertTrue(Place.objects.get(pk=2).visited)
+
+    def test_mark_someone_else_place_visited_query_count(self):
+        # Reading the place finds nothing, so one more query decides between 403 and 404
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse('place_was_visited', args=(5,)))
+        self.assertEqual(403, response.status_code)
+        self.assertFalse(Place.objects.get(pk=5).visited)
+
+    def test_delete_place_query_count(self):
+        # The ownership-scoped SELECT, the DELETE, then recording that the user's
+        # places changed and updating their stats
+        with self.assertNumQueries(4):
+            self.client.post(reverse('delete_place', args=(2,)))
+        self.assertFalse(Place.objects.filter(pk=2).exists())
+
+    def test_update_notes_query_count(self):
+        # The ownership-scoped SELECT, an UPDATE of just the notes column since the
+        # date is unchanged, then recording that the user's places changed
+        with self.assertNumQueries(3) as context:
+            self.client.post(reverse('place_details', kwargs={'place_pk': 1}), {'notes': 'awesome', 'date_visited': '2014-01-01'})
+        self.assertTrue(context.captured_queries[1]['sql'].startswith('UPDATE "travel_wishlist_place" SET "notes" = '))
+        self.assertEqual('awesome', Place.objects.get(pk=1).notes)
+
+
+
+class TestPhotoDeletionQueue(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.MEDIA_ROOT = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.MEDIA_ROOT)
+        self.settings_override = self.settings(MEDIA_ROOT=self.MEDIA_ROOT)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def place_with_photo(self, pk=1):
+        handle, img_path = tempfile.mkstemp(suffix='.jpg')
+        os.close(handle)
+        self.addCleanup(os.remove, img_path)
+        Image.new('RGB', (10, 10), (pk * 40, 0, 0)).save(img_path, format='JPEG')   # a different photo for each place
+        place = Place.objects.get(pk=pk)
+        with open(img_path, 'rb') as img_file:
+            place.photo.save(os.path.basename(img_path), img_file)
+        return Place.objects.get(pk=pk)
+
+    def photo_path(self, place):
+        return os.path.join(self.MEDIA_ROOT, place.photo.name)
+
+    def test_delete_queues_photo_on_commit(self):
+        place = self.place_with_photo()
+        with self.captureOnCommitCallbacks() as callbacks:
+            # The DELETE, recording that the user's places changed, updating their
+            # stats and visits that year, then releasing the photo's reference count
+            # and deleting its count and rendition rows; no file I/O or queue write yet
+            with self.assertNumQueries(9):
+                place.delete()
+        self.assertFalse(PhotoDeletion.objects.exists())
+        for callback in callbacks:   # commit
+            callback()
+        self.assertEqual([place.photo.name], list(PhotoDeletion.objects.values_list('name', flat=True)))
+
+    def test_rolled_back_delete_queues_nothing(self):
+        place = self.place_with_photo()
+        photo_path = self.photo_path(place)
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    place.delete()
+                    raise RuntimeError('roll back')
+            except RuntimeError:
+                pass
+        self.assertFalse(PhotoDeletion.objects.exists())
+        self.assertTrue(Place.objects.filter(pk=1).exists())
+        self.assertTrue(os.path.exists(photo_path))
+
+    def test_worker_deletes_queued_photos_in_batches(self):
+        places = [self.place_with_photo(pk) for pk in (1, 2, 3)]
+        paths = [self.photo_path(place) for place in places]
+        with self.captureOnCommitCallbacks(execute=True):
+            for place in places:
+                place.delete()
+        self.assertEqual((3, 0), deletions.drain(batch_size=2))
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+        self.assertFalse(PhotoDeletion.objects.exists())
+
+    def test_failed_deletion_retried_later(self):
+        place = self.place_with_photo()
+        with self.captureOnCommitCallbacks(execute=True):
+            place.delete()
+
+        storage = deletions.photo_storage()
+        with mock.patch.object(storage, 'delete', side_effect=OSError('disk unavailable')):
+            self.assertEqual((1, 1), deletions.process_batch())
+        job = PhotoDeletion.objects.get()
+        self.assertEqual(1, job.attempts)
+        self.assertEqual('disk unavailable', job.last_error)
+        self.assertEqual((0, 0), deletions.process_batch())   # not due again yet
+
+        PhotoDeletion.objects.update(next_attempt=job.created)
+        self.assertEqual((1, 0), deletions.process_batch())
+        self.assertFalse(os.path.exists(self.photo_path(place)))
+
+    def test_photo_still_used_by_a_place_not_deleted(self):
+        place = self.place_with_photo()
+        PhotoDeletion.objects.create(name=place.photo.name)
+        self.assertEqual((1, 0), deletions.process_batch())
+        self.assertTrue(os.path.exists(self.photo_path(place)))
+
+    def orphan(self, name, hours_old=48):
+        path = os.path.join(self.MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(b'orphan')
+        modified = time.time() - hours_old * 3600
+        os.utime(path, (modified, modified))
+        return path
+
+    def test_stored_files_sorted_as_the_database_sorts_names(self):
+        for name in ('user_images/a/b.jpg', 'user_images/a.jpg', 'user_images/a-b.jpg', 'user_images/ab.jpg'):
+            self.orphan(name)
+        names = [name for name, modified in deletions.stored_files(deletions.photo_storage(), 'user_images')]
+        self.assertEqual(sorted(names), names)
+        self.assertEqual(4, len(names))
+
+    def test_orphaned_files_found_by_merging_names(self):
+        places = [self.place_with_photo(pk) for pk in (1, 2, 3)]
+        old_orphan = self.orphan('user_images/00/00/orphan.jpg')
+        new_orphan = self.orphan('user_images/ff/ff/orphan.jpg', hours_old=1)
+        rendition = self.orphan('user_images/renditions/orphan_160w.jpg')
+        PhotoRendition.objects.create(source=places[0].photo.name, width=160, name='user_images/renditions/orphan_160w.jpg')
+
+        orphans = list(deletions.orphaned_files(batch_size=1))
+        self.assertEqual(['user_images/00/00/orphan.jpg'], orphans)
+        self.assertEqual(2, len(list(deletions.orphaned_files(min_age=datetime.timedelta(0), batch_size=2))))
+
+        call_command('collect_orphaned_photos', dry_run=True, verbosity=0)
+        self.assertTrue(os.path.exists(old_orphan))
+        call_command('collect_orphaned_photos', rate=1000, verbosity=0)
+        self.assertFalse(os.path.exists(old_orphan))
+        self.assertTrue(all(os.path.exists(path) for path in [new_orphan, rendition, *map(self.photo_path, places)]))
+
+    def test_orphan_uploaded_again_is_not_old(self):
+        place = self.place_with_photo()
+        path = self.photo_path(place)
+        modified = time.time() - 48 * 3600
+        os.utime(path, (modified, modified))
+        Place.objects.filter(pk=1).update(photo='')   # an orphan now, two days old
+
+        # Uploaded again, and stored, but its place not saved yet
+        with open(path, 'rb') as photo:
+            self.assertEqual(place.photo.name, deletions.photo_storage().save('user_images/again.jpg', photo))
+        self.assertGreater(os.path.getmtime(path), modified)
+        self.assertEqual([], list(deletions.orphaned_files()))
+
+    def test_orphan_used_again_since_found_is_kept(self):
+        place = self.place_with_photo()
+        self.assertEqual(0, deletions.delete_orphans([place.photo.name]))
+        self.assertTrue(os.path.exists(self.photo_path(place)))
+
+
+class TestPhotoRenditions(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        user = User.objects.get(pk=1)
+        self.client.force_login(user)
+        self.MEDIA_ROOT = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.MEDIA_ROOT)
+        self.settings_override = self.settings(MEDIA_ROOT=self.MEDIA_ROOT)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def upload_photo(self, size, pk=1):
+        handle, img_path = tempfile.mkstemp(suffix='.jpg')
+        os.close(handle)
+        self.addCleanup(os.remove, img_path)
+        Image.new('RGB', size).save(img_path, format='JPEG')
+        with open(img_path, 'rb') as img_file:
+            self.client.post(reverse('place_details', kwargs={'place_pk': pk}), {'photo': img_file})
+        return Place.objects.get(pk=pk)
+
+    def test_upload_makes_renditions(self):
+        place = self.upload_photo((2000, 1000))
+        renditions = PhotoRendition.objects.filter(source=place.photo.name).order_by('width')
+        self.assertEqual([160, 640, 1280], [rendition.width for rendition in renditions])
+        for rendition in renditions:
+            with Image.open(os.path.join(self.MEDIA_ROOT, rendition.name)) as image:
+                self.assertEqual((rendition.width, rendition.width // 2), image.size)
+
+    def test_srcset_in_detail_page(self):
+        place = self.upload_photo((2000, 1000))
+        response = self.client.get(reverse('place_details', kwargs={'place_pk': 1}))
+        rendition = PhotoRendition.objects.get(source=place.photo.name, width=640)
+        self.assertContains(response, f'/media/{rendition.name} 640w')
+
+    def test_missing_or_unreadable_photo_shown_without_srcset(self):
+        place = self.upload_photo((2000, 1000))
+        PhotoRendition.objects.all().delete()
+        path = os.path.join(self.MEDIA_ROOT, place.photo.name)
+        with open(path, 'wb') as photo:
+            photo.write(b'not an image')
+        with self.assertLogs('travel_wishlist.images', 'WARNING'):
+            response = self.client.get(reverse('place_details', kwargs={'place_pk': 1}))
+        self.assertContains(response, f'src="{place.photo.url}"')
+        self.assertNotContains(response, 'srcset=')
+
+        os.remove(path)
+        with self.assertLogs('travel_wishlist.images', 'WARNING'):
+            response = self.client.get(reverse('place_details', kwargs={'place_pk': 1}))
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(PhotoRendition.objects.exists())   # made once the photo is readable again
+
+    def test_small_photo_not_upscaled(self):
+        place = self.upload_photo((500, 400))
+        renditions = dict(PhotoRendition.objects.filter(source=place.photo.name).values_list('width', 'name'))
+        self.assertNotEqual('', renditions[160])
+        self.assertEqual('', renditions[640])
+        self.assertEqual('', renditions[1280])
+        response = self.client.get(reverse('place_details', kwargs={'place_pk': 1}))
+        self.assertContains(response, ' 160w"')
+
+    def test_missing_renditions_made_when_first_needed(self):
+        place = self.upload_photo((2000, 1000))
+        PhotoRendition.objects.all().delete()
+        self.client.get(reverse('place_details', kwargs={'place_pk': 1}))
+        self.assertEqual(3, PhotoRendition.objects.filter(source=place.photo.name).count())
+
+    def test_renditions_deleted_with_photo(self):
+        place = self.upload_photo((2000, 1000))
+        rendition_paths = [os.path.join(self.MEDIA_ROOT, name)
+                           for name in PhotoRendition.objects.values_list('name', flat=True)]
+        with self.captureOnCommitCallbacks(execute=True):
+            place.delete()
+        call_command('process_photo_deletions', verbosity=0)
+        self.assertFalse(PhotoRendition.objects.exists())
+        self.assertFalse(any(os.path.exists(path) for path in rendition_paths))
+
+
+
+class TestBoundedPhotoUploads(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        user = User.objects.get(pk=1)
+        self.client.force_login(user)
+        self.MEDIA_ROOT = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.MEDIA_ROOT)
+        self.settings_override = self.settings(MEDIA_ROOT=self.MEDIA_ROOT)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def upload(self, path):
+        with open(path, 'rb') as photo:
+            return self.client.post(reverse('place_details', kwargs={'place_pk': 1}), {'photo': photo, 'notes': 'new notes'}, follow=True)
+
+    def write_png_header_only_bomb(self, width, height):
+        """ A small PNG that claims to be width × height pixels of zeros. """
+        handle, path = tempfile.mkstemp(suffix='.png')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        def chunk(kind, data):
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+        compressor = zlib.compressobj()
+        row = b'\x00' * (width + 1)   # filter byte, then one byte per grayscale pixel
+        data = b''.join(compressor.compress(row) for _ in range(64)) + compressor.flush()
+        with open(path, 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n')
+            f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)))
+            f.write(chunk(b'IDAT', data))
+            f.write(chunk(b'IEND', b''))
+        return path
+
+    def test_oversize_file_rejected_and_other_fields_still_arrive(self):
+        handle, path = tempfile.mkstemp(suffix='.jpg')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(200 * 1024))
+        with self.settings(PHOTO_UPLOAD_MAX_BYTES=100 * 1024):
+            response = self.upload(path)
+        self.assertContains(response, 'Photos can be at most 100.0')
+        place = Place.objects.get(pk=1)
+        self.assertFalse(place.photo)
+        self.assertEqual('cool', place.notes)   # form was invalid, nothing saved
+
+    def test_request_with_rejected_upload_closes_every_file(self):
+        # The handlers close the uploaded files once the response is sent; the
+        # test client never does
+        request = RequestFactory().post(reverse('place_details', kwargs={'place_pk': 1}), {
+            'photo': SimpleUploadedFile('big.jpg', os.urandom(200 * 1024)),
+            'other': SimpleUploadedFile('small.jpg', b'small'),
+        })
+        with self.settings(PHOTO_UPLOAD_MAX_BYTES=100 * 1024):
+            files = request.FILES
+        self.assertIsInstance(files['photo'], RejectedUpload)
+        request.close()
+        self.assertTrue(files['other'].file.closed)
+
+    def test_decompression_bomb_rejected_before_decoding(self):
+        path = self.write_png_header_only_bomb(30000, 30000)
+        response = self.upload(path)
+        self.assertContains(response, 'Photos can be at most 50 megapixels')
+        self.assertFalse(Place.objects.get(pk=1).photo)
+
+    def test_exif_stripped_and_large_photo_scaled_down(self):
+        handle, path = tempfile.mkstemp(suffix='.jpg')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        exif = Image.Exif()
+        exif[0x010F] = 'Test camera maker'
+        Image.new('RGB', (3000, 1500)).save(path, format='JPEG', exif=exif)
+        with self.settings(PHOTO_MAX_DIMENSION=1000):
+            self.upload(path)
+        place = Place.objects.get(pk=1)
+        with Image.open(os.path.join(self.MEDIA_ROOT, place.photo.name)) as stored:
+            self.assertEqual((1000, 500), stored.size)
+            self.assertEqual(0, len(stored.getexif()))
+
+    @skipUnless(sys.platform.startswith('linux'), 'reads peak memory from /proc/self/status')
+    def test_reencoding_large_photo_memory_stays_bounded(self):
+        # A 7000 × 7000 JPEG takes 49 MB once decoded at full size, and about 120 MB
+        # of peak memory to re-encode that way. It's made here, and re-encoded in a
+        # fresh process so that process's peak memory can be measured.
+        handle, path = tempfile.mkstemp(suffix='.jpg')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        Image.linear_gradient('L').resize((7000, 7000)).save(path, format='JPEG')
+
+        script = f"""
+import django
+django.setup()
+from django.core.files.uploadedfile import SimpleUploadedFile
+from travel_wishlist.uploads import process_photo, read_dimensions
+from PIL import Image
+Image.new('L', (64, 64)).save('/dev/null', format='JPEG')   # load the codecs first
+
+def peak_kb():
+    with open('/proc/self/status') as status:
+        return next(int(line.split()[1]) for line in status if line.startswith('VmHWM'))
+
+before = peak_kb()
+with open({path!r}, 'rb') as f:
+    upload = SimpleUploadedFile('big.jpg', b'')
+    upload.file = f
+    read_dimensions(upload)
+    photo = process_photo(upload)
+print(peak_kb() - before)
+"""
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                                env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'wishlist.settings'},
+                                cwd=os.path.dirname(os.path.dirname(__file__)))
+        self.assertEqual(0, result.returncode, result.stderr)
+        peak_growth_kb = int(result.stdout.split()[-1])
+        self.assertGreater(peak_growth_kb, 0)
+        self.assertLess(peak_growth_kb, 64 * 1024)
+
+
+
+class TestContentAddressedPhotos(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.MEDIA_ROOT = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.MEDIA_ROOT)
+        self.settings_override = self.settings(MEDIA_ROOT=self.MEDIA_ROOT)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        handle, self.img_path = tempfile.mkstemp(suffix='.jpg')
+        os.close(handle)
+        self.addCleanup(os.remove, self.img_path)
+        Image.new('RGB', (10, 10), 'blue').save(self.img_path, format='JPEG')
+
+    def give_photo(self, pk):
+        place = Place.objects.get(pk=pk)
+        with open(self.img_path, 'rb') as img_file:
+            place.photo.save('holiday.jpg', img_file)
+        return Place.objects.get(pk=pk)
+
+    def delete_and_drain(self, place):
+        with self.captureOnCommitCallbacks(execute=True):
+            place.delete()
+        deletions.drain()
+
+    def test_same_photo_stored_once(self):
+        first = self.give_photo(1)
+        second = self.give_photo(2)
+        self.assertEqual(first.photo.name, second.photo.name)
+        stored_files = [name for root, dirs, names in os.walk(self.MEDIA_ROOT) for name in names]
+        self.assertEqual(1, len(stored_files))
+        self.assertEqual(2, PhotoBlob.objects.get(name=first.photo.name).refcount)
+
+    def test_shared_photo_deleted_with_last_reference(self):
+        first = self.give_photo(1)
+        second = self.give_photo(2)
+        path = os.path.join(self.MEDIA_ROOT, first.photo.name)
+
+        self.delete_and_drain(first)
+        self.assertTrue(os.path.exists(path))   # still used by the second place
+        self.assertEqual(1, PhotoBlob.objects.get(name=second.photo.name).refcount)
+
+        self.delete_and_drain(second)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(PhotoBlob.objects.exists())
+
+    def test_replacing_shared_photo_keeps_it_for_other_place(self):
+        first = self.give_photo(1)
+        self.give_photo(2)
+        path = os.path.join(self.MEDIA_ROOT, first.photo.name)
+
+        handle, other_path = tempfile.mkstemp(suffix='.jpg')
+        os.close(handle)
+        self.addCleanup(os.remove, other_path)
+        Image.new('RGB', (10, 10), 'red').save(other_path, format='JPEG')
+        with self.captureOnCommitCallbacks(execute=True):
+            with open(other_path, 'rb') as img_file:
+                first.photo.save('other.jpg', img_file)
+        deletions.drain()
+
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(1, PhotoBlob.objects.get(name=Place.objects.get(pk=2).photo.name).refcount)
+
+
+class TestPageCache(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.user = User.objects.get(pk=1)
+        self.client.force_login(self.user)
+
+    def test_second_request_served_from_cache(self):
+        self.client.get(reverse('place_list'))
+        with self.assertNumQueries(1):   # the last modified time, no place, session or user queries
+            response = self.client.get(reverse('place_list'))
+        self.assertContains(response, 'San Francisco')
+
+    def test_pages_cached_per_user(self):
+        self.client.get(reverse('place_list'))
+        self.client.force_login(User.objects.get(pk=2))
+        response = self.client.get(reverse('place_list'))
+        self.assertContains(response, 'Hawaii')
+        self.assertNotContains(response, 'San Francisco')
+
+    def test_pages_cached_per_cursor(self):
+        with self.settings(PLACES_PER_PAGE=1):
+            first = self.client.get(reverse('place_list'))
+            second = self.client.get(reverse('place_list'), {'after': first.context['page'].next_cursor})
+        self.assertContains(first, 'New York')
+        self.assertContains(second, 'San Francisco')
+        self.assertNotContains(second, 'New York')
+
+    def test_not_stale_after_add(self):
+        self.client.get(reverse('place_list'))
+        self.client.post(reverse('place_list'), {'name': 'Denver', 'visited': False})
+        self.assertContains(self.client.get(reverse('place_list')), 'Denver')
+
+    def test_not_stale_after_mark_visited(self):
+        self.client.get(reverse('place_list'))
+        self.client.get(reverse('places_visited'))
+        self.client.post(reverse('place_was_visited', args=(2,)))
+        self.assertNotContains(self.client.get(reverse('place_list')), 'New York')
+        self.assertContains(self.client.get(reverse('places_visited')), 'New York')
+
+    def test_not_stale_after_delete(self):
+        self.client.get(reverse('place_list'))
+        self.client.post(reverse('delete_place', args=(2,)))
+        self.assertNotContains(self.client.get(reverse('place_list')), 'New York')
+
+    def test_not_stale_after_save_outside_views(self):
+        self.client.get(reverse('places_visited'))
+        place = Place.objects.get(pk=1)
+        place.name = 'Kyoto'
+        place.save()
+        self.assertContains(self.client.get(reverse('places_visited')), 'Kyoto')
+
+    def test_not_stale_when_version_evicted(self):
+        self.client.get(reverse('place_list'))
+        page_cache().delete(f'places-version:{self.user.pk}')
+        # Bypasses the version bump; moves updated_at on, as every update of places
+        # does, since each row of the wishlist is cached until it changes
+        Place.objects.filter(pk=2).update(name='Boston', updated_at=timezone.now())
+        self.assertContains(self.client.get(reverse('place_list')), 'Boston')
+
+    def test_cached_page_has_csrf_token_for_each_request(self):
+        csrf_client = self.client_class(enforce_csrf_checks=True)
+        csrf_client.force_login(self.user)
+        self.client.get(reverse('place_list'))   # cache the page
+
+        response = csrf_client.get(reverse('place_list'))
+        self.assertNotContains(response, CSRF_PLACEHOLDER)
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+        response = csrf_client.post(reverse('place_list'), {'name': 'Denver', 'visited': False, 'csrfmiddlewaretoken': token})
+        self.assertEqual(302, response.status_code)
+        self.assertTrue(Place.objects.filter(name='Denver').exists())
+
+
+class TestConditionalGet(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.user = User.objects.get(pk=1)
+        self.client.force_login(self.user)
+
+    def assertNotModified(self, url, **headers):
+        # Just the one query for the last modified time; the session and user are cached
+        with self.assertNumQueries(1):
+            response = self.client.get(url, headers=headers)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b'', response.content)
+
+    def test_place_lists_answer_if_none_match(self):
+        for url in (reverse('place_list'), reverse('places_visited')):
+            response = self.client.get(url)
+            self.assertIn('private', response['Cache-Control'])
+            self.assertNotModified(url, if_none_match=response['ETag'])
+
+    def test_place_lists_answer_if_modified_since(self):
+        places_changed(self.user.pk)
+        PlacesState.objects.update(last_modified=timezone.now() - datetime.timedelta(minutes=1))
+        for url in (reverse('place_list'), reverse('places_visited')):
+            response = self.client.get(url)
+            self.assertNotModified(url, if_modified_since=response['Last-Modified'])
+
+    def test_no_last_modified_until_its_second_is_over(self):
+        # Otherwise a client given it could miss a change later in the same second
+        changed = datetime.datetime(2026, 1, 1, 12, 0, 0, 200000, tzinfo=datetime.timezone.utc)
+        PlacesState.objects.update_or_create(user=self.user, defaults={'last_modified': changed})
+        url = reverse('place_list')
+        with mock.patch('travel_wishlist.conditional.timezone.now', return_value=changed.replace(microsecond=900000)):
+            response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('ETag', response)
+        with mock.patch('travel_wishlist.conditional.timezone.now', return_value=changed.replace(second=1)):
+            response = self.client.get(url)
+        self.assertEqual('Thu, 01 Jan 2026 12:00:00 GMT', response['Last-Modified'])
+
+    def test_place_details_answers_if_none_match(self):
+        url = reverse('place_details', kwargs={'place_pk': 1})
+        response = self.client.get(url)
+        self.assertNotModified(url, if_none_match=response['ETag'])
+
+    def test_etag_differs_per_page(self):
+        with self.settings(PLACES_PER_PAGE=1):
+            first = self.client.get(reverse('place_list'))
+            second = self.client.get(reverse('place_list'), {'after': first.context['page'].next_cursor})
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        self.assertNotEqual(first['ETag'], self.client.get(reverse('places_visited'))['ETag'])
+
+    def test_full_response_after_places_change(self):
+        etag = self.client.get(reverse('place_list'))['ETag']
+        self.client.post(reverse('place_was_visited', args=(2,)))
+        response = self.client.get(reverse('place_list'), headers={'if_none_match': etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotContains(response, 'New York')
+
+    def test_full_response_after_delete(self):
+        etag = self.client.get(reverse('places_visited'))['ETag']
+        self.client.post(reverse('delete_place', args=(1,)))
+        response = self.client.get(reverse('places_visited'), headers={'if_none_match': etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotContains(response, 'Tokyo')
+
+    def test_place_details_full_response_after_another_place_added(self):
+        # The nav on the page shows how many places are on the wishlist
+        url = reverse('place_details', kwargs={'place_pk': 2})
+        etag = self.client.get(url)['ETag']
+        self.client.post(reverse('place_list'), {'name': 'Denver', 'visited': False})
+        response = self.client.get(url, headers={'if_none_match': etag})
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, '<span id="wishlist-count">(3)</span>', html=True)
+
+    def test_full_response_after_place_details_change(self):
+        url = reverse('place_details', kwargs={'place_pk': 1})
+        etag = self.client.get(url)['ETag']
+        self.client.post(url, {'notes': 'new notes', 'date_visited': '2014-01-01'})
+        # The first page after the update shows the 'Trip information updated!' message
+        response = self.client.get(url, headers={'if_none_match': etag})
+        self.assertContains(response, 'new notes')
+        self.assertContains(response, 'Trip information updated!')
+        # and then the page without the message is cached in its own right
+        response = self.client.get(url, headers={'if_none_match': response['ETag']})
+        self.assertEqual(200, response.status_code)
+
+    def test_other_users_place_still_forbidden(self):
+        url = reverse('place_details', kwargs={'place_pk': 5})
+        self.assertEqual(403, self.client.get(url, headers={'if_none_match': '*'}).status_code)
+
+    def test_posts_not_made_conditional(self):
+        etag = self.client.get(reverse('place_list'))['ETag']
+        response = self.client.post(reverse('place_list'), {'name': 'Denver', 'visited': False}, headers={'if_none_match': etag})
+        self.assertEqual(302, response.status_code)
+
+
+class TestBulkImportExport(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.user = User.objects.get(pk=1)
+        self.client.force_login(self.user)
+        self.carol = User.objects.create(username='carol')
+        self.fixture_path = os.path.join(os.path.dirname(__file__), 'fixtures', 'test_places.json')
+
+    def write_file(self, content, suffix):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_command_imports_fixture_file_for_user(self):
+        call_command('import_places', self.fixture_path, user='carol', verbosity=0)
+        places = Place.objects.filter(user=self.carol).order_by('name')
+        self.assertEqual(['Hawaii', 'Los Angeles', 'Moab', 'New York', 'San Francisco', 'Tokyo'],
+                         [place.name for place in places])
+        tokyo = places.get(name='Tokyo')
+        self.assertTrue(tokyo.visited)
+        self.assertEqual('2014-01-01', str(tokyo.date_visited))
+        self.assertEqual('cool', tokyo.notes)
+
+    def test_command_imports_csv_with_user_per_record(self):
+        path = self.write_file(f'user,name,visited,date_visited\n2,Denver,False,\n{self.carol.pk},Boston,True,2020-05-01\n', '.csv')
+        call_command('import_places', path, verbosity=0)
+        self.assertTrue(Place.objects.filter(user_id=2, name='Denver', visited=False).exists())
+        self.assertTrue(Place.objects.filter(user=self.carol, name='Boston', visited=True).exists())
+
+    def test_command_imports_in_batches_and_reports_bad_record(self):
+        lines = [f'{{"name": "Place {n}"}}' for n in range(3)] + ['{"name": ""}']
+        path = self.write_file('\n'.join(lines), '.jsonl')
+        with self.assertRaisesMessage(CommandError, 'Record 4: name: This field cannot be blank. 2 places were imported'):
+            call_command('import_places', path, user='carol', batch_size=2, verbosity=0)
+        # The first batch was committed, the second was never inserted
+        self.assertEqual(['Place 0', 'Place 1'], sorted(Place.objects.filter(user=self.carol).values_list('name', flat=True)))
+
+    def test_command_rejects_unknown_user_in_record(self):
+        path = self.write_file('{"user": 99, "name": "Nowhere"}\n', '.jsonl')
+        with self.assertRaisesMessage(CommandError, 'Record 1: No user with pk 99.'):
+            call_command('import_places', path, verbosity=0)
+
+    def test_import_endpoint_streams_body_for_current_user(self):
+        body = '{"user": 2, "name": "Denver"}\n{"model": "travel_wishlist.place", "fields": {"name": "Boston", "visited": true}}\n'
+        response = self.client.post(reverse('import_places'), body, content_type='application/jsonl')
+        self.assertEqual(201, response.status_code)
+        self.assertEqual({'imported': 2}, response.json())
+        # Always imported for the logged in user, whatever the records say
+        self.assertTrue(Place.objects.filter(user=self.user, name='Denver', visited=False).exists())
+        self.assertTrue(Place.objects.filter(user=self.user, name='Boston', visited=True).exists())
+        self.assertFalse(Place.objects.filter(user_id=2, name='Denver').exists())
+
+    def test_import_endpoint_reports_errors(self):
+        body = 'name,visited\nDenver,False\nBoston,maybe\n'
+        response = self.client.post(reverse('import_places'), body, content_type='text/csv')
+        self.assertEqual(400, response.status_code)
+        self.assertIn('Record 2: visited', response.json()['error'])
+        self.assertEqual(0, response.json()['imported'])
+        self.assertFalse(Place.objects.filter(name='Denver').exists())
+
+    def test_import_endpoint_reports_row_longer_than_header(self):
+        body = 'name,visited\nDenver,False\nBoston,True,2020-05-01\n'
+        response = self.client.post(reverse('import_places'), body, content_type='text/csv')
+        self.assertEqual(400, response.status_code)
+        self.assertIn('Record 2: This row has more values than the header.', response.json()['error'])
+        self.assertFalse(Place.objects.filter(name='Denver').exists())
+
+    def test_import_form_upload(self):
+        self.client.get(reverse('place_list'))   # cache the page
+        upload = SimpleUploadedFile('places.csv', b'name,visited\nDenver,False\n', content_type='text/csv')
+        response = self.client.post(reverse('import_places'), {'file': upload}, follow=True)
+        self.assertContains(response, 'Imported 1 places.')
+        self.assertContains(self.client.get(reverse('place_list')), 'Denver')
+
+    def test_import_needs_login(self):
+        self.client.logout()
+        response = self.client.post(reverse('import_places'), '{"name": "Denver"}', content_type='application/jsonl')
+        self.assertEqual(302, response.status_code)
+        self.assertFalse(Place.objects.filter(name='Denver').exists())
+
+    def test_export_streams_users_places_as_fixture_lines(self):
+        response = self.client.get(reverse('export_places'))
+        self.assertTrue(response.streaming)
+        self.assertEqual('attachment; filename="places.jsonl"', response['Content-Disposition'])
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([1, 2, 3, 4], [record['pk'] for record in records])
+        self.assertEqual({'model': 'travel_wishlist.place', 'pk': 1}, {key: records[0][key] for key in ('model', 'pk')})
+        self.assertEqual('Tokyo', records[0]['fields']['name'])
+        self.assertIs(True, records[0]['fields']['visited'])
+        self.assertEqual('2014-01-01', records[0]['fields']['date_visited'])
+
+    def test_export_csv_imports_again(self):
+        response = self.client.get(reverse('export_places'), {'format': 'csv'})
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(b'pk,user,name,visited,notes,date_visited,photo,updated_at\r\n'))
+
+        self.client.force_login(self.carol)
+        response = self.client.post(reverse('import_places'), content, content_type='text/csv')
+        self.assertEqual({'imported': 4}, response.json())
+        self.assertEqual(
+            list(Place.objects.filter(user_id=1).order_by('pk').values_list('name', 'visited', 'notes', 'date_visited')),
+            list(Place.objects.filter(user=self.carol).order_by('pk').values_list('name', 'visited', 'notes', 'date_visited')))
+
+
+class TestBulkPlaceActions(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.user = User.objects.get(pk=1)
+        self.client.force_login(self.user)
+        self.MEDIA_ROOT = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.MEDIA_ROOT)
+        self.settings_override = self.settings(MEDIA_ROOT=self.MEDIA_ROOT)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def make_places(self, count, visited=False):
+        places = Place.objects.bulk_create(
+            Place(user=self.user, name=f'Bulk place {n}', visited=visited) for n in range(count))
+        return [place.pk for place in places]
+
+    def add_photo(self, place_pk):
+        handle, img_path = tempfile.mkstemp(suffix='.png')
+        os.close(handle)
+        self.addCleanup(os.remove, img_path)
+        # PNG, since JPEG can save close colours the same, and equal photos are stored once
+        Image.new('RGB', (10, 10), (place_pk % 256, place_pk // 256, 0)).save(img_path, format='PNG')
+        place = Place.objects.get(pk=place_pk)
+        with open(img_path, 'rb') as img_file:
+            place.photo.save(os.path.basename(img_path), img_file)
+        return place.photo.name
+
+    def test_wishlist_has_checkboxes_for_bulk_actions(self):
+        response = self.client.get(reverse('place_list'))
+        self.assertContains(response, 'id="select-place-2" name="place_pk" value="2" form="bulk-actions"')
+        self.assertContains(response, 'id="bulk-actions"')
+        self.assertContains(response, f'formaction="{reverse("delete_places")}"')
+
+    def test_mark_visited_query_count_constant(self):
+        for count in (1, 10, 200):
+            pks = self.make_places(count)
+            # Inside a savepoint: counting the places by year for the stats, the
+            # UPDATE, recording that the user's places changed, and updating their stats
+            with self.assertNumQueries(6):
+                response = self.client.post(reverse('places_were_visited'), {'place_pk': pks})
+            self.assertRedirects(response, reverse('place_list'))
+            self.assertEqual(count, Place.objects.filter(pk__in=pks, visited=True).count())
+
+    def test_mark_visited_skips_other_users_places(self):
+        response = self.client.post(reverse('places_were_visited'), {'place_pk': [2, 3, 5, 999, 'x']})
+        self.assertRedirects(response, reverse('place_list'))
+        self.assertTrue(Place.objects.get(pk=2).visited)
+        self.assertTrue(Place.objects.get(pk=3).visited)
+        self.assertFalse(Place.objects.get(pk=5).visited)
+
+    def test_mark_visited_updates_cached_pages(self):
+        self.client.get(reverse('place_list'))
+        self.client.post(reverse('places_were_visited'), {'place_pk': [2, 3]})
+        response = self.client.get(reverse('place_list'))
+        self.assertNotContains(response, 'New York')
+        self.assertNotContains(response, 'San Francisco')
+
+    def test_delete_query_count_constant(self):
+        for count in (1, 10, 50):
+            pks = self.make_places(count)
+            names = [self.add_photo(pk) for pk in pks]
+            with self.captureOnCommitCallbacks() as callbacks:
+                # In a savepoint: the places' photos, counting the places by year for
+                # the stats, the DELETE, recording the change, updating the stats, and
+                # releasing all the photos together (their counts, which are in use,
+                # the rendition names, then deleting the count and rendition rows)
+                with self.assertNumQueries(12):
+                    response = self.client.post(reverse('delete_places'), {'place_pk': pks})
+            self.assertRedirects(response, reverse('place_list'))
+            self.assertFalse(Place.objects.filter(pk__in=pks).exists())
+
+            with self.assertNumQueries(1):   # all the photos queued in one INSERT
+                for callback in callbacks:
+                    callback()
+            self.assertEqual(sorted(names), sorted(PhotoDeletion.objects.filter(name__in=names).values_list('name', flat=True)))
+
+    def test_delete_without_photos(self):
+        pks = self.make_places(20)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('delete_places'), {'place_pk': pks})
+        self.assertFalse(Place.objects.filter(pk__in=pks).exists())
+        self.assertFalse(PhotoDeletion.objects.exists())
+
+    def test_delete_skips_other_users_places(self):
+        self.client.post(reverse('delete_places'), {'place_pk': [2, 5, 6]})
+        self.assertFalse(Place.objects.filter(pk=2).exists())
+        self.assertTrue(Place.objects.filter(pk=5).exists())
+        self.assertTrue(Place.objects.filter(pk=6).exists())
+
+    def test_shared_photo_kept_while_a_place_uses_it(self):
+        name = self.add_photo(2)
+        place = Place.objects.get(pk=3)
+        place.photo = name
+        place.save()
+        PhotoBlob.objects.filter(name=name).update(refcount=2)   # as a second upload of the same photo would
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('delete_places'), {'place_pk': [2]})
+        self.assertEqual(1, PhotoBlob.objects.get(name=name).refcount)
+        self.assertFalse(PhotoDeletion.objects.exists())
+
+    def test_nothing_selected(self):
+        with self.assertNumQueries(0):   # the session and user are cached
+            response = self.client.post(reverse('delete_places'))
+        self.assertEqual(302, response.status_code)
+
+
+class TestPlacesAPI(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.user = User.objects.get(pk=1)
+        self.client.force_login(self.user)
+
+    def test_list_default_fields(self):
+        response = self.client.get(reverse('api_places'))
+        self.assertEqual({'places': [
+            {'pk': 4, 'name': 'Moab', 'visited': True},
+            {'pk': 2, 'name': 'New York', 'visited': False},
+            {'pk': 3, 'name': 'San Francisco', 'visited': False},
+            {'pk': 1, 'name': 'Tokyo', 'visited': True},
+        ], 'next': None, 'previous': None}, response.json())
+
+    def test_list_selects_only_requested_columns(self):
+        with self.assertNumQueries(1) as context:   # just the places
+            response = self.client.get(reverse('api_places'), {'fields': 'notes', 'visited': 'true'})
+        sql = context.captured_queries[-1]['sql']
+        self.assertIn('"notes"', sql)
+        self.assertNotIn('"date_visited"', sql)
+        self.assertNotIn('"photo"', sql)
+        self.assertEqual([{'notes': None}, {'notes': 'cool'}], response.json()['places'])
+
+    def test_list_does_not_make_model_instances(self):
+        with mock.patch.object(Place, 'from_db', side_effect=AssertionError('model instance made')):
+            response = self.client.get(reverse('api_places'), {'fields': 'pk,name,updated_at'})
+        self.assertEqual(200, response.status_code)
+
+    def test_list_keyset_pagination(self):
+        first = self.client.get(reverse('api_places'), {'per_page': 3, 'fields': 'name'}).json()
+        self.assertEqual(['Moab', 'New York', 'San Francisco'], [place['name'] for place in first['places']])
+        second = self.client.get(reverse('api_places'), {'per_page': 3, 'fields': 'name', 'after': first['next']}).json()
+        self.assertEqual([{'name': 'Tokyo'}], second['places'])
+        self.assertIsNone(second['next'])
+        back = self.client.get(reverse('api_places'), {'per_page': 3, 'fields': 'name', 'before': second['previous']}).json()
+        self.assertEqual(first['places'], back['places'])
+
+    def test_unknown_field_rejected(self):
+        response = self.client.get(reverse('api_places'), {'fields': 'name,user__password'})
+        self.assertEqual(400, response.status_code)
+        self.assertIn('user__password', response.json()['error'])
+
+    def test_detail(self):
+        response = self.client.get(reverse('api_place', args=(1,)))
+        data = response.json()
+        self.assertEqual('Tokyo', data['name'])
+        self.assertEqual('2014-01-01', data['date_visited'])
+        self.assertIsNone(data['photo'])
+        response = self.client.get(reverse('api_place', args=(1,)), {'fields': 'name'})
+        self.assertEqual({'name': 'Tokyo'}, response.json())
+
+    def test_detail_ownership(self):
+        self.assertEqual(403, self.client.get(reverse('api_place', args=(5,))).status_code)
+        self.assertEqual(404, self.client.get(reverse('api_place', args=(999,))).status_code)
+
+    def test_create(self):
+        response = self.client.post(reverse('api_places'), {'name': 'Oslo', 'visited': False}, content_type='application/json')
+        self.assertEqual(201, response.status_code)
+        data = response.json()
+        self.assertEqual('Oslo', data['name'])
+        self.assertTrue(Place.objects.filter(pk=data['pk'], user=self.user, name='Oslo').exists())
+
+    def test_create_invalid(self):
+        response = self.client.post(reverse('api_places'), {'visited': False}, content_type='application/json')
+        self.assertEqual(400, response.status_code)
+        self.assertIn('name', response.json()['errors'])
+        response = self.client.post(reverse('api_places'), 'not json', content_type='application/json')
+        self.assertEqual(400, response.status_code)
+
+    def test_mark_visited(self):
+        response = self.client.post(reverse('api_place_visited', args=(2,)))
+        self.assertEqual({'pk': 2, 'visited': True}, response.json())
+        self.assertTrue(Place.objects.get(pk=2).visited)
+        self.assertEqual(403, self.client.post(reverse('api_place_visited', args=(5,))).status_code)
+        self.assertFalse(Place.objects.get(pk=5).visited)
+
+    def test_delete(self):
+        self.assertEqual(403, self.client.delete(reverse('api_place', args=(5,))).status_code)
+        self.assertTrue(Place.objects.filter(pk=5).exists())
+        self.assertEqual(204, self.client.delete(reverse('api_place', args=(2,))).status_code)
+        self.assertFalse(Place.objects.filter(pk=2).exists())
+        self.assertEqual(404, self.client.delete(reverse('api_place', args=(2,))).status_code)
+
+    def test_wrong_method(self):
+        self.assertEqual(405, self.client.put(reverse('api_place', args=(1,))).status_code)
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(reverse('api_places'))
+        self.assertEqual(401, response.status_code)
+        self.assertEqual('application/json', response['Content-Type'])
+
+
+class TestSearch(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.user = User.objects.get(pk=1)
+        self.client.force_login(self.user)
+
+    def names(self, query, user=None):
+        return [result['name'] for result in search.search_places(user or self.user, query)]
+
+    def test_index_in_use(self):
+        self.assertTrue(search.search_index_exists(), 'This SQLite has no FTS5, so only the fallback is tested')
+
+    def test_whole_words_prefixes_and_all_words(self):
+        Place.objects.create(user=self.user, name='New Orleans')
+        self.assertEqual([], self.names('tok'))
+        self.assertEqual(['Tokyo'], self.names('tok*'))
+        self.assertEqual(['New Orleans', 'New York'], sorted(self.names('new')))
+        self.assertEqual(['New York'], self.names('new yo*'))
+        self.assertEqual([], self.names('hawaii'))   # another user's place
+
+    def test_only_the_users_places_even_if_the_index_returns_others(self):
+        # As if the index's user_id column were out of step with the place table
+        with mock.patch.object(search, 'fts_query', return_value='{name notes} : ("hawaii")'):
+            self.assertEqual([], self.names('hawaii'))
+            self.assertEqual(['Hawaii'], self.names('hawaii', user=User.objects.get(pk=2)))
+
+    def test_name_matches_rank_above_notes_matches(self):
+        Place.objects.create(user=self.user, name='Lyon', notes='A train ride from Paris, and much cheaper than Paris')
+        Place.objects.create(user=self.user, name='Paris')
+        self.assertEqual(['Paris', 'Lyon'], self.names('paris'))
+
+    def test_highlighted_and_escaped(self):
+        Place.objects.create(user=self.user, name='Cairo <script>', notes='The <b>pyramids</b> at dawn')
+        result = search.search_places(self.user, 'pyramids')[0]
+        self.assertEqual('Cairo &lt;script&gt;', result['name_html'])
+        self.assertEqual('The &lt;b&gt;<mark>pyramids</mark>&lt;/b&gt; at dawn', result['notes_html'])
+
+    def test_long_notes_snippet(self):
+        notes = ' '.join(['filler'] * 100 + ['volcano'] + ['filler'] * 100)
+        Place.objects.create(user=self.user, name='Iceland', notes=notes)
+        snippet = search.search_places(self.user, 'volcano')[0]['notes_html']
+        self.assertIn('<mark>volcano</mark>', snippet)
+        self.assertLess(len(snippet), 200)
+
+    def test_query_syntax_is_not_interpreted(self):
+        for query in ('"', 'NEAR(tokyo', 'tokyo OR', '* - ^', 'name:tokyo'):
+            search.search_places(self.user, query)   # no OperationalError
+        self.assertEqual(['Tokyo'], self.names('(tokyo)!'))
+
+    def test_index_follows_changes(self):
+        place = Place.objects.get(pk=2)
+        place.notes = 'Saw a show on Broadway'
+        place.save()
+        self.assertEqual(['New York'], self.names('broadway'))
+
+        Place.objects.filter(pk=2).update(name='Manhattan')
+        self.assertEqual(['Manhattan'], self.names('manhattan'))
+        self.assertEqual([], self.names('york'))
+
+        Place.objects.bulk_create([Place(user=self.user, name='Bruges')])
+        self.assertEqual(['Bruges'], self.names('bruges'))
+
+        Place.objects.filter(name='Bruges').delete()
+        self.assertEqual([], self.names('bruges'))
+
+        Place.objects.filter(pk=3).update(user_id=2)
+        self.assertEqual([], self.names('francisco'))
+        self.assertEqual(['San Francisco'], self.names('francisco', user=User.objects.get(pk=2)))
+
+    def test_like_fallback(self):
+        Place.objects.create(user=self.user, name='Lyon', notes='Day trip to <Paris>')
+        with mock.patch.object(search, 'search_index_exists', return_value=False):
+            results = search.search_places(self.user, 'paris')
+        self.assertEqual(['Lyon'], [result['name'] for result in results])
+        self.assertEqual('Day trip to &lt;<mark>Paris</mark>&gt;', results[0]['notes_html'])
+
+    def test_lost_triggers_restored_after_migrate(self):
+        from django.db import connection
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {search.FTS_TABLE}_insert')
+        Place.objects.create(user=self.user, name='Reykjavik')
+        self.assertEqual([], self.names('reykjavik'))
+
+        search.ensure_search_index()
+        self.assertEqual(['Reykjavik'], self.names('reykjavik'))
+        Place.objects.create(user=self.user, name='Reykjavik again')
+        self.assertEqual(2, len(self.names('reykjavik')))
+
+    def test_search_view(self):
+        Place.objects.create(user=self.user, name='Kyoto', notes='Temples & gardens')
+        response = self.client.get(reverse('search'), {'q': 'gardens'})
+        self.assertContains(response, 'Temples &amp; <mark>gardens</mark>', html=False)
+        self.assertContains(response, 'id="search-result-')
+        self.assertNotContains(self.client.get(reverse('search'), {'q': 'la'}), 'Los Angeles')
+
+
+class TestPlaceNameSuggestions(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.user = User.objects.get(pk=1)
+        self.client.force_login(self.user)
+
+    def suggestions(self, text, user_id=1):
+        return [(suggestion['name'], suggestion['source']) for suggestion in autocomplete.suggest(user_id, text)]
+
+    def test_gazetteer_prefixes_ignore_case_and_accents(self):
+        gazetteer = autocomplete.gazetteer()
+        self.assertEqual(['Zürich'], [name for key, name in gazetteer.lookup('zur')])
+        self.assertEqual(['São Paulo', 'São Tomé and Príncipe'], [name for key, name in gazetteer.lookup('sao')])
+        self.assertEqual('Aberdeen', gazetteer.lookup('a')[0][1])
+        self.assertEqual([], gazetteer.lookup('zzz'))
+        self.assertEqual(3, len(gazetteer.lookup('', limit=3)))
+
+    def test_gazetteer_binary_search_finds_every_prefix(self):
+        names = ['Ab', 'Abc', 'B', 'Bé', 'Bea', 'C d', 'Ça', 'Zz'] + [f'Place {n}' for n in range(50)]
+        with tempfile.NamedTemporaryFile() as file:
+            autocomplete.write_gazetteer(names, file)
+            file.flush()
+            gazetteer = autocomplete.Gazetteer(file.name)
+            keys = sorted({autocomplete.normalize(name) for name in names})
+            for prefix in {key[:length] for key in keys for length in range(len(key) + 1)} | {'zzz', 'bz'}:
+                expected = [key for key in keys if key.startswith(prefix)][:autocomplete.MAX_SUGGESTIONS]
+                self.assertEqual(expected, [key for key, name in gazetteer.lookup(prefix)], prefix)
+
+    def test_empty_gazetteer(self):
+        with tempfile.NamedTemporaryFile() as file:
+            self.assertEqual([], autocomplete.Gazetteer(file.name).lookup('a'))
+
+    def test_users_places_first_without_repeats(self):
+        Place.objects.create(user=self.user, name='Toronto')
+        suggestions = self.suggestions('to')
+        self.assertEqual([('Tokyo', 'place'), ('Toronto', 'place')], suggestions[:2])
+        self.assertEqual(['Togo', 'Tonga', 'Torres del Paine', 'Toulouse'], [name for name, source in suggestions[2:]])
+        self.assertEqual([], self.suggestions('hawaii'))   # another user's place
+        self.assertEqual([], self.suggestions('   '))
+
+    def place_names(self, text):
+        return [name for name, source in self.suggestions(text) if source == 'place']
+
+    def test_saved_places_merged_in_without_reloading(self):
+        self.suggestions('x')   # loads the user's names
+        with self.captureOnCommitCallbacks(execute=True):
+            Place.objects.create(user=self.user, name='Tbilisi')
+        with self.captureOnCommitCallbacks(execute=True):
+            place = Place.objects.get(pk=2)
+            place.name = 'Newark'
+            place.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(['Tbilisi'], self.place_names('tbil'))
+            self.assertEqual(['Newark'], self.place_names('new'))
+
+    def test_reloaded_after_other_changes(self):
+        self.suggestions('x')
+        delete_places(self.user.pk, [1])
+        with self.assertNumQueries(1):
+            self.assertEqual([], self.place_names('tokyo'))
+
+    def test_endpoint(self):
+        response = self.client.get(reverse('place_name_suggestions'), {'q': 'san'})
+        self.assertEqual({'name': 'San Francisco', 'source': 'place'}, response.json()['suggestions'][0])
+        self.assertIn({'name': 'San Diego', 'source': 'gazetteer'}, response.json()['suggestions'])
+
+    def test_endpoint_needs_login(self):
+        self.client.logout()
+        self.assertEqual(302, self.client.get(reverse('place_name_suggestions'), {'q': 'san'}).status_code)
+
+    def test_wishlist_form_uses_suggestions(self):
+        response = self.client.get(reverse('place_list'))
+        self.assertContains(response, 'list="place-name-suggestions"')
+        self.assertContains(response, f'<datalist id="place-name-suggestions" data-url="{reverse("place_name_suggestions")}">')
+
+    def test_build_gazetteer_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'cities.txt')
+            output = os.path.join(directory, 'gazetteer.tsv')
+            with open(source, 'w', encoding='utf-8') as file:
+                file.write('1\tOslo\tNO\n2\tÅlesund\tNO\n3\tOslo\tNO\n')
+            call_command('build_gazetteer', source, output=output, column=1, verbosity=0)
+            with open(output, encoding='utf-8') as file:
+                self.assertEqual('alesund\tÅlesund\noslo\tOslo\n', file.read())
+
+
+class TestPlaceStats(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.user = User.objects.get(pk=1)
+        self.client.force_login(self.user)
+
+    def stats(self, user_id=1):
+        stats = PlaceStats.objects.get(user_id=user_id)
+        years = dict(VisitYear.objects.filter(user_id=user_id, visits__gt=0).values_list('year', 'visits'))
+        return stats.wishlist_count, stats.visited_count, years
+
+    def assertStatsMatchPlaces(self, user_id=1):
+        kept = self.stats(user_id)
+        rebuild_place_stats([user_id])
+        self.assertEqual(self.stats(user_id), kept)
+
+    def test_fixture_stats_match_places(self):
+        self.assertEqual((2, 2, {2014: 1}), self.stats())
+        self.assertStatsMatchPlaces()
+        self.assertStatsMatchPlaces(user_id=2)
+
+    def test_save_and_delete(self):
+        place = Place.objects.create(user=self.user, name='Oslo')
+        self.assertEqual((3, 2, {2014: 1}), self.stats())
+
+        place.visited = True
+        place.date_visited = datetime.date(2020, 5, 1)
+        place.save()
+        self.assertEqual((2, 3, {2014: 1, 2020: 1}), self.stats())
+
+        place.date_visited = datetime.date(2014, 6, 1)
+        place.save()
+        self.assertEqual((2, 3, {2014: 2}), self.stats())
+
+        place.delete()
+        self.assertEqual((2, 2, {2014: 1}), self.stats())
+        self.assertStatsMatchPlaces()
+
+    def test_moved_to_another_user(self):
+        place = Place.objects.get(pk=1)
+        place.user_id = 2
+        place.save()
+        self.assertEqual((2, 1, {}), self.stats())
+        self.assertEqual((2, 1, {2014: 1}), self.stats(user_id=2))
+
+    def test_bulk_changes(self):
+        Place.objects.filter(pk=2).update(date_visited=datetime.date(2019, 1, 1))
+        rebuild_place_stats([1])
+        mark_places_visited(1, [2, 3, 5])
+        self.assertEqual((0, 4, {2014: 1, 2019: 1}), self.stats())
+        delete_places(1, [1, 2])
+        self.assertEqual((0, 2, {}), self.stats())
+        self.assertStatsMatchPlaces()
+
+    def test_view_and_api_changes(self):
+        Place.objects.filter(pk=2).update(date_visited=datetime.date(2019, 1, 1))
+        rebuild_place_stats([1])
+        self.client.post(reverse('place_was_visited', args=(2,)))
+        self.client.post(reverse('place_was_visited', args=(2,)))   # already visited, so not counted again
+        self.assertEqual((1, 3, {2014: 1, 2019: 1}), self.stats())
+        self.client.post(reverse('api_places'), '{"name": "Lima", "visited": true}', content_type='application/json')
+        self.client.delete(reverse('api_place', args=(3,)))
+        self.assertEqual((0, 4, {2014: 1, 2019: 1}), self.stats())
+        self.assertStatsMatchPlaces()
+
+    def test_import(self):
+        records = [{'name': 'Rome', 'visited': True, 'date_visited': '2014-03-01'}, {'name': 'Bern'}]
+        bulk.import_places(records, user=self.user)
+        self.assertEqual((3, 3, {2014: 2}), self.stats())
+
+    def test_missing_stats_made_from_places(self):
+        user = User.objects.create(username='carol')
+        Place.objects.bulk_create([Place(user=user, name='Quito'), Place(user=user, name='Lima', visited=True)])
+        Place.objects.create(user=user, name='Cusco')   # no stats row to add to, so they're counted
+        self.assertEqual((2, 1, {}), self.stats(user.pk))
+
+    def test_reconcile_command(self):
+        Place.objects.filter(pk=2).update(visited=True, date_visited=datetime.date(2001, 1, 1))
+        PlaceStats.objects.filter(user_id=2).delete()
+        out = io.StringIO()
+        call_command('reconcile_place_stats', batch_size=1, stdout=out)
+        self.assertEqual((1, 3, {2001: 1, 2014: 1}), self.stats())
+        self.assertEqual((2, 0, {}), self.stats(user_id=2))
+        self.assertIn('Checked the stats of 2 users, 2 were wrong', out.getvalue())
+
+    def test_stats_page_reads_only_stats_tables(self):
+        with self.assertNumQueries(2):   # the user's stats and their visits by year
+            response = self.client.get(reverse('travel_stats'))
+        self.assertContains(response, '<span id="stats-visited-count">2</span>', html=True)
+        self.assertContains(response, '<tr id="visit-year-2014"><td>2014</td><td>1</td></tr>', html=True)
+        self.assertContains(response, '<span id="wishlist-count">(2)</span>', html=True)
+
+    def test_counts_on_every_page_cached_until_places_change(self):
+        url = reverse('place_details', kwargs={'place_pk': 2})
+        self.assertContains(self.client.get(url), '<span id="visited-count">(2)</span>', html=True)
+        with mock.patch('travel_wishlist.context_processors.get_place_stats') as get_place_stats:
+            self.client.get(url)
+        get_place_stats.assert_not_called()
+
+        self.client.post(reverse('place_was_visited', args=(2,)))
+        self.assertContains(self.client.get(url), '<span id="visited-count">(3)</span>', html=True)
+
+
+
+class TestLoadTest(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def test_every_url_has_a_scenario(self):
+        self.assertEqual([], loadtest.missing_scenarios())
+
+    def test_every_scenario_runs_without_errors(self):
+        results = loadtest.run_load_test([User.objects.get(pk=1)], requests_per_worker=2)
+        self.assertEqual(sorted(scenario.url_name for scenario in loadtest.SCENARIOS), sorted(results))
+        for name, result in results.items():
+            self.assertEqual(0, result['errors'], f'{name}: {result["error_examples"]}')
+            self.assertEqual(2, result['requests'])
+            self.assertGreater(result['queries_per_request'], 0)
+
+    def test_regressions(self):
+        baseline = {'search': {'errors': 0, 'statuses': ['200'], 'queries_per_request': 4.0, 'p50_ms': 10.0,
+                               'p95_ms': 20.0, 'p99_ms': 30.0, 'throughput_rps': 100.0}}
+        within_noise = dict(baseline['search'], p95_ms=25.0, throughput_rps=80.0)
+        self.assertEqual([], loadtest.regressions({'search': within_noise, 'new_url': within_noise}, baseline,
+                                                  timings=True))
+
+        slower = dict(baseline['search'], p99_ms=50.0, throughput_rps=50.0)
+        self.assertEqual([], loadtest.regressions({'search': slower}, baseline))   # timings only if asked for
+        self.assertEqual(2, len(loadtest.regressions({'search': slower}, baseline, timings=True)))
+
+        worse = dict(baseline['search'], queries_per_request=5.0, errors=1, statuses=['200', '500'])
+        problems = loadtest.regressions({'search': worse}, baseline)
+        self.assertEqual(3, len(problems))
+        self.assertIn('search: 5.00 queries per request, was 4.00', problems)
+        self.assertIn('search: answered 200, 500, was 200', problems)
+
+    def test_committed_baseline_catches_a_regression(self):
+        baseline = loadtest.load_baseline(settings.LOADTEST_BASELINE)
+        self.assertEqual(sorted(scenario.url_name for scenario in loadtest.SCENARIOS), sorted(baseline))
+        for result in baseline.values():
+            self.assertFalse(set(loadtest.TIMING_KEYS) & set(result), 'timings depend on the machine')
+
+        self.assertEqual([], loadtest.regressions(baseline, baseline))
+
+        results = json.loads(json.dumps(baseline))
+        results['search']['queries_per_request'] += 1
+        results['api_place']['statuses'] = ['404']
+        problems = loadtest.regressions(results, baseline)
+        self.assertEqual(['search', 'api_place'], [problem.split(':')[0] for problem in problems])
+
+
+class TestMetrics(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = os.path.join(directory.name, 'var', 'metrics.sqlite3')   # made on first use
+        settings_override = override_settings(METRICS_DB=self.db_path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        metrics.recorder.__init__()
+        self.addCleanup(metrics.recorder.__init__)
+        self.client.force_login(User.objects.get(pk=1))
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_nothing_is_recorded_until_someone_scrapes(self):
+        self.client.get(reverse('place_list'))
+        self.assertNotIn('view="place_list"', self.scrape())
+
+        self.client.get(reverse('place_list'))
+        self.client.get(reverse('place_list'))
+        text = self.scrape()
+        self.assertIn('wishlist_request_seconds_count{view="place_list"} 2', text)
+        self.assertIn('wishlist_request_seconds_bucket{view="place_list",le="+Inf"} 2', text)
+        self.assertIn('# TYPE wishlist_db_queries histogram', text)
+        self.assertNotIn('view="metrics"', text)
+
+    def test_recording_stops_when_nobody_scrapes(self):
+        self.scrape()
+        with override_settings(METRICS_ACTIVE_SECONDS=0):
+            self.client.get(reverse('place_list'))
+        self.assertNotIn('view="place_list"', self.scrape())
+
+    def test_staff_only(self):
+        self.client.force_login(User.objects.create(username='carol'))
+        self.assertEqual(403, self.client.get(reverse('metrics')).status_code)
+        self.client.logout()
+        self.assertEqual(403, self.client.get(reverse('metrics')).status_code)
+
+    def test_queries_and_template_time_are_counted(self):
+        self.scrape()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('place_list'))
+        count = len(queries)
+        text = self.scrape()
+        buckets = dict(re.findall(r'wishlist_db_queries_bucket\{view="place_list",le="([^"]+)"\} (\d+)', text))
+        self.assertEqual('1', buckets['+Inf'])
+        self.assertIn(f'wishlist_db_queries_sum{{view="place_list"}} {count}.000000', text)
+        template_sum = re.search(r'wishlist_template_seconds_sum\{view="place_list"\} ([\d.]+)', text)
+        self.assertGreater(float(template_sum.group(1)), 0)
+
+    def test_storage_time_is_counted(self):
+        recorded = metrics.RequestMetrics()
+        token = metrics._current.set(recorded)
+        try:
+            deletions.photo_storage().exists('user_images/none.jpg')
+        finally:
+            metrics._current.reset(token)
+        self.assertGreater(recorded.storage_seconds, 0)
+
+    def test_totals_include_other_processes(self):
+        self.scrape()
+        self.client.get(reverse('place_list'))
+        other_process = metrics.Histograms()
+        other_process.observe('place_list', {'request_seconds': 0.2})
+        metrics.Store(self.db_path).add(other_process.take())
+        text = self.scrape()
+        self.assertIn('wishlist_request_seconds_count{view="place_list"} 2', text)
+        self.assertIn('wishlist_request_seconds_bucket{view="place_list",le="0.25"} 2', text)
+
+    def test_without_a_shared_file(self):
+        with override_settings(METRICS_DB=None):
+            self.scrape()
+            self.client.get(reverse('place_list'))
+            self.assertIn('wishlist_request_seconds_count{view="place_list"} 1', self.scrape())
+
+
+class TestProfiling(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(PROFILING_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(User.objects.get(pk=1))
+
+    def test_profile_with_cprofile(self):
+        with self.assertLogs('travel_wishlist.profiling', 'INFO') as logs:
+            response = self.client.get(reverse('place_list'), {'profile': ''})
+        self.assertEqual(200, response.status_code)
+        file_name = response['X-Profile']
+        self.assertTrue(file_name.endswith('-place_list-user1.pstats'))
+        stats = pstats.Stats(os.path.join(self.directory, file_name))
+        self.assertTrue(any(function == 'place_list' for (file, line, function) in stats.stats))
+        self.assertIn('queries in', logs.output[0])
+        self.assertTrue(any('FROM "travel_wishlist_place"' in line and 'ms' in line for line in logs.output))
+
+    def test_profile_with_sampling_from_a_header(self):
+        with self.assertLogs('travel_wishlist.profiling', 'INFO'):
+            response = self.client.get(reverse('place_list'), headers={'X-Profile': 'sample'})
+        file_name = response['X-Profile']
+        self.assertTrue(file_name.endswith('.collapsed'))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, file_name)))
+
+    def test_sampler_writes_collapsed_stacks(self):
+        with profiling.Sampler(threading.get_ident(), 0.001) as sampler:
+            time.sleep(0.05)
+        path = os.path.join(self.directory, 'stacks.collapsed')
+        sampler.write(path)
+        with open(path) as file:
+            stack, count = file.readline().rsplit(' ', 1)
+        self.assertIn(';travel_wishlist.tests.TestProfiling.test_sampler_writes_collapsed_stacks', stack)
+        self.assertGreater(int(count), 0)
+
+    def test_only_staff_can_profile(self):
+        self.client.force_login(User.objects.create(username='carol'))
+        response = self.client.get(reverse('place_list'), {'profile': ''})
+        self.assertNotIn('X-Profile', response)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_off_without_a_directory(self):
+        with override_settings(PROFILING_DIR=None):
+            with self.assertRaises(MiddlewareNotUsed):
+                profiling.ProfilingMiddleware(lambda request: None)
+            self.client.handler.load_middleware()
+            response = self.client.get(reverse('place_list'), {'profile': ''})
+        self.assertNotIn('X-Profile', response)
+
+
+class TestSQLiteSettings(TestCase):
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_set_on_new_connections(self):
+        self.assertEqual(5000, self.pragma('busy_timeout'))
+        self.assertEqual(1, self.pragma('synchronous'))   # NORMAL
+        self.assertEqual(-64 * 1024, self.pragma('cache_size'))
+
+    def test_pragma_values_are_checked(self):
+        with override_settings(SQLITE_PRAGMAS={'cache_size': '1; DROP TABLE travel_wishlist_place'}):
+            with self.assertRaises(ValueError):
+                db.configure_connection(None, connection)
+        self.assertEqual(0, Place.objects.count())
+
+
+@override_settings(ROOT_URLCONF='wishlist.async_urls')
+class TestAsyncViews(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.async_client.force_login(User.objects.get(pk=1))
+
+    async def test_wishlist(self):
+        response = await self.async_client.get(reverse('place_list'))
+        self.assertContains(response, 'New York')
+        self.assertNotContains(response, 'Tokyo')   # visited
+        self.assertIn('ETag', response)
+
+        response = await self.async_client.get(reverse('place_list'), headers={'If-None-Match': response['ETag']})
+        self.assertEqual(304, response.status_code)
+
+    async def test_add_place(self):
+        response = await self.async_client.post(reverse('place_list'), {'name': 'Oslo', 'visited': False})
+        self.assertRedirects(response, reverse('place_list'), fetch_redirect_response=False)
+        self.assertTrue(await Place.objects.filter(user_id=1, name='Oslo').aexists())
+        self.assertContains(await self.async_client.get(reverse('place_list')), 'Oslo')
+
+    async def test_mark_visited(self):
+        await self.async_client.post(reverse('place_was_visited', args=(2,)))
+        self.assertTrue((await Place.objects.aget(pk=2)).visited)
+        stats = await PlaceStats.objects.aget(user_id=1)
+        self.assertEqual((1, 3), (stats.wishlist_count, stats.visited_count))
+
+    async def test_other_users_and_missing_places(self):
+        self.assertEqual(403, (await self.async_client.get(reverse('place_details', args=(5,)))).status_code)
+        self.assertEqual(404, (await self.async_client.get(reverse('place_details', args=(999,)))).status_code)
+        self.assertEqual(403, (await self.async_client.post(reverse('delete_place', args=(5,)))).status_code)
+        self.assertTrue(await Place.objects.filter(pk=5).aexists())
+
+    async def test_upload_photo(self):
+        image = io.BytesIO()
+        Image.new('RGB', (10, 10), 'black').save(image, format='JPEG')
+        upload = SimpleUploadedFile('photo.jpg', image.getvalue(), content_type='image/jpeg')
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            response = await self.async_client.post(reverse('place_details', args=(1,)), {'photo': upload})
+            self.assertEqual(302, response.status_code)
+            place = await Place.objects.aget(pk=1)
+            self.assertTrue(os.path.exists(os.path.join(media_root, place.photo.name)))
+            self.assertContains(await self.async_client.get(reverse('place_details', args=(1,))), place.photo.url)
+
+    async def test_export_is_streamed_asynchronously(self):
+        response = await self.async_client.get(reverse('export_places'))
+        self.assertTrue(response.is_async)
+        lines = b''.join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+        self.assertEqual(4, len(lines))
+
+    async def test_stats_search_and_suggestions(self):
+        self.assertContains(await self.async_client.get(reverse('travel_stats')), '2014')
+        self.assertContains(await self.async_client.get(reverse('search'), {'q': 'cool'}), 'Tokyo')
+        response = await self.async_client.get(reverse('place_name_suggestions'), {'q': 'new'})
+        self.assertEqual('New York', response.json()['suggestions'][0]['name'])
+
+    def test_asgi_routes_to_the_async_views(self):
+        from wishlist.asgi import application
+        scope = {'type': 'http', 'method': 'GET', 'path': '/', 'query_string': b'', 'headers': [], 'root_path': ''}
+        request, error_response = application.create_request(scope, io.BytesIO())
+        self.assertEqual('wishlist.async_urls', request.urlconf)
+        with override_settings(ASYNC_VIEWS=False):
+            request, error_response = application.create_request(scope, io.BytesIO())
+            self.assertFalse(hasattr(request, 'urlconf'))
+
+
+class TestStaticFiles(TestCase):
+
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root)
+        storages = {**settings.STORAGES, 'staticfiles': {
+            'BACKEND': 'travel_wishlist.staticfiles.CompressedManifestStaticFilesStorage'}}
+        override = self.settings(STATIC_ROOT=self.static_root, STORAGES=storages)
+        override.enable()
+        self.addCleanup(override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(self.static_root, 'staticfiles.json')) as manifest:
+            self.hashed_style = json.load(manifest)['paths']['css/style.css']
+
+    def test_collectstatic_writes_hashed_and_gzipped_copies(self):
+        self.assertRegex(self.hashed_style, r'^css/style\.[0-9a-f]{12}\.css$')
+        with open(os.path.join(self.static_root, self.hashed_style), 'rb') as style:
+            content = style.read()
+        with gzip.open(os.path.join(self.static_root, self.hashed_style + '.gz')) as compressed:
+            self.assertEqual(content, compressed.read())
+        self.assertFalse(os.path.exists(os.path.join(self.static_root, 'img', 'jtree.jpg.gz')))
+
+    def test_hashed_file_is_served_compressed_and_immutable(self):
+        response = self.client.get('/static/' + self.hashed_style, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('gzip', response['Content-Encoding'])
+        self.assertEqual('text/css', response['Content-Type'])
+        self.assertEqual('Accept-Encoding', response['Vary'])
+        self.assertEqual(staticfiles.IMMUTABLE_CACHE_CONTROL, response['Cache-Control'])
+        self.assertIn(b'jtree.', gzip.decompress(b''.join(response.streaming_content)))
+
+    def test_unhashed_file_uncompressed_for_clients_without_gzip(self):
+        response = self.client.get('/static/css/style.css', headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(staticfiles.CACHE_CONTROL, response['Cache-Control'])
+        response = self.client.get('/static/css/style.css', headers={'If-Modified-Since': response['Last-Modified']})
+        self.assertEqual(304, response.status_code)
+
+    def test_pages_link_the_hashed_stylesheets(self):
+        self.client.force_login(User.objects.create(username='carol'))
+        self.assertContains(self.client.get(reverse('place_list')), '/static/' + self.hashed_style)
+        self.assertEqual(404, self.client.get('/static/css/missing.css').status_code)
+        self.assertNotEqual(200, self.client.get('/static/../wishlist/settings.py').status_code)
+
+
+class TestServePhoto(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.client.force_login(User.objects.get(pk=1))
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = self.settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        image = io.BytesIO()
+        Image.effect_noise((800, 600), 64).convert('RGB').save(image, format='JPEG')
+        upload = SimpleUploadedFile('photo.jpg', image.getvalue(), content_type='image/jpeg')
+        self.client.post(reverse('place_details', args=(1,)), {'photo': upload})
+        self.client.get(reverse('place_details', args=(1,)))   # makes the renditions
+        self.photo = Place.objects.get(pk=1).photo
+        with self.photo.open('rb') as photo:
+            self.content = photo.read()
+
+    def test_owner_gets_photo_cached_privately(self):
+        response = self.client.get(self.photo.url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.content, b''.join(response.streaming_content))
+        self.assertEqual('image/jpeg', response['Content-Type'])
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        response = self.client.get(self.photo.url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(304, response.status_code)
+
+    def test_range_requests(self):
+        response = self.client.get(self.photo.url, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(f'bytes 10-19/{len(self.content)}', response['Content-Range'])
+        self.assertEqual(self.content[10:20], b''.join(response.streaming_content))
+        response = self.client.get(self.photo.url, headers={'Range': 'bytes=-5'})
+        self.assertEqual(self.content[-5:], b''.join(response.streaming_content))
+        response = self.client.get(self.photo.url, headers={'Range': f'bytes={len(self.content)}-'})
+        self.assertEqual(416, response.status_code)
+        response = self.client.get(self.photo.url, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+        self.assertEqual(200, response.status_code)
+
+    def test_renditions_are_served_to_the_owner(self):
+        rendition = PhotoRendition.objects.filter(source=self.photo.name).exclude(name='').first()
+        self.assertEqual(200, self.client.get(self.photo.storage.url(rendition.name)).status_code)
+
+    def test_other_users_photos_not_found_as_if_unknown(self):
+        # Names are content hashes, so a 403 would say that someone has uploaded the image
+        self.client.force_login(User.objects.create(username='carol'))
+        self.assertEqual(404, self.client.get(self.photo.url).status_code)
+        self.assertEqual(404, self.client.get('/media/user_images/nothing.jpg').status_code)
+        self.client.logout()
+        self.assertEqual(302, self.client.get(self.photo.url).status_code)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect')
+    def test_file_sent_by_the_proxy(self):
+        response = self.client.get(self.photo.url)
+        self.assertEqual('/protected-media/' + self.photo.name, response['X-Accel-Redirect'])
+        self.assertEqual(b'', response.content)
+
+
+class TestCachedUser(TestCase):
+
+    fixtures = ['test_users', 'test_places', 'test_place_stats']
+
+    def setUp(self):
+        self.user = User.objects.get(pk=1)
+        self.client.force_login(self.user)
+
+    def test_place_list_query_count(self):
+        places_changed(self.user.pk)   # as any change to their places would, so there's a last modified time
+        # Rendering the page: the last modified time, the places, and the counts in
+        # base.html. No session or user queries, as logging in cached both.
+        with self.assertNumQueries(3):
+            self.assertContains(self.client.get(reverse('place_list')), 'San Francisco')
+        with self.assertNumQueries(1):   # from the page cache, after the last modified time
+            self.client.get(reverse('place_list'))
+
+    def test_user_looked_up_once_after_cache_miss(self):
+        places_changed(self.user.pk)
+        self.client.get(reverse('place_list'))
+        auth.forget_user(self.user.pk)
+        with self.assertNumQueries(2):   # the user, then the last modified time; the session is cached
+            self.client.get(reverse('place_list'))
+        with self.assertNumQueries(1):
+            self.client.get(reverse('place_list'))
+
+    def test_password_change_signs_out_other_sessions(self):
+        self.client.get(reverse('place_list'))
+        user = User.objects.get(pk=1)
+        user.set_password('a new password')
+        user.save()
+        response = self.client.get(reverse('place_list'))
+        self.assertEqual(302, response.status_code)
+        self.assertIn(settings.LOGIN_URL, response['Location'])
+
+    def test_session_hash_checked_against_cached_user(self):
+        # A change that skips post_save leaves the old user cached, but the session
+        # still has to match them
+        session = self.client.session
+        session['_auth_user_hash'] = 'not the hash'
+        session.save()
+        self.assertEqual(302, self.client.get(reverse('place_list')).status_code)
+
+    def test_logout_forgets_the_user(self):
+        self.client.logout()
+        self.assertIsNone(auth.user_cache().get(f'session-user:{self.user.pk}'))
+        self.assertEqual(302, self.client.get(reverse('place_list')).status_code)
+
+    def test_user_saved_is_seen_on_the_next_request(self):
+        self.client.get(reverse('travel_stats'))
+        User.objects.filter(pk=1).update(is_active=False)   # no post_save, so still cached
+        self.assertEqual(200, self.client.get(reverse('travel_stats')).status_code)
+        User.objects.get(pk=1).save()
+        self.assertEqual(302, self.client.get(reverse('travel_stats')).status_code)
+
+    def test_refuses_per_process_cache(self):
+        local_caches = {**settings.CACHES, 'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with self.settings(CACHES=local_caches):
+            with self.assertRaisesMessage(ImproperlyConfigured, 'The sessions cache is per process'):
+                auth.CachedUserMiddleware(lambda request: None)
+            with self.settings(DEBUG=True):
+                auth.CachedUserMiddleware(lambda request: None)
+
+    def test_refuses_cache_directory_others_can_write_to(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        location = os.path.join(directory, 'sessions')
+        file_caches = {**settings.CACHES, 'sessions': {**settings.CACHES['sessions'], 'LOCATION': location}}
+        with self.settings(CACHES=file_caches):
+            auth.CachedUserMiddleware(lambda request: None)
+            self.assertEqual(0o700, stat.S_IMODE(os.stat(location).st_mode))   # made private
+
+            os.chmod(location, 0o777)
+            with self.assertRaisesMessage(ImproperlyConfigured, f'{location} holds pickled sessions'):
+                auth.CachedUserMiddleware(lambda request: None)
+
+    async def test_async_views_use_the_cached_user(self):
+        await self.async_client.aforce_login(self.user)
+        queries = []
+        with override_settings(ROOT_URLCONF='wishlist.async_urls'), \
+                db.listening_to_queries(lambda sql, params, context, seconds: queries.append(sql)):
+            response = await self.async_client.get(reverse('travel_stats'))
+        self.assertContains(response, '2014')
+        self.assertEqual(2, len(queries))   # the user's stats and their visits by year
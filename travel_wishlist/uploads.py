@@ -0,0 +1,176 @@
+"""
+Bounded-memory handling of uploaded photos.
+
+BoundedUploadHandler streams every uploaded file to a temporary file on disk and
+stops keeping a file once it is bigger than PHOTO_UPLOAD_MAX_BYTES, so a huge
+upload never sits in memory or fills the disk. PhotoField then reads the image
+size from the file header, before anything is decoded, to reject decompression
+bombs. Finally it re-encodes the photo in a small thread pool, scaled down to
+PHOTO_MAX_DIMENSION and without its EXIF metadata (which can include the GPS
+position the photo was taken at). JPEGs are decoded at reduced scale. The size
+of the pool limits how many photos are decoded at once, so memory use has an
+upper bound however large the uploaded files are.
+"""
+
+import io
+import os
+import tempfile
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps
+
+
+REENCODED_FORMATS = {'JPEG', 'MPO', 'PNG', 'WEBP'}
+
+
+def max_upload_bytes():
+    return getattr(settings, 'PHOTO_UPLOAD_MAX_BYTES', 25 * 1024 * 1024)
+
+
+def max_pixels():
+    return getattr(settings, 'PHOTO_MAX_PIXELS', 50_000_000)
+
+
+def max_dimension():
+    return getattr(settings, 'PHOTO_MAX_DIMENSION', 2560)
+
+
+class RejectedUpload(UploadedFile):
+    """ Stands in for an uploaded file that was too large to keep. It has an
+    empty file, so closing it with the request's other uploads works. """
+
+    def __init__(self, name, size):
+        super().__init__(file=io.BytesIO(), name=name, size=size)
+
+
+class BoundedUploadHandler(TemporaryFileUploadHandler):
+    """ Stream uploaded files to disk, discarding any file that grows too large. """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.too_large = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.too_large:
+            return None
+        if start + len(raw_data) > max_upload_bytes():
+            # Stop writing, but keep reading the rest of the request so the
+            # other form fields still arrive and the form can show an error.
+            self.too_large = True
+            self.file.truncate(0)
+            return None
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if self.too_large:
+            self.file.close()   # removes the temporary file
+            return RejectedUpload(self.file_name, file_size)
+        return super().file_complete(file_size)
+
+
+class PhotoField(forms.ImageField):
+    """ An ImageField that rejects oversized uploads and re-encodes valid ones. """
+
+    default_error_messages = {
+        'too_large': 'Photos can be at most %(max_size)s.',
+        'too_many_pixels': 'Photos can be at most %(max_megapixels)s megapixels.',
+    }
+
+    def to_python(self, data):
+        if isinstance(data, RejectedUpload):
+            raise ValidationError(self.error_messages['too_large'], code='too_large',
+                                  params={'max_size': filesizeformat(max_upload_bytes())})
+        if data in self.empty_values or not hasattr(data, 'read'):
+            return super().to_python(data)
+
+        width, height = read_dimensions(data)
+        if width * height > max_pixels():
+            raise ValidationError(self.error_messages['too_many_pixels'], code='too_many_pixels',
+                                  params={'max_megapixels': max_pixels() // 1_000_000})
+
+        upload = super().to_python(data)
+        return process_photo(upload)
+
+
+def read_dimensions(upload):
+    """ The (width, height) in an image file's header, or (0, 0) if it's not an image.
+    Nothing is decoded, so this is safe to call on a decompression bomb. """
+    source = upload.temporary_file_path() if hasattr(upload, 'temporary_file_path') else upload
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(source) as image:
+                return image.size
+    except Image.DecompressionBombError:
+        # Pillow refuses to open images over twice its own pixel limit
+        return Image.MAX_IMAGE_PIXELS * 2, 1
+    except Exception:
+        return 0, 0   # not an image; ImageField.to_python reports it
+    finally:
+        if hasattr(upload, 'seek'):
+            upload.seek(0)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'PHOTO_PROCESSING_WORKERS', 2)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='photo')
+        return _executor
+
+
+def process_photo(upload):
+    """ Re-encode an uploaded photo in the photo thread pool, and return the new file. """
+    return executor().submit(reencode, upload).result()
+
+
+def reencode(upload):
+    """ Scale upload down to fit max_dimension() and save it again without its EXIF
+    metadata. The new data replaces the upload's file, so the request still closes
+    and removes it. Formats that aren't re-encoded are left as they are. """
+
+    source = upload.temporary_file_path() if hasattr(upload, 'temporary_file_path') else upload
+    limit = max_dimension()
+
+    with Image.open(source) as image:
+        image_format = 'JPEG' if image.format == 'MPO' else image.format
+        if image_format not in REENCODED_FORMATS:
+            upload.seek(0)
+            return upload
+
+        # For JPEGs, decode at 1/2, 1/4 or 1/8 scale when that is still at least
+        # as big as needed, so a huge photo is never decoded at full size
+        image.draft(None, (limit, limit))
+        icc_profile = image.info.get('icc_profile')
+
+        photo = ImageOps.exif_transpose(image)   # keep the orientation the EXIF data gave it
+        photo.thumbnail((limit, limit))
+        if image_format == 'JPEG' and photo.mode not in ('RGB', 'L', 'CMYK'):
+            photo = photo.convert('RGB')
+
+        reencoded = tempfile.NamedTemporaryFile(suffix='.upload' + os.path.splitext(upload.name)[1],
+                                                dir=settings.FILE_UPLOAD_TEMP_DIR)
+        options = {'quality': 90, 'optimize': True} if image_format in ('JPEG', 'WEBP') else {'optimize': True}
+        if icc_profile:
+            options['icc_profile'] = icc_profile
+        photo.save(reencoded, format=image_format, **options)
+
+    upload.file.close()   # a temporary file is removed when it's closed
+    upload.file = reencoded
+    upload.size = reencoded.tell()
+    upload.content_type = Image.MIME.get(image_format)
+    upload.seek(0)
+    return upload
@@ -1,10 +1,28 @@
 from django.urls import path
-from . import views
-
-urlpatterns = [
-    path('', views.place_list, name='place_list'),
-    path('visited', views.places_visited, name='places_visited'),
-    path('place/<int:place_pk>/was_visited', views.place_was_visited, name='place_was_visited'),
-    path('place/<int:place_pk>', views.place_details, name='place_details'),
-    path('place/<int:place_pk>/delete', views.delete_place, name='delete_place'),
-]
+from . import views, async_views, api
+
+
+def place_urls(views):
+    """ The app's URLs, served by the views in the module views: views, or
+    async_views for ASGI. The API views are the same in both. """
+    return [
+        path('', views.place_list, name='place_list'),
+        path('visited', views.places_visited, name='places_visited'),
+        path('place/<int:place_pk>/was_visited', views.place_was_visited, name='place_was_visited'),
+        path('place/<int:place_pk>', views.place_details, name='place_details'),
+        path('place/<int:place_pk>/delete', views.delete_place, name='delete_place'),
+        path('places/were_visited', views.places_were_visited, name='places_were_visited'),
+        path('places/delete', views.delete_places, name='delete_places'),
+        path('search', views.search, name='search'),
+        path('stats', views.travel_stats, name='travel_stats'),
+        path('suggest', views.place_name_suggestions, name='place_name_suggestions'),
+        path('import', views.import_places, name='import_places'),
+        path('export', views.export_places, name='export_places'),
+        path('api/places', api.places, name='api_places'),
+        path('api/places/<int:place_pk>', api.place, name='api_place'),
+        path('api/places/<int:place_pk>/visited', api.place_visited, name='api_place_visited'),
+    ]
+
+
+urlpatterns = place_urls(views)
+async_urlpatterns = place_urls(async_views)
@@ -1,12 +1,44 @@
-from django.shortcuts import render, redirect, get_object_or_404
-from .models import Place
-from .forms import NewPlaceForm, TripReviewForm
+from django.shortcuts import render, redirect
+from .models import (Place, VisitYear, get_place_stats, places_changed, stats_changes, update_place_stats,
+                     mark_places_visited, delete_places as delete_user_places)
+from .forms import NewPlaceForm, TripReviewForm, PlacesImportForm
+from . import bulk
+from .pagination import paginate
+from .images import srcset
+from .search import search_places
+from .autocomplete import suggest
+from .cache import render_cached
+from .conditional import conditional_get, places_etag, places_last_modified, place_etag, place_last_modified
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.cache import cache_control
 from django.contrib import messages
-from django.http import HttpResponseForbidden
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+
+
+def get_place_or_deny(user, place_pk, queryset=None):
+    """ Fetch the place with this pk if it belongs to user. The lookup is scoped
+    to the user, so someone else's place is never loaded. If nothing matches,
+    raise Http404 if there is no such place at all, or PermissionDenied (a 403
+    response) if it belongs to another user. """
+    queryset = Place.objects.all() if queryset is None else queryset
+    place = queryset.filter(pk=place_pk, user=user).first()
+    if place is None:
+        raise_for_missing_place(place_pk)
+    return place
+
+
+def raise_for_missing_place(place_pk):
+    """ Explain why an ownership-scoped lookup or update of place_pk matched nothing. """
+    if Place.objects.filter(pk=place_pk).exists():
+        raise PermissionDenied
+    raise Http404('No Place matches the given query.')
 
 
 @login_required
+@cache_control(private=True, no_cache=True)   # browsers check back each time, and get a 304 if nothing changed
+@conditional_get(places_etag, places_last_modified)
 def place_list(request):
 
     """ If this is a POST request, the user clicked the Add button
@@ -15,7 +47,9 @@ def place_list(request):
     This creates a GET request to this same route.
 
     If not a POST route, or Place is not valid, display a page with
-    a list of places and a form to add a new place.
+    a list of places and a form to add a new place. The list is shown
+    one page at a time; the after and before query parameters are the
+    cursors for the next and previous pages.
     """
 
     if request.method == 'POST':
@@ -27,63 +61,207 @@ def place_list(request):
             return redirect('place_list')
 
     # If not a POST request, or the form is not valid, display the page
-    # with the form, and place list
-    places = Place.objects.filter(user=request.user).filter(visited=False).order_by('name')
-    form = NewPlaceForm()
-    return render(request, 'travel_wishlist/wishlist.html', {'places': places, 'new_place_form': form})
+    # with the form, and place list.
+    return render_wishlist(request)
+
+
+def render_wishlist(request):
+    """ The wishlist page, cached until the user's places change. """
+    def get_context():
+        places = Place.objects.filter(user=request.user).filter(visited=False)
+        page = paginate(places, after=request.GET.get('after'), before=request.GET.get('before'))
+        form = NewPlaceForm()
+        return {'places': page.items, 'page': page, 'new_place_form': form}
+
+    return render_cached(request, 'travel_wishlist/wishlist.html', get_context,
+                         request.GET.get('after'), request.GET.get('before'))
 
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@conditional_get(places_etag, places_last_modified)
 def places_visited(request):
-    visited = Place.objects.filter(user=request.user).filter(visited=True).order_by('name')
-    return render(request, 'travel_wishlist/visited.html', {'visited': visited})
+    return render_visited(request)
+
+
+def render_visited(request):
+    def get_context():
+        visited = Place.objects.filter(user=request.user).filter(visited=True)
+        page = paginate(visited, after=request.GET.get('after'), before=request.GET.get('before'))
+        return {'visited': page.items, 'page': page}
+
+    return render_cached(request, 'travel_wishlist/visited.html', get_context,
+                         request.GET.get('after'), request.GET.get('before'))
+
+
+def mark_place_visited(user, place_pk):
+    """ Mark the user's place visited with a single UPDATE, scoped to the user so
+    they can only visit their own places. It's read first, for the year it was
+    visited in their stats; if that finds nothing, it's a 404 or 403. """
+    place = Place.objects.filter(pk=place_pk, user=user).values('visited', 'date_visited').first()
+    if place is None:
+        raise_for_missing_place(place_pk)
+    # visited=False, so only one request counts it if two race
+    if Place.objects.filter(pk=place_pk, visited=False).update(visited=True, updated_at=timezone.now()):
+        count_visit(user.pk, place['date_visited'])
+
+
+def count_visit(user_id, date_visited):
+    """ Do what Place.save would have, for a place update() marked visited. """
+    places_changed(user_id)
+    changes = stats_changes(user_id, True, date_visited)
+    changes.update(stats_changes(user_id, False, date_visited, places=-1))
+    update_place_stats(changes)
 
 
 @login_required
 def place_was_visited(request, place_pk):
+    """ The Visited! button on a place's own page. The wishlist's buttons share
+    one form, which posts to places_were_visited. """
     if request.method == 'POST':
-        place = get_object_or_404(Place, pk=place_pk)
-        if place.user == request.user:    # only let a user visit their own places
-            place.visited = True   
-            place.save()
-        else:
-            return HttpResponseForbidden()
+        mark_place_visited(request.user, place_pk)
     
     return redirect('place_list')
 
 
 @login_required
 def delete_place(request, place_pk):
-    place = get_object_or_404(Place, pk=place_pk)
-    if place.user == request.user:
-        place.delete()
-        return redirect('place_list')
-    else:
-        return HttpResponseForbidden() 
+    place = get_place_or_deny(request.user, place_pk)
+    place.delete()
+    return redirect('place_list')
+
+
+def selected_place_pks(request):
+    """ The pks of the places ticked in the wishlist's bulk actions form. """
+    return {int(pk) for pk in request.POST.getlist('place_pk') if pk.isdigit()}
 
 
 @login_required
-def place_details(request, place_pk):
+def places_were_visited(request):
+    if request.method == 'POST':
+        # One UPDATE for all the ticked places, scoped to the user, so places
+        # that aren't theirs are skipped
+        mark_places_visited(request.user.pk, selected_place_pks(request))
 
-    place = get_object_or_404(Place, pk=place_pk)
+    return redirect('place_list')
 
-    if place.user != request.user:
-        return HttpResponseForbidden()
 
+@login_required
+def delete_places(request):
     if request.method == 'POST':
-        form = TripReviewForm(request.POST, request.FILES, instance=place)  # instance = model object to update with the form data
-        if form.is_valid():
-            form.save()
-            messages.info(request, 'Trip information updated!')
-        else:
-            messages.error(request, form.errors)  # Temp error message - future version should improve 
+        # One DELETE, scoped to the user, and their photos cleaned up as a batch
+        delete_user_places(request.user.pk, selected_place_pks(request))
+
+    return redirect('place_list')
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@conditional_get(place_etag, place_last_modified)
+def place_details(request, place_pk):
 
+    place = get_place_or_deny(request.user, place_pk)
+
+    if request.method == 'POST':
+        save_trip_review(request, place)
         return redirect('place_details', place_pk=place_pk)
 
     else:    # GET place details
-        if place.visited:
-            review_form = TripReviewForm(instance=place)  # Pre-populate with data from this Place instance
-            return render(request, 'travel_wishlist/place_detail.html', {'place': place, 'review_form': review_form} )
+        return render_place_details(request, place)
+
+
+def render_place_details(request, place):
+    if place.visited:
+        review_form = TripReviewForm(instance=place)  # Pre-populate with data from this Place instance
+        photo_srcset = srcset(place.photo)   # makes any missing resized copies
+        return render(request, 'travel_wishlist/place_detail.html', {'place': place, 'review_form': review_form, 'photo_srcset': photo_srcset} )
+
+    else:
+        return render(request, 'travel_wishlist/place_detail.html', {'place': place} )
+
+
+def save_trip_review(request, place):
+    """ Update place from the trip review form posted, and say how it went in a message. """
+    form = TripReviewForm(request.POST, request.FILES, instance=place)  # instance = model object to update with the form data
+    if form.is_valid():
+        form.save()
+        messages.info(request, 'Trip information updated!')
+    else:
+        messages.error(request, form.errors)  # Temp error message - future version should improve 
+
+
+@login_required
+def import_places(request):
 
+    """ Add places for the user in bulk, from JSON lines or CSV in the shape of
+    an export. A file uploaded with the form on this page is checked and the
+    result shown as a message. Any other POST is read as the data itself,
+    as it arrives, with the format from its Content-Type (text/csv, or JSON
+    lines otherwise), and the result is sent back as JSON. Those requests need
+    an X-CSRFToken header. """
+
+    if request.method == 'POST' and request.content_type != 'multipart/form-data':
+        records = bulk.read_records(request, bulk.guess_format(content_type=request.content_type))
+        try:
+            imported = bulk.import_places(records, user=request.user)
+        except bulk.PlaceImportError as error:
+            return JsonResponse({'error': str(error), 'imported': error.imported}, status=400)
+        return JsonResponse({'imported': imported}, status=201)
+
+    if request.method == 'POST':
+        form = PlacesImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            records = bulk.read_records(upload, bulk.guess_format(upload.name, upload.content_type))
+            try:
+                imported = bulk.import_places(records, user=request.user)
+                messages.info(request, f'Imported {imported} places.')
+            except bulk.PlaceImportError as error:
+                messages.error(request, f'{error} {error.imported} places were imported before it.')
         else:
-            return render(request, 'travel_wishlist/place_detail.html', {'place': place} )
+            messages.error(request, form.errors)
+        return redirect('import_places')
+
+    return render(request, 'travel_wishlist/import.html', {'import_form': PlacesImportForm()})
+
+
+@login_required
+def export_places(request):
+    """ All the user's places, as JSON lines in the shape of the fixtures, or as
+    CSV with ?format=csv. The places are read and sent a batch at a time. """
+    export_format = 'csv' if request.GET.get('format') == 'csv' else 'jsonl'
+    places = Place.objects.filter(user=request.user)
+    return export_response(bulk.export_places(places, export_format), export_format)
+
+
+def export_response(content, export_format):
+    content_type = 'text/csv' if export_format == 'csv' else 'application/jsonl'
+    response = StreamingHttpResponse(content, content_type=f'{content_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="places.{export_format}"'
+    return response
+
+
+@login_required
+def search(request):
+    """ The user's places with names or notes matching the words in ?q=, best
+    matches first. See search.py. """
+    query = request.GET.get('q', '').strip()
+    results = search_places(request.user, query) if query else []
+    return render(request, 'travel_wishlist/search.html', {'query': query, 'results': results})
+
+
+@login_required
+def travel_stats(request):
+    """ How many places the user has to visit and has visited, and visits by
+    year, all read from the stats tables rather than counted from the places. """
+    stats = get_place_stats(request.user.pk)
+    years = VisitYear.objects.filter(user=request.user, visits__gt=0).order_by('-year')
+    counts = {'wishlist': stats.wishlist_count, 'visited': stats.visited_count}   # for base.html, already read
+    return render(request, 'travel_wishlist/stats.html', {'stats': stats, 'years': years, 'place_counts': counts})
+
+
+@login_required
+def place_name_suggestions(request):
+    """ Names starting with ?q=, for the add place form: the user's own
+    place names first, then names from the gazetteer. See autocomplete.py. """
+    return JsonResponse({'suggestions': suggest(request.user.pk, request.GET.get('q', ''))})
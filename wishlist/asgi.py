@@ -0,0 +1,34 @@
+"""
+ASGI config for wishlist project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+With settings.ASYNC_VIEWS on, requests are routed with async_urls.py, to the
+async versions of the app's views; see travel_wishlist/async_views.py.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/stable/howto/deployment/asgi/
+"""
+
+import os
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wishlist.settings")
+# Each async request runs its sync code in a thread of its own, so connections
+# kept open between requests would be left behind in threads that have ended
+os.environ.setdefault("DB_CONN_MAX_AGE", "0")
+django.setup(set_prefix=False)
+
+
+class WishlistASGIHandler(ASGIHandler):
+
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+        if request is not None and settings.ASYNC_VIEWS:
+            request.urlconf = 'wishlist.async_urls'
+        return request, error_response
+
+
+application = WishlistASGIHandler()
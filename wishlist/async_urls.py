@@ -0,0 +1,16 @@
+"""
+The URLs in urls.py, with the app's async views in place of its sync ones.
+asgi.py routes requests with these when settings.ASYNC_VIEWS is on.
+"""
+
+from django.urls import path, include
+
+from travel_wishlist.urls import async_urlpatterns
+
+from .urls import urlpatterns as sync_urlpatterns
+
+# Matched first, so everything else is as in urls.py
+urlpatterns = [
+    path('', include(async_urlpatterns)),
+    *sync_urlpatterns,
+]
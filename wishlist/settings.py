@@ -16,6 +16,13 @@ import os
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Files the app writes as it runs, private to the user it runs as
+VAR_DIR = Path(os.environ.get('WISHLIST_VAR_DIR', BASE_DIR / 'var'))
+
+
+def env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/6.0/howto/deployment/checklist/
@@ -42,11 +49,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'travel_wishlist.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'travel_wishlist.staticfiles.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'travel_wishlist.auth.CachedUserMiddleware',
+    'travel_wishlist.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -55,32 +66,67 @@ ROOT_URLCONF = 'wishlist.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for the request metrics
+        'BACKEND': 'travel_wishlist.metrics.TimedDjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
+        'APP_DIRS': False,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'travel_wishlist.context_processors.place_counts',
+            ],
+            # Templates are parsed once per process and kept. With DEBUG on, the
+            # autoreloader empties the cache when a template changes; otherwise,
+            # restart the server to pick up edited templates.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'wishlist.wsgi.application'
+ASGI_APPLICATION = 'wishlist.asgi.application'
+
+# Under ASGI, serve the async versions of the app's views, see wishlist/asgi.py
+ASYNC_VIEWS = env_bool('WISHLIST_ASYNC_VIEWS', True)
 
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# Connections are kept for DB_CONN_MAX_AGE seconds ('none' for ever) and checked
+# before they're reused; under ASGI, asgi.py makes that 0. Writers take SQLite's write lock when their transaction
+# begins, so a busy database makes them wait, up to SQLITE_BUSY_TIMEOUT, rather
+# than fail with "database is locked" when a read lock can't be upgraded.
+DB_CONN_MAX_AGE = os.environ.get('DB_CONN_MAX_AGE', '600')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': None if DB_CONN_MAX_AGE.lower() == 'none' else int(DB_CONN_MAX_AGE),
+        'CONN_HEALTH_CHECKS': env_bool('DB_CONN_HEALTH_CHECKS', True),
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# Set on every new SQLite connection, see travel_wishlist/db.py
+SQLITE_PRAGMAS = {
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),   # milliseconds
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),   # bytes
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64 * 1024)),   # negative for KiB
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -118,5 +164,145 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# collectstatic copies static files here with hashed names, and gzipped copies
+# (and brotli ones, if the brotli package is installed), which are then served
+# with far-future caching. See travel_wishlist/staticfiles.py.
+STATIC_ROOT = os.environ.get('STATIC_ROOT', BASE_DIR / 'staticfiles')
+
 MEDIA_URL = 'media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Photos are served by a view that checks who owns them, see travel_wishlist/media.py.
+# Set MEDIA_SENDFILE to 'x-accel-redirect' to have nginx send the file from an
+# internal location at MEDIA_INTERNAL_URL, aliased to MEDIA_ROOT, or to
+# 'x-sendfile' for Apache with mod_xsendfile. Unset, Django sends the file.
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+MEDIA_INTERNAL_URL = '/protected-media/'
+
+# Number of places shown on each page of the wishlist and visited lists
+PLACES_PER_PAGE = 50
+
+# Places inserted per transaction by bulk imports, see travel_wishlist/bulk.py
+PLACES_IMPORT_BATCH_SIZE = 1000
+
+# Sorted file of place names suggested in the add place form, see travel_wishlist/autocomplete.py.
+# Rebuild it with manage.py build_gazetteer. Each process also keeps the place names of up
+# to PLACES_AUTOCOMPLETE_USERS recently active users in memory.
+PLACES_GAZETTEER = BASE_DIR / 'travel_wishlist' / 'data' / 'gazetteer.tsv'
+PLACES_AUTOCOMPLETE_USERS = 1000
+
+# The results manage.py benchmark_views compares a run with, by default: queries, errors
+# and statuses for each URL, but no timings, which depend on the machine. Save a new
+# baseline with --save-baseline after a change that's meant to add or remove queries.
+LOADTEST_BASELINE = BASE_DIR / 'travel_wishlist' / 'data' / 'loadtest_baseline.json'
+
+# Widths, in pixels, of the resized copies of uploaded photos used in srcset
+PHOTO_RENDITION_WIDTHS = (160, 640, 1280)
+
+# Uploaded files are streamed to temporary files on disk, see travel_wishlist/uploads.py
+FILE_UPLOAD_HANDLERS = ['travel_wishlist.uploads.BoundedUploadHandler']
+
+# Limits for uploaded photos. Photos are scaled down to fit PHOTO_MAX_DIMENSION
+# and re-encoded in a pool of PHOTO_PROCESSING_WORKERS threads.
+PHOTO_UPLOAD_MAX_BYTES = 25 * 1024 * 1024
+PHOTO_MAX_PIXELS = 50_000_000
+PHOTO_MAX_DIMENSION = 2560
+PHOTO_PROCESSING_WORKERS = 2
+
+# Uploaded photos are stored by content hash, see travel_wishlist/storage.py
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'travel_wishlist.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+    'photos': {
+        'BACKEND': 'travel_wishlist.storage.ContentAddressedStorage',
+    },
+}
+
+# Rendered wishlist and visited pages are cached per user, see travel_wishlist/cache.py.
+# LocMemCache evicts the least recently used pages once MAX_ENTRIES is reached.
+# It is per process, so when running several worker processes use a shared
+# backend, such as FileBasedCache, so every worker sees each version bump.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pages',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    # Sessions, and the users signed in to them, see travel_wishlist/auth.py. This
+    # cache must be shared by every worker process: logging out or changing a
+    # password only clears the entries in it, so a worker with its own copy would
+    # keep the old session and user. A file cache is shared by the workers on one
+    # host; with several hosts, point SESSION_CACHE_BACKEND and SESSION_CACHE_LOCATION
+    # at Redis or Memcached. CachedUserMiddleware refuses to start on a per-process
+    # cache such as LocMemCache unless DEBUG is on. It holds pickled objects, so a
+    # file cache lives in VAR_DIR, not a shared temp directory, and CachedUserMiddleware
+    # refuses to start if anyone else owns or can write to it.
+    'sessions': {
+        'BACKEND': os.environ.get('SESSION_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('SESSION_CACHE_LOCATION', VAR_DIR / 'sessions'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # Rows of the wishlist, each cached until its place changes, see wishlist.html
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    },
+}
+PAGE_CACHE_ALIAS = 'pages'
+
+# Sessions are read from the cache, and written to it and the database
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
+
+# The signed in user is cached for this long, see travel_wishlist/auth.py
+USER_CACHE_ALIAS = 'sessions'
+USER_CACHE_SECONDS = 300
+
+# Request metrics, shown to staff at /metrics, see travel_wishlist/metrics.py.
+# Requests are only recorded for METRICS_ACTIVE_SECONDS after a scrape. Worker
+# processes add what they recorded to the METRICS_DB SQLite file every
+# METRICS_FLUSH_SECONDS, so any worker's /metrics has them all. It lives in VAR_DIR by
+# default, shared by this checkout's workers and no one else. Set METRICS_DB to an empty
+# string for each worker to report only its own requests.
+METRICS_DB = os.environ.get('METRICS_DB', VAR_DIR / 'metrics.sqlite3') or None
+METRICS_ACTIVE_SECONDS = 300
+METRICS_FLUSH_SECONDS = 10
+
+# Staff can profile a request with ?profile or ?profile=sample, see
+# travel_wishlist/profiling.py. Profiles are written to PROFILING_DIR; without
+# it, profiling is off and the middleware is left out.
+PROFILING_DIR = os.environ.get('PROFILING_DIR')
+PROFILING_SAMPLE_INTERVAL = 0.001
+
+# Show the SQL of profiled requests on the console
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'travel_wishlist.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
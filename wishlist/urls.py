@@ -2,13 +2,15 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from django.conf import settings 
+
+from travel_wishlist.media import serve_photo
+from travel_wishlist.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
+    # Photos are checked for ownership, so they're served by a view even in production, see travel_wishlist/media.py
+    path(f'{settings.MEDIA_URL.lstrip("/")}<path:name>', serve_photo, name='media'),
     path('', include('travel_wishlist.urls'))
-]
-
-from django.conf import settings 
-from django.conf.urls.static import static 
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
\ No newline at end of file